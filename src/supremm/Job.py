@@ -1,5 +1,6 @@
 """ Container class for an HPC job """
 import datetime
+import copy
 from collections import OrderedDict
 
 def safe_strptime(time_string, fmt):
@@ -136,6 +137,24 @@ class Job(object):
             if nodedata.archive != None:
                 yield nodename, nodedata.nodeindex, nodedata.archive
 
+    def shards(self, size):
+        """ Split the nodes of the job into shards of at most size nodes. Returns
+        a list with a copy of the job for each shard that only has the nodes in
+        the shard. The node count and node indices are those of the whole job
+        so that the results for the shards can be merged """
+        nodenames = self._nodes.keys()
+        shards = []
+        for start in xrange(0, len(nodenames), size):
+            shard = copy.copy(self)
+            shard._nodes = OrderedDict((x, copy.deepcopy(self._nodes[x])) for x in nodenames[start:start + size])
+            shard._data = {}
+            shard._errors = {}
+            shard._nodebegin = dict(self._nodebegin)
+            shard._nodeend = dict(self._nodeend)
+            shard.jobdir = None
+            shards.append(shard)
+        return shards
+
     def has_any_archives(self):
         """ are there any archives for this job """
 
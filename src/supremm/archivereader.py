@@ -0,0 +1,773 @@
+#!/usr/bin/env python
+""" Native reader for pcp archives. The .meta, .index and data volume files
+    are memory mapped and decoded directly rather than through libpcp. Only
+    version 2 archives are supported.
+
+    ArchiveContext has the subset of the pmapi.pmContext interface that the
+    summarization code uses and this module has the same functions as
+    pcpcinterface, so the two can be used interchangeably. Derived metrics
+    are not supported.
+"""
+
+import bisect
+import heapq
+import mmap
+import os
+import re
+import struct
+
+import numpy
+from pcp import pmapi
+import cpmapi as c_pmapi
+
+PM_LOG_MAGIC = 0x50052600
+PM_LOG_MAGICMASK = 0xFFFFFF00
+PM_LOG_VERS02 = 2
+
+LABEL_SIZE = 132
+
+TYPE_DESC = 1
+TYPE_INDOM = 2
+
+PM_VAL_INSITU = 0
+PM_INDOM_NULL = 0xFFFFFFFF
+
+PM_TYPE_32 = 0
+PM_TYPE_U32 = 1
+PM_TYPE_64 = 2
+PM_TYPE_U64 = 3
+PM_TYPE_FLOAT = 4
+PM_TYPE_DOUBLE = 5
+PM_TYPE_STRING = 6
+
+# on-disk (big endian) format of the values that are stored in the pmValue
+INSITU_FORMATS = {
+    PM_TYPE_32: '>i4',
+    PM_TYPE_U32: '>u4',
+    PM_TYPE_FLOAT: '>f4'
+}
+
+# on-disk (big endian) format and in-memory datatype for each pcp datatype
+VALUE_FORMATS = {
+    PM_TYPE_32: ('>i4', numpy.int64),
+    PM_TYPE_U32: ('>u4', numpy.uint64),
+    PM_TYPE_64: ('>i8', numpy.int64),
+    PM_TYPE_U64: ('>u8', numpy.uint64),
+    PM_TYPE_FLOAT: ('>f4', numpy.float64),
+    PM_TYPE_DOUBLE: ('>f8', numpy.float64)
+}
+
+class ArchiveError(Exception):
+    """ The archive could not be read by the native reader """
+    pass
+
+class Timestamp(object):
+    """ Archive timestamp with the same fields as a struct timeval """
+    def __init__(self, tv_sec, tv_usec):
+        self.tv_sec = tv_sec
+        self.tv_usec = tv_usec
+
+    def __float__(self):
+        return self.tv_sec + self.tv_usec / 1000000.0
+
+    def __str__(self):
+        return str(float(self))
+
+class ArchiveLabel(object):
+    """ The information in the archive label record """
+    def __init__(self, magic, pid, start, vol, hostname, tz):
+        self.magic = magic
+        self.pid = pid
+        self.start = start
+        self.vol = vol
+        self.hostname = hostname
+        self.tz = tz
+
+class ArchiveMetadata(object):
+    """ The metric descriptors, names and instance domains of an archive """
+
+    def __init__(self):
+        self.descs = {}
+        self.names = {}
+        self._indoms = {}
+
+    def addinstances(self, indom, timestamp, instances):
+        """ store the instances of the instance domain from the time """
+        history = self._indoms.setdefault(indom, ([], []))
+        pos = bisect.bisect_right(history[0], timestamp)
+        history[0].insert(pos, timestamp)
+        history[1].insert(pos, instances)
+
+    def gettype(self, pmid):
+        """ returns the pcp datatype of the metric """
+        return self.descs[pmid][0]
+
+    def getindom(self, pmid):
+        """ returns the instance domain of the metric """
+        return self.descs[pmid][1]
+
+    def getinstances(self, indom, timestamp=None):
+        """ returns a dict of instance id to name for the instance domain at
+            the time (or the most recent if timestamp is None). Returns None
+            if the instance domain is not in the archive """
+        if indom not in self._indoms:
+            return None
+        times, instances = self._indoms[indom]
+        if timestamp is None:
+            return instances[-1]
+        return instances[max(bisect.bisect_right(times, timestamp) - 1, 0)]
+
+class ArchiveReader(ArchiveMetadata):
+    """ Parses the files of one archive. archive is the path to the archive
+        without the file suffix. """
+
+    def __init__(self, archive):
+        super(ArchiveReader, self).__init__()
+        self.archive = archive
+        self._files = []
+        self._maps = []
+
+        try:
+            meta = self._open(archive + ".meta")
+            self.label = self._parselabel(meta, -1)
+            self._parsemeta(meta)
+
+            self._volumes = []
+            dirname, basename = os.path.split(archive)
+            for filename in os.listdir(dirname if dirname else "."):
+                mtch = re.match(r"^" + re.escape(basename) + r"\.(\d+)$", filename)
+                if mtch:
+                    self._volumes.append((int(mtch.group(1)), os.path.join(dirname, filename)))
+            self._volumes.sort()
+
+            if len(self._volumes) == 0:
+                raise ArchiveError("no data volumes for {0}".format(archive))
+
+            self._volmaps = []
+            self._volraw = []
+            for volnum, filename in self._volumes:
+                vmap = self._open(filename)
+                self._parselabel(vmap, volnum)
+                self._volmaps.append(vmap)
+                self._volraw.append(numpy.frombuffer(vmap, dtype=numpy.uint8))
+
+            self._index = []
+            if os.path.exists(archive + ".index"):
+                self._parseindex(self._open(archive + ".index"))
+            self._indextimes = [x[0] for x in self._index]
+
+        except (IOError, OSError, ValueError, struct.error) as exc:
+            self.close()
+            raise ArchiveError(str(exc))
+        except ArchiveError:
+            self.close()
+            raise
+
+    def close(self):
+        """ unmap and close all of the files """
+        self._volraw = []
+        for fmap in self._maps:
+            fmap.close()
+        for fptr in self._files:
+            fptr.close()
+        self._maps = []
+        self._files = []
+
+    def _open(self, filename):
+        """ memory map the file """
+        fptr = open(filename, "rb")
+        self._files.append(fptr)
+        if os.fstat(fptr.fileno()).st_size < LABEL_SIZE:
+            raise ArchiveError("{0} is truncated".format(filename))
+        fmap = mmap.mmap(fptr.fileno(), 0, access=mmap.ACCESS_READ)
+        self._maps.append(fmap)
+        return fmap
+
+    @staticmethod
+    def _parselabel(fmap, expectvol):
+        """ parse and check the label record at the start of every file """
+        reclen, magic, pid, sec, usec, vol = struct.unpack_from(">iIiiii", fmap, 0)
+        if reclen != LABEL_SIZE or (magic & PM_LOG_MAGICMASK) != PM_LOG_MAGIC:
+            raise ArchiveError("not a pcp archive")
+        if (magic & 0xFF) != PM_LOG_VERS02:
+            raise ArchiveError("unsupported archive version {0}".format(magic & 0xFF))
+        if vol != expectvol:
+            raise ArchiveError("unexpected volume number {0}".format(vol))
+
+        hostname = fmap[24:88].split("\0")[0]
+        tz = fmap[88:128].split("\0")[0]
+        return ArchiveLabel(magic, pid, Timestamp(sec, usec), vol, hostname, tz)
+
+    def _parsemeta(self, meta):
+        """ read the metric descriptors, names and instance domains """
+        offset = LABEL_SIZE
+        while offset + 8 <= len(meta):
+            reclen, rectype = struct.unpack_from(">ii", meta, offset)
+            if reclen < 12 or offset + reclen > len(meta):
+                # Truncated record at the end of the file
+                break
+
+            if rectype == TYPE_DESC:
+                pmid, dtype, indom, sem, units, numnames = struct.unpack_from(">IiIiIi", meta, offset + 8)
+                self.descs[pmid] = (dtype, indom, sem, units)
+                pos = offset + 32
+                for _ in xrange(numnames):
+                    namelen = struct.unpack_from(">i", meta, pos)[0]
+                    self.names[meta[pos + 4:pos + 4 + namelen]] = pmid
+                    pos += 4 + namelen
+
+            elif rectype == TYPE_INDOM:
+                sec, usec, indom, numinst = struct.unpack_from(">iiIi", meta, offset + 8)
+                insts = struct.unpack_from(">{0}i".format(numinst), meta, offset + 24)
+                stridx = struct.unpack_from(">{0}i".format(numinst), meta, offset + 24 + 4 * numinst)
+                strbase = offset + 24 + 8 * numinst
+                instances = {}
+                for inst, sidx in zip(insts, stridx):
+                    start = strbase + sidx
+                    instances[inst] = meta[start:meta.find("\0", start, offset + reclen)]
+
+                self.addinstances(indom, sec + usec / 1000000.0, instances)
+
+            offset += reclen
+
+    def _parseindex(self, index):
+        """ read the temporal index """
+        volnums = dict((volnum, i) for i, (volnum, _) in enumerate(self._volumes))
+        for offset in xrange(LABEL_SIZE, len(index) - 19, 20):
+            sec, usec, vol, _, dataoffset = struct.unpack_from(">iiiii", index, offset)
+            if vol in volnums:
+                self._index.append((sec + usec / 1000000.0, volnums[vol], dataoffset))
+
+    def records(self, start=None):
+        """ generator that returns (timestamp, valuesets) for each record in
+            the archive in time order. If start is specified then the temporal index
+            is used to skip the records before start. valuesets is a dict of pmid to
+            (numval, instances, values). numval is negative for pcp errors. """
+
+        volidx, offset = 0, LABEL_SIZE
+        if start is not None and len(self._index) > 0:
+            pos = bisect.bisect_right(self._indextimes, start) - 1
+            if pos >= 0:
+                volidx, offset = self._index[pos][1:]
+
+        while volidx < len(self._volmaps):
+            vmap = self._volmaps[volidx]
+            while offset + 20 <= len(vmap):
+                reclen = struct.unpack_from(">i", vmap, offset)[0]
+                if reclen < 20 or offset + reclen > len(vmap):
+                    # Truncated record at the end of the volume
+                    break
+                timestamp, valuesets = self._decoderecord(volidx, offset)
+                offset += reclen
+                if start is None or float(timestamp) >= start:
+                    yield timestamp, valuesets
+
+            volidx += 1
+            offset = LABEL_SIZE
+
+    def _decoderecord(self, volidx, recoffset):
+        """ decode the data record at the offset """
+        vmap = self._volmaps[volidx]
+        sec, usec, numpmid = struct.unpack_from(">iii", vmap, recoffset + 4)
+
+        valuesets = {}
+        pos = recoffset + 16
+        for _ in xrange(numpmid):
+            pmid, numval = struct.unpack_from(">Ii", vmap, pos)
+            pos += 8
+            if numval <= 0:
+                valuesets[pmid] = (numval, numpy.empty(0, dtype=numpy.int64), numpy.empty(0, dtype=numpy.float64))
+                continue
+
+            valfmt = struct.unpack_from(">i", vmap, pos)[0]
+            pairs = numpy.frombuffer(vmap, dtype=">i4", count=2 * numval, offset=pos + 4).reshape(numval, 2)
+            pos += 4 + 8 * numval
+
+            values = self._decodevalues(volidx, recoffset, pmid, valfmt, pairs[:, 1])
+            valuesets[pmid] = (numval, pairs[:, 0].astype(numpy.int64), values)
+
+        return Timestamp(sec, usec), valuesets
+
+    def _decodevalues(self, volidx, recoffset, pmid, valfmt, words):
+        """ convert the value words to an array of values. The words are the
+            values themselves for 32 bit types or the offsets to the value
+            blocks. """
+
+        dtype = self.descs[pmid][0] if pmid in self.descs else None
+
+        if valfmt == PM_VAL_INSITU:
+            if dtype in INSITU_FORMATS:
+                return words.view(INSITU_FORMATS[dtype]).astype(VALUE_FORMATS[dtype][1])
+            return None
+
+        # The value block offsets are in 32 bit words from the start of the
+        # record in pdu format, which has a two word longer header than on disk
+        blockstart = recoffset + (words.astype(numpy.int64) - 2) * 4
+
+        if dtype == PM_TYPE_STRING:
+            vmap = self._volmaps[volidx]
+            strings = []
+            for start in blockstart:
+                vlen = struct.unpack_from(">I", vmap, start)[0] & 0xFFFFFF
+                strings.append(vmap[start + 4:start + vlen].split("\0")[0])
+            return numpy.array(strings, dtype=object)
+
+        if dtype not in VALUE_FORMATS:
+            return None
+
+        fmt, memtype = VALUE_FORMATS[dtype]
+        size = int(fmt[2:])
+        byteidx = (blockstart + 4)[:, numpy.newaxis] + numpy.arange(size)
+        return self._volraw[volidx][byteidx].view(fmt).ravel().astype(memtype)
+
+    def end(self):
+        """ returns the timestamp of the last record in the archive """
+        start = self._indextimes[-1] if len(self._indextimes) > 0 else None
+        last = None
+        for timestamp, _ in self.records(start):
+            last = timestamp
+        return last
+
+def mergerecords(streams):
+    """ generator that merges the (timestamp, valuesets) records from several
+        archives into time order. Records with the same timestamp are combined """
+
+    if len(streams) == 1:
+        for record in streams[0]:
+            yield record
+        return
+
+    keyed = [((float(ts), i, ts, vsets) for ts, vsets in stream) for i, stream in enumerate(streams)]
+
+    pendingtime = None
+    pendingts = None
+    pendingsets = None
+    for fts, _, timestamp, valuesets in heapq.merge(*keyed):
+        if pendingsets is not None and pendingtime == fts:
+            pendingsets.update(valuesets)
+            continue
+        if pendingsets is not None:
+            yield pendingts, pendingsets
+        pendingtime, pendingts, pendingsets = fts, timestamp, dict(valuesets)
+
+    if pendingsets is not None:
+        yield pendingts, pendingsets
+
+class ArchiveSetReader(ArchiveMetadata):
+    """ Presents several archives for the same host as one archive. This is
+        the equivalent of the archive that pmlogextract would create from them.
+        archives is the list of archive paths without the file suffix or of
+        ArchiveReaders. """
+
+    def __init__(self, archives):
+        super(ArchiveSetReader, self).__init__()
+        self.readers = []
+        try:
+            for archive in archives:
+                self.readers.append(archive if isinstance(archive, ArchiveReader) else ArchiveReader(archive))
+        except ArchiveError:
+            self.close()
+            raise
+
+        if len(self.readers) == 0:
+            raise ArchiveError("no archives")
+
+        self.readers.sort(key=lambda x: float(x.label.start))
+        self.label = self.readers[0].label
+
+        for reader in self.readers:
+            self.descs.update(reader.descs)
+            self.names.update(reader.names)
+            for indom, (times, instances) in reader._indoms.iteritems():
+                for timestamp, insts in zip(times, instances):
+                    self.addinstances(indom, timestamp, insts)
+
+    def close(self):
+        """ close all of the archives """
+        for reader in self.readers:
+            reader.close()
+
+    def records(self, start=None):
+        """ generator that returns the records from all of the archives in time
+            order. Records from different archives with the same timestamp are
+            combined. """
+
+        return mergerecords([reader.records(start) for reader in self.readers])
+
+    def end(self):
+        """ returns the timestamp of the last record in any of the archives """
+        ends = [x for x in [reader.end() for reader in self.readers] if x is not None]
+        if len(ends) == 0:
+            return None
+        return max(ends, key=float)
+
+class DecodedArchive(object):
+    """ The records of an archive in the time range [start, end] decoded once
+        so that they can be used by the contexts for several jobs """
+
+    def __init__(self, archive, start=None, end=None):
+        self.reader = ArchiveReader(archive)
+        self.records = []
+        for timestamp, valuesets in self.reader.records(start):
+            if end is not None and float(timestamp) > end:
+                break
+            if len(valuesets) > 0:
+                self.records.append((timestamp, valuesets))
+        self.times = [float(x[0]) for x in self.records]
+
+    def window(self, start=None, end=None):
+        """ returns the list of the records in the time range """
+        first = 0 if start is None else bisect.bisect_left(self.times, start)
+        last = len(self.times) if end is None else bisect.bisect_right(self.times, end)
+        return self.records[first:last]
+
+    def close(self):
+        """ close the archive """
+        self.reader.close()
+
+class SharedArchives(object):
+    """ The decoded archives that are used by the jobs in a batch. The time
+        range and the number of users of each archive are registered with
+        add() before the archives are used. Each archive is decoded on first
+        use and closed when all of the users have called release() """
+
+    def __init__(self):
+        self._ranges = {}
+        self._users = {}
+        self._decoded = {}
+
+    def add(self, archive, start, end):
+        """ register a user of the archive for the time range """
+        if archive in self._ranges:
+            prevstart, prevend = self._ranges[archive]
+            self._ranges[archive] = (min(prevstart, start), max(prevend, end))
+        else:
+            self._ranges[archive] = (start, end)
+        self._users[archive] = self._users.get(archive, 0) + 1
+
+    def get(self, archive):
+        """ returns the DecodedArchive for the archive. Raises ArchiveError if
+            the archive cannot be read """
+        if archive not in self._decoded:
+            start, end = self._ranges[archive]
+            self._decoded[archive] = DecodedArchive(archive, start, end)
+        return self._decoded[archive]
+
+    def release(self, archive):
+        """ called when a user has finished with the archive """
+        self._users[archive] -= 1
+        if self._users[archive] == 0:
+            del self._users[archive]
+            del self._ranges[archive]
+            decoded = self._decoded.pop(archive, None)
+            if decoded is not None:
+                decoded.close()
+
+class ArchiveResult(object):
+    """ Equivalent of a pmResult. valuesets has the (numval, instances, values)
+        for each of the requested metrics in the same order as the request """
+    def __init__(self, timestamp, valuesets):
+        self.timestamp = timestamp
+        self.valuesets = valuesets
+
+    contents = property(lambda x: x)
+
+class ArchiveContext(object):
+    """ Read an archive with the ArchiveReader using the same api as the
+        pmapi.pmContext. archive is either the path to an archive or a list
+        of archive paths or DecodedArchives that are read as if they had been
+        merged with pmlogextract. If start and/or end (seconds since the
+        epoch) are specified then only the records in that time range are
+        used. """
+
+    def __init__(self, archive, start=None, end=None):
+        self._decoded = None
+        if isinstance(archive, basestring):
+            self.reader = ArchiveReader(archive)
+        elif len(archive) > 0 and all(isinstance(x, DecodedArchive) for x in archive):
+            self._decoded = archive
+            self.reader = ArchiveSetReader([x.reader for x in archive])
+        else:
+            self.reader = ArchiveSetReader(archive)
+        self._start = start
+        self._end = end
+        self._records = None
+        self._times = None
+        self._position = 0
+        self._mode = c_pmapi.PM_MODE_FORW
+        self.current = None
+
+    def _loadrecords(self):
+        """ all of the records are decoded on first use and shared by all of
+            the fetch calls """
+        if self._records is None and self._decoded is not None:
+            self._records = list(mergerecords([x.window(self._start, self._end) for x in self._decoded]))
+            self._times = [float(x[0]) for x in self._records]
+
+        if self._records is None:
+            self._records = []
+            for timestamp, valuesets in self.reader.records(self._start):
+                if self._end is not None and float(timestamp) > self._end:
+                    break
+                if len(valuesets) > 0:
+                    self._records.append((timestamp, valuesets))
+            self._times = [float(x[0]) for x in self._records]
+
+    def getrecords(self):
+        """ returns the list of (timestamp, valuesets) for all of the records
+            in the time range """
+        self._loadrecords()
+        return self._records
+
+    def pmGetArchiveLabel(self):
+        """ returns the archive label. The start time is the start of the
+            time range if it is after the start of the archive """
+        label = self.reader.label
+        if self._start is not None and self._start > float(label.start):
+            start = Timestamp(int(self._start), int(round((self._start - int(self._start)) * 1000000)))
+            label = ArchiveLabel(label.magic, label.pid, start, label.vol, label.hostname, label.tz)
+        return label
+
+    def pmGetArchiveEnd(self):
+        """ returns the timestamp of the last record """
+        self._loadrecords()
+        if len(self._records) == 0:
+            return self.reader.label.start
+        return self._records[-1][0]
+
+    def pmSetMode(self, mode, timestamp, delta):
+        """ set the direction and time for the next fetch. Interpolated modes
+            are not supported """
+        self._loadrecords()
+        if mode == c_pmapi.PM_MODE_FORW:
+            self._position = bisect.bisect_left(self._times, float(timestamp))
+        elif mode == c_pmapi.PM_MODE_BACK:
+            self._position = bisect.bisect_right(self._times, float(timestamp)) - 1
+        else:
+            raise pmapi.pmErr(c_pmapi.PM_ERR_MODE)
+        self._mode = mode
+
+    def pmFetch(self, pmids):
+        """ returns the next record in the current direction that has at least
+            one of the metrics """
+        self._loadrecords()
+        step = 1 if self._mode == c_pmapi.PM_MODE_FORW else -1
+
+        while 0 <= self._position < len(self._records):
+            timestamp, valuesets = self._records[self._position]
+            self._position += step
+            if any(pmid in valuesets for pmid in pmids):
+                self.current = timestamp
+                empty = (0, numpy.empty(0, dtype=numpy.int64), numpy.empty(0, dtype=numpy.float64))
+                return ArchiveResult(timestamp, [valuesets.get(pmid, empty) for pmid in pmids])
+
+        raise pmapi.pmErr(c_pmapi.PM_ERR_EOL)
+
+    def pmFreeResult(self, result):
+        """ Results are garbage collected """
+        pass
+
+    def pmRegisterDerived(self, name, expr):
+        """ Derived metrics are not supported """
+        raise pmapi.pmErr(c_pmapi.PM_ERR_NYI)
+
+class MetricCache(object):
+    """ Same interface as the pcpcinterface.MetricCache """
+
+    def __init__(self, context):
+        self.context = context
+        self._lastdescription = {}
+
+    def prime(self, analytics):
+        """ The metadata is read when the archive is opened """
+        pass
+
+    def lookupnames(self, names):
+        """ returns a list with the pmid for each name (None if the metric is
+            not in the archive) """
+        return [self.context.reader.names.get(x) for x in names]
+
+    def gettype(self, pmid):
+        """ returns the datatype of the metric """
+        return self.context.reader.gettype(pmid)
+
+    def getindom(self, pmid):
+        """ returns the instance domain of the metric """
+        return self.context.reader.getindom(pmid)
+
+    def getinstances(self, pmid, refresh=False):
+        """ returns a dict of instance id to name for the metric at the time of
+            the most recent fetch or None if the metric has no instance domain """
+        indom = self.getindom(pmid)
+        if indom == PM_INDOM_NULL:
+            return None
+        timestamp = float(self.context.current) if self.context.current is not None else None
+        return self.context.reader.getinstances(indom, timestamp)
+
+    def getlastdescription(self, key):
+        """ returns the description that was last stored for the key """
+        return self._lastdescription.get(key)
+
+    def setlastdescription(self, key, description):
+        """ store the description for the key """
+        self._lastdescription[key] = description
+
+def getmetricstofetch(context, analytic, cache=None):
+    """ returns the list of metrics requested for the analytic and their names.
+        Raises ArchiveError for analytics that use derived metrics """
+
+    if cache is None:
+        cache = MetricCache(context)
+
+    if len(analytic.derivedMetrics) > 0:
+        raise ArchiveError("derived metrics are not supported")
+
+    metriclist = []
+    metricnames = []
+
+    if len(analytic.requiredMetrics) > 0:
+        if isinstance(analytic.requiredMetrics[0], basestring):
+            alternatives = [analytic.requiredMetrics]
+        else:
+            alternatives = analytic.requiredMetrics
+
+        for reqarray in alternatives:
+            pmids = cache.lookupnames(reqarray)
+            if len(pmids) > 0 and None not in pmids:
+                metriclist += pmids
+                metricnames.extend(reqarray)
+                break
+        else:
+            return [], []
+
+    for optional, pmid in zip(analytic.optionalMetrics, cache.lookupnames(analytic.optionalMetrics)):
+        if pmid is not None:
+            metriclist.append(pmid)
+            metricnames.append(optional)
+
+    return metriclist, metricnames
+
+def getmetrictypes(context, py_metric_ids, cache=None):
+    """ returns a list with the datatype of the provided metric ids """
+    return [context.reader.gettype(pmid) for pmid in py_metric_ids]
+
+def getnumvals(result):
+    """ returns a list with the number of values in each of the value sets in
+        the result """
+    return [x[0] for x in result.valuesets]
+
+def bufferdtype(dtype):
+    """ fetchblock() is not available for the native reader """
+    return None
+
+def extractValues(context, result, py_metric_id_array, mtypes, logerr, vsetidx=None, cache=None):
+    """ returns data, description in the same format as
+        pcpcinterface.extractValues() """
+
+    if cache is None:
+        cache = MetricCache(context)
+
+    data = []
+    description = []
+    allempty = True
+    allreused = True
+
+    numpmid = len(result.valuesets) if vsetidx is None else len(vsetidx)
+
+    for i in xrange(numpmid):
+        k = i if vsetidx is None else vsetidx[i]
+        numval, insts, values = result.valuesets[k]
+
+        if numval == c_pmapi.PM_ERR_VALUE:
+            # Data missing at this timestep
+            return True, True
+        elif numval < 0:
+            logerr("pmError ({0})".format(numval))
+            return None, None
+        elif numval == 0:
+            data.append(numpy.empty(0, dtype=numpy.float64))
+            description.append([numpy.empty(0, dtype=numpy.int64), []])
+            allreused = False
+            continue
+
+        if values is None:
+            logerr("unkown data type on extraction")
+            data.append([])
+        elif values.dtype == object:
+            data.append(numpy.array(values.tolist()))
+            allempty = False
+        else:
+            data.append(values.astype(numpy.float64))
+            allempty = False
+
+        pmid = py_metric_id_array[i]
+        previous = cache.getlastdescription(pmid)
+        if previous is not None and numpy.array_equal(previous[0], insts):
+            description.append(previous)
+            continue
+
+        allreused = False
+
+        instances = cache.getinstances(pmid)
+        if instances is None:
+            if len(data[i]) != 0:
+                description.append([numpy.empty(0, dtype=numpy.int64), []])
+                continue
+            return None, None
+
+        if numval > len(instances):
+            return True, True
+
+        names = []
+        allnamed = True
+        for inst in insts:
+            if inst not in instances:
+                logerr("instance is not pcp archive")
+                allnamed = False
+                continue
+            names.append(instances[inst])
+
+        desc = [insts, names]
+        if allnamed:
+            cache.setlastdescription(pmid, desc)
+        description.append(desc)
+
+    if allempty:
+        return None, None
+
+    # The list is stored when it is built so that the next fetch with the same
+    # instances returns the same object
+    key = tuple(py_metric_id_array)
+    if allreused:
+        previouslist = cache.getlastdescription(key)
+        if previouslist is not None and all(x is y for x, y in zip(previouslist, description)):
+            return data, previouslist
+    cache.setlastdescription(key, description)
+
+    return data, description
+
+def extractpreprocValues(context, result, py_metric_id_array, mtypes, vsetidx=None, cache=None):
+    """ returns data, description in the same format as
+        pcpcinterface.extractpreprocValues() """
+
+    if cache is None:
+        cache = MetricCache(context)
+
+    description = []
+    for pmid in py_metric_id_array:
+        instances = cache.getinstances(pmid)
+        description.append(instances if instances is not None else {})
+
+    data = []
+    numpmid = len(result.valuesets) if vsetidx is None else len(vsetidx)
+    for i in xrange(numpmid):
+        k = i if vsetidx is None else vsetidx[i]
+        numval, insts, values = result.valuesets[k]
+        if numval <= 0:
+            data.append([])
+        elif values is None:
+            data.append([[] for _ in xrange(numval)])
+        else:
+            data.append(zip(values.tolist(), insts.tolist()))
+
+    return numpy.array(data), description
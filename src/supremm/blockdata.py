@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+""" Helper that collects the per-timestep data for plugins that use the
+    process_block() api """
+
+from collections import OrderedDict
+import numpy
+
+class BlockAccumulator(object):
+    """ Remembers the data for every timestep that it was passed and calls
+        the process_block() function of the analytic with all of the data for
+        a node. Has the same interface as the DataCache """
+
+    def __init__(self, name):
+        self.name = name
+        self.mdata = None
+        self.timestamps = []
+        self.rows = []
+        self.columns = None
+        self.names = None
+        self.lastdescription = None
+
+    def process(self, mdata, timestamp, data, description):
+        """ process call """
+
+        if self.columns is None:
+            self.columns = [OrderedDict() for _ in data]
+            self.names = [{} for _ in data]
+
+        instances = []
+        for i, desc in enumerate(description):
+            ids = desc[0]
+            if self.lastdescription is not None and desc is self.lastdescription[i]:
+                # Same instances as the previous timestep
+                instances.append(ids)
+                continue
+
+            if len(ids) != len(data[i]):
+                # Some of the instances could not be identified
+                instances.append(None)
+                continue
+
+            for j, instid in enumerate(ids):
+                if instid not in self.columns[i]:
+                    self.columns[i][instid] = len(self.columns[i])
+                    if j < len(desc[1]):
+                        self.names[i][instid] = desc[1][j]
+            instances.append(ids)
+
+        self.lastdescription = description
+        self.mdata = mdata
+        self.timestamps.append(timestamp)
+        self.rows.append((data, instances))
+
+        return True
+
+    def getblock(self):
+        """ returns the timestamps, values, description for all of the data.
+            The values are a list with a masked array for each metric
+            with dimension (ntimesteps x ninstances). The mask is set for the
+            instances that had no data at a timestep. The description has the
+            same format as the per-timestep description """
+
+        ntimes = len(self.timestamps)
+
+        values = []
+        description = []
+
+        for i, columns in enumerate(self.columns):
+            dtype = numpy.float64
+            for data, _ in self.rows:
+                if len(data[i]) > 0:
+                    dtype = data[i].dtype if data[i].dtype.kind not in "SU" else object
+                    break
+
+            block = numpy.zeros((ntimes, len(columns)), dtype=dtype)
+            mask = numpy.ones((ntimes, len(columns)), dtype=bool)
+
+            for row, (data, instances) in enumerate(self.rows):
+                if instances[i] is None or len(data[i]) == 0:
+                    continue
+                cols = [columns[x] for x in instances[i]]
+                block[row, cols] = data[i]
+                mask[row, cols] = False
+
+            values.append(numpy.ma.masked_array(block, mask))
+            description.append([numpy.array(columns.keys(), dtype=numpy.int64), [self.names[i].get(x) for x in columns]])
+
+        return numpy.array(self.timestamps), values, description
+
+    def docallback(self, analytic):
+        """ call the analytic with all of the data passed to process (if any) """
+        if len(self.timestamps) == 0:
+            return True
+
+        timestamps, values, description = self.getblock()
+        return analytic.process_block(self.mdata, timestamps, values, description)
+
+def concatenateblocks(parts):
+    """ Combine the (timestamps, values, instances) tuples returned by
+        RecordBlock.getrecords() for consecutive blocks from the same archive.
+        Instance columns are only ever added to a block so the columns of an
+        earlier part are a prefix of the columns of the later parts. Returns
+        timestamps, values, instances for all of the records """
+
+    timestamps = numpy.concatenate([x[0] for x in parts])
+    instances = parts[-1][2]
+
+    values = []
+    for i, ids in enumerate(instances):
+        chunks = []
+        for part in parts:
+            chunk = part[1][i]
+            if chunk.shape[1] < len(ids):
+                padding = numpy.ma.masked_all((chunk.shape[0], len(ids) - chunk.shape[1]), dtype=chunk.dtype)
+                chunk = numpy.ma.concatenate([chunk, padding], axis=1)
+            chunks.append(chunk)
+        values.append(numpy.ma.concatenate(chunks))
+
+    return timestamps, values, instances
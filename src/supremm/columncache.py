@@ -0,0 +1,340 @@
+#!/usr/bin/env python
+""" Columnar cache of the decoded archive data for each node of a job. Each
+    cached metric is stored as numpy arrays that are memory mapped when the job
+    is summarized again, so the job can be reprocessed without pmlogextract or
+    decoding the pcp archives.
+
+    The cache for a node is a directory that contains:
+        index.json          the archive label, the metric descriptors, the
+                            instance domains and the metrics that are cached
+        timestamps.npy      the timestamp of each record
+        m<N>.numval.npy     the number of values of the metric in each record
+                            (ABSENT if the metric is not in the record)
+        m<N>.instances.npy  the instance id for each column
+        m<N>.values.npy     the values (nrecords x ninstances)
+        m<N>.valid.npy      whether there is a value in each element
+
+    ColumnContext reads the cache with the same api as the
+    archivereader.ArchiveContext so the archivereader functions are used to
+    extract the data.
+"""
+
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+import numpy
+from pcp import pmapi
+import cpmapi as c_pmapi
+
+from supremm import archivereader
+
+CACHE_VERSION = 1
+
+# numval for records that do not contain the metric
+ABSENT = numpy.iinfo(numpy.int32).min
+
+class ColumnCache(object):
+    """ The directory that contains the cached data for all of the jobs """
+
+    def __init__(self, cachedir):
+        self.cachedir = cachedir
+
+    @staticmethod
+    def fromconfig(config):
+        """ returns the cache from the summary section of the configuration
+            file or None if the cache is not configured """
+        try:
+            summaryconf = config.getsection("summary")
+        except KeyError:
+            return None
+
+        if 'column_cache_dir' not in summaryconf:
+            return None
+
+        return ColumnCache(summaryconf['column_cache_dir'])
+
+    def nodedir(self, job, nodename):
+        """ path to the cache directory for the node in the job """
+        return os.path.join(self.cachedir, str(job.job_pk_id), nodename)
+
+    def covers(self, job, nodename, metricnames):
+        """ returns whether the cache for the node exists and has all of the
+            metrics. Metrics that were not in the archive count as covered """
+        index = readindex(self.nodedir(job, nodename))
+        if index is None:
+            return False
+        known = set(index['metrics'].keys()) | set(index['absent'])
+        return all(x in known for x in metricnames)
+
+    def open(self, job, nodename):
+        """ returns the ColumnContext for the node """
+        return ColumnContext(self.nodedir(job, nodename))
+
+    def store(self, job, nodename, context, metricnames):
+        """ write the cache for the node from an archivereader.ArchiveContext.
+            Any existing cache for the node is replaced """
+
+        nodedir = self.nodedir(job, nodename)
+        parent = os.path.dirname(nodedir)
+
+        tmpdir = None
+        try:
+            if not os.path.isdir(parent):
+                os.makedirs(parent)
+            tmpdir = tempfile.mkdtemp(dir=parent, prefix=".tmp")
+            writecache(tmpdir, context, metricnames)
+
+            if os.path.exists(nodedir):
+                olddir = tempfile.mkdtemp(dir=parent, prefix=".old")
+                os.rename(nodedir, os.path.join(olddir, "cache"))
+                shutil.rmtree(olddir, ignore_errors=True)
+            os.rename(tmpdir, nodedir)
+            tmpdir = None
+        except (OSError, IOError) as exc:
+            logging.warning("Unable to write the column cache for %s %s: %s", job.job_id, nodename, str(exc))
+        finally:
+            if tmpdir is not None:
+                shutil.rmtree(tmpdir, ignore_errors=True)
+
+def readindex(nodedir):
+    """ returns the contents of the index file or None if there is no usable cache """
+    try:
+        with open(os.path.join(nodedir, "index.json"), "r") as fp:
+            index = json.load(fp)
+    except (IOError, ValueError):
+        return None
+
+    if index.get('version') != CACHE_VERSION:
+        return None
+
+    return index
+
+def writecache(outdir, context, metricnames):
+    """ write the data for the metrics from the records of the context """
+
+    reader = context.reader
+    records = context.getrecords()
+    label = context.pmGetArchiveLabel()
+
+    index = {
+        'version': CACHE_VERSION,
+        'label': {
+            'magic': label.magic,
+            'pid': label.pid,
+            'start': [label.start.tv_sec, label.start.tv_usec],
+            'vol': label.vol,
+            'hostname': label.hostname,
+            'tz': label.tz
+        },
+        'metrics': {},
+        'absent': [],
+        'indoms': {}
+    }
+
+    timestamps = numpy.array([float(x[0]) for x in records], dtype=numpy.float64)
+    numpy.save(os.path.join(outdir, "timestamps.npy"), timestamps)
+
+    for name in metricnames:
+        pmid = reader.names.get(name)
+        if pmid is None:
+            index['absent'].append(name)
+            continue
+
+        filename = "m{0}".format(len(index['metrics']))
+        if not writemetric(os.path.join(outdir, filename), pmid, records):
+            # Unsupported data type. The metric is not cached.
+            continue
+
+        dtype, indom, sem, units = reader.descs[pmid]
+        index['metrics'][name] = {'pmid': pmid, 'file': filename, 'type': dtype, 'indom': indom, 'sem': sem, 'units': units}
+
+        if indom != archivereader.PM_INDOM_NULL and str(indom) not in index['indoms']:
+            times, instances = reader._indoms.get(indom, ([], []))
+            index['indoms'][str(indom)] = [[x, sorted(y.iteritems())] for x, y in zip(times, instances)]
+
+    # The index is written last so that a partial cache is never used
+    with open(os.path.join(outdir, "index.json"), "w") as fp:
+        json.dump(index, fp)
+
+def writemetric(basepath, pmid, records):
+    """ write the arrays for one metric. Returns False if the datatype of
+        the metric is not supported """
+
+    numval = numpy.empty(len(records), dtype=numpy.int32)
+    columns = {}
+    instances = []
+    memtype = None
+
+    for i, (_, valuesets) in enumerate(records):
+        if pmid not in valuesets:
+            numval[i] = ABSENT
+            continue
+        count, insts, values = valuesets[pmid]
+        numval[i] = count
+        if count <= 0:
+            continue
+        if values is None:
+            return False
+        if memtype is None:
+            memtype = values.dtype
+        for inst in insts:
+            if inst not in columns:
+                columns[inst] = len(instances)
+                instances.append(inst)
+
+    if memtype is None:
+        memtype = numpy.dtype(numpy.float64)
+
+    strings = memtype == numpy.dtype(object)
+    if strings:
+        # Fixed length strings so that the array can be memory mapped
+        width = max([1] + [len(v) for _, vsets in records if pmid in vsets and vsets[pmid][0] > 0 for v in vsets[pmid][2]])
+        memtype = numpy.dtype("S{0}".format(width))
+
+    values = numpy.zeros((len(records), len(instances)), dtype=memtype)
+    valid = numpy.zeros((len(records), len(instances)), dtype=numpy.bool_)
+
+    for i, (_, valuesets) in enumerate(records):
+        if numval[i] <= 0:
+            continue
+        _, insts, vals = valuesets[pmid]
+        cols = [columns[x] for x in insts]
+        values[i, cols] = vals
+        valid[i, cols] = True
+
+    numpy.save(basepath + ".numval.npy", numval)
+    numpy.save(basepath + ".instances.npy", numpy.array(instances, dtype=numpy.int64))
+    numpy.save(basepath + ".values.npy", values)
+    numpy.save(basepath + ".valid.npy", valid)
+
+    return True
+
+class ColumnMetadata(archivereader.ArchiveMetadata):
+    """ The metric descriptors, names and instance domains from the index """
+
+    def __init__(self, index):
+        super(ColumnMetadata, self).__init__()
+
+        lbl = index['label']
+        self.label = archivereader.ArchiveLabel(lbl['magic'], lbl['pid'], archivereader.Timestamp(*lbl['start']),
+                                                lbl['vol'], str(lbl['hostname']), str(lbl['tz']))
+
+        for name, metric in index['metrics'].iteritems():
+            self.names[str(name)] = metric['pmid']
+            self.descs[metric['pmid']] = (metric['type'], metric['indom'], metric['sem'], metric['units'])
+
+        for indom, history in index['indoms'].iteritems():
+            for timestamp, instances in history:
+                self.addinstances(int(indom), timestamp, dict((inst, str(name)) for inst, name in instances))
+
+class ColumnContext(object):
+    """ Read the cached data for a node using the same api as the
+        archivereader.ArchiveContext """
+
+    def __init__(self, nodedir):
+        index = readindex(nodedir)
+        if index is None:
+            raise archivereader.ArchiveError("no column cache in {0}".format(nodedir))
+
+        self.nodedir = nodedir
+        self.reader = ColumnMetadata(index)
+        self.timestamps = numpy.load(os.path.join(nodedir, "timestamps.npy"), mmap_mode='r')
+
+        self.columns = {}
+        for metric in index['metrics'].itervalues():
+            basepath = os.path.join(nodedir, metric['file'])
+            self.columns[metric['pmid']] = (numpy.load(basepath + ".numval.npy", mmap_mode='r'),
+                                            numpy.load(basepath + ".instances.npy"),
+                                            numpy.load(basepath + ".values.npy", mmap_mode='r'),
+                                            numpy.load(basepath + ".valid.npy", mmap_mode='r'))
+
+        self._fetchable = {}
+        self._position = 0
+        self._mode = c_pmapi.PM_MODE_FORW
+        self.current = None
+
+    def _timestamp(self, row):
+        """ the archivereader.Timestamp for the record """
+        value = float(self.timestamps[row])
+        sec = int(value)
+        return archivereader.Timestamp(sec, int(round((value - sec) * 1000000)))
+
+    def pmGetArchiveLabel(self):
+        """ returns the archive label """
+        return self.reader.label
+
+    def pmGetArchiveEnd(self):
+        """ returns the timestamp of the last record """
+        if len(self.timestamps) == 0:
+            return self.reader.label.start
+        return self._timestamp(len(self.timestamps) - 1)
+
+    def pmSetMode(self, mode, timestamp, delta):
+        """ set the direction and time for the next fetch. Interpolated modes
+            are not supported """
+        if mode == c_pmapi.PM_MODE_FORW:
+            self._position = numpy.searchsorted(self.timestamps, float(timestamp), 'left')
+        elif mode == c_pmapi.PM_MODE_BACK:
+            self._position = numpy.searchsorted(self.timestamps, float(timestamp), 'right') - 1
+        else:
+            raise pmapi.pmErr(c_pmapi.PM_ERR_MODE)
+        self._mode = mode
+
+    def pmFetch(self, pmids):
+        """ returns the next record in the current direction that has at least
+            one of the metrics """
+
+        key = tuple(pmids)
+        if key not in self._fetchable:
+            present = numpy.zeros(len(self.timestamps), dtype=numpy.bool_)
+            for pmid in pmids:
+                if pmid in self.columns:
+                    present |= self.columns[pmid][0] != ABSENT
+            self._fetchable[key] = numpy.flatnonzero(present)
+        rows = self._fetchable[key]
+
+        if self._mode == c_pmapi.PM_MODE_FORW:
+            i = numpy.searchsorted(rows, self._position, 'left')
+            if i == len(rows):
+                raise pmapi.pmErr(c_pmapi.PM_ERR_EOL)
+            row = rows[i]
+            self._position = row + 1
+        else:
+            i = numpy.searchsorted(rows, self._position, 'right') - 1
+            if i < 0:
+                raise pmapi.pmErr(c_pmapi.PM_ERR_EOL)
+            row = rows[i]
+            self._position = row - 1
+
+        timestamp = self._timestamp(row)
+        self.current = timestamp
+
+        valuesets = []
+        for pmid in pmids:
+            if pmid not in self.columns or self.columns[pmid][0][row] == ABSENT:
+                valuesets.append((0, numpy.empty(0, dtype=numpy.int64), numpy.empty(0, dtype=numpy.float64)))
+                continue
+
+            numval, instances, values, valid = self.columns[pmid]
+            if numval[row] <= 0:
+                valuesets.append((int(numval[row]), numpy.empty(0, dtype=numpy.int64), numpy.empty(0, dtype=numpy.float64)))
+                continue
+
+            mask = numpy.asarray(valid[row])
+            rowvalues = numpy.asarray(values[row][mask])
+            if rowvalues.dtype.kind == 'S':
+                rowvalues = numpy.array(rowvalues.tolist(), dtype=object)
+            valuesets.append((int(numval[row]), instances[mask], rowvalues))
+
+        return archivereader.ArchiveResult(timestamp, valuesets)
+
+    def pmFreeResult(self, result):
+        """ Results are garbage collected """
+        pass
+
+    def pmRegisterDerived(self, name, expr):
+        """ Derived metrics are not supported """
+        raise pmapi.pmErr(c_pmapi.PM_ERR_NYI)
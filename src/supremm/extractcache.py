@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+""" Persistent cache of the job-level archives that are created by pmlogextract.
+    The cached archives are keyed by a fingerprint of the inputs to pmlogextract
+    so that reprocessing a job can reuse the archives from the previous run. The
+    total size of the cache is limited and the least recently used archives are
+    removed first.
+"""
+
+import errno
+import hashlib
+import logging
+import os
+import re
+import shutil
+import tempfile
+
+class ExtractCache(object):
+    """ Directory of cached job-level archives. Each entry is a subdirectory
+        named by the fingerprint that contains the archive files. The
+        modification time of the subdirectory is the time it was last used.
+        The size of the cache is tracked as entries are added so that the
+        cache directory is only scanned when the size exceeds the limit. Entries
+        added by other processes are not counted until the next scan so a cache
+        that is shared by several processes may exceed the limit in between """
+
+    ARCHIVE_NAME = "archive"
+
+    def __init__(self, cachedir, maxbytes):
+        self.cachedir = cachedir
+        self.maxbytes = maxbytes
+        self._size = None
+
+        if not os.path.isdir(cachedir):
+            try:
+                os.makedirs(cachedir)
+            except OSError as exc:
+                if exc.errno != errno.EEXIST:
+                    raise
+
+    @staticmethod
+    def fromconfig(config):
+        """ returns the cache from the summary section of the configuration
+            file or None if the cache is not configured """
+        try:
+            summaryconf = config.getsection("summary")
+        except KeyError:
+            return None
+
+        if 'extract_cache_dir' not in summaryconf:
+            return None
+
+        try:
+            return ExtractCache(summaryconf['extract_cache_dir'], int(summaryconf.get('extract_cache_max_bytes', 10 * 1024 ** 3)))
+        except OSError as exc:
+            logging.warning("Unable to use the extract cache %s: %s", summaryconf['extract_cache_dir'], str(exc))
+            return None
+
+    @staticmethod
+    def fingerprint(nodename, archives, begin, end, metrics=None):
+        """ returns the key for the archive that pmlogextract would create
+            from the raw archives for the time range. The size and modification
+            time of all of the raw archive files (including each data volume)
+            are included so that the key changes if data are appended to an
+            archive or a new volume is added """
+
+        digest = hashlib.sha1()
+        digest.update(nodename)
+        digest.update(begin.isoformat())
+        digest.update(end.isoformat())
+
+        for archive in archives:
+            digest.update(archive)
+            try:
+                for suffix, path in sorted(ExtractCache._archivefiles(archive)):
+                    stat = os.stat(path)
+                    digest.update("{0} {1} {2}".format(suffix, stat.st_size, stat.st_mtime))
+            except OSError:
+                digest.update("missing")
+
+        if metrics:
+            digest.update("\n".join(metrics))
+
+        return digest.hexdigest()
+
+    @staticmethod
+    def _archivefiles(archive):
+        """ returns the list of (suffix, path) for the files of the archive """
+        dirname, basename = os.path.split(archive)
+        files = []
+        for filename in os.listdir(dirname or "."):
+            mtch = re.match(r"^" + re.escape(basename) + r"(\.(?:meta|index|\d+))$", filename)
+            if mtch:
+                files.append((mtch.group(1), os.path.join(dirname, filename)))
+        return files
+
+    @staticmethod
+    def _linkorcopy(src, dest):
+        """ hard link the file if possible, otherwise copy it """
+        try:
+            os.link(src, dest)
+        except OSError:
+            shutil.copy2(src, dest)
+
+    def fetch(self, key, archive):
+        """ create the archive from the cache entry. Returns whether the
+            entry was in the cache """
+
+        entrydir = os.path.join(self.cachedir, key)
+        try:
+            files = self._archivefiles(os.path.join(entrydir, self.ARCHIVE_NAME))
+            if len(files) == 0:
+                return False
+            for suffix, path in files:
+                self._linkorcopy(path, archive + suffix)
+            os.utime(entrydir, None)
+        except (OSError, IOError) as exc:
+            if getattr(exc, 'errno', None) != errno.ENOENT:
+                logging.warning("Extract cache entry %s could not be used: %s", key, str(exc))
+            return False
+
+        return True
+
+    def store(self, key, archive):
+        """ add the archive to the cache and remove the least recently used
+            entries if the cache is larger than the limit """
+
+        entrydir = os.path.join(self.cachedir, key)
+        if os.path.exists(entrydir):
+            return
+
+        tmpdir = None
+        try:
+            # The entry is created under a temporary name and renamed so that
+            # other processes never see a partial entry
+            tmpdir = tempfile.mkdtemp(dir=self.cachedir, prefix=".tmp")
+            size = 0
+            for suffix, path in self._archivefiles(archive):
+                self._linkorcopy(path, os.path.join(tmpdir, self.ARCHIVE_NAME + suffix))
+                size += os.path.getsize(path)
+            os.rename(tmpdir, entrydir)
+            tmpdir = None
+        except (OSError, IOError) as exc:
+            logging.warning("Unable to add %s to the extract cache: %s", archive, str(exc))
+            return
+        finally:
+            if tmpdir is not None:
+                shutil.rmtree(tmpdir, ignore_errors=True)
+
+        if self._size is None:
+            self.evict()
+            return
+
+        self._size += size
+        if self._size > self.maxbytes:
+            self.evict()
+
+    def evict(self):
+        """ remove the least recently used entries until the total size of the
+            cache is within the limit and reset the tracked size to the size
+            of the remaining entries """
+
+        entries = []
+        total = 0
+        for key in os.listdir(self.cachedir):
+            if key.startswith("."):
+                continue
+            entrydir = os.path.join(self.cachedir, key)
+            try:
+                size = sum(os.path.getsize(os.path.join(entrydir, x)) for x in os.listdir(entrydir))
+                entries.append((os.path.getmtime(entrydir), size, entrydir))
+                total += size
+            except OSError:
+                # Removed by another process
+                continue
+
+        entries.sort()
+        for _, size, entrydir in entries:
+            if total <= self.maxbytes:
+                break
+            shutil.rmtree(entrydir, ignore_errors=True)
+            total -= size
+
+        self._size = total
@@ -12,6 +12,7 @@ import cpmapi as c_pmapi
 import time
 
 from supremm.config import Config
+from supremm import archivereader
 from supremm.scripthelpers import parsetime, setuplogger
 
 from supremm.account import DbArchiveCache
@@ -53,7 +54,8 @@ class TimezoneAdjuster(object):
 class PcpArchiveProcessor(object):
     """ Parses a pcp archive and adds the archive information to the index """
 
-    def __init__(self, resconf):
+    def __init__(self, resconf, archive_reader="pmapi"):
+        self.archive_reader = archive_reader
         self.hostname_mode = resconf['hostname_mode']
         if self.hostname_mode == "fqdn":
             self.hostnameext = resconf['host_name_ext']
@@ -82,13 +84,19 @@ class PcpArchiveProcessor(object):
             records and hostname. Store this in the DbArchiveCache
         """
         start_timestamp = None
+        nativedata = None
         if fast_index:
             start_timestamp = self.get_archive_data_fast(archive)
+        if start_timestamp is None and self.archive_reader == "native":
+            nativedata = self.get_archive_data_native(archive)
 
         if start_timestamp is not None:
             hostname = host_from_path
             end_timestamp = start_timestamp
 
+        elif nativedata is not None:
+            hostname, start_timestamp, end_timestamp = nativedata
+
         else:
             # fallback implementation that opens the archive
             try:
@@ -116,6 +124,26 @@ class PcpArchiveProcessor(object):
 
         return hostname, archive[:-6], start_timestamp, end_timestamp, jobid
 
+    @staticmethod
+    def get_archive_data_native(arch_path):
+        """ Read the hostname and the timestamps of the first and last records
+            with the native archive reader. Returns None if the archive cannot
+            be read this way """
+        basename = arch_path[:-6] if arch_path.endswith(".index") else arch_path
+        try:
+            reader = archivereader.ArchiveReader(basename)
+        except archivereader.ArchiveError as exc:
+            logging.debug("archive %s not readable by the native reader: %s", arch_path, str(exc))
+            return None
+
+        try:
+            end_timestamp = reader.end()
+            if end_timestamp is None:
+                return None
+            return reader.label.hostname, float(reader.label.start), float(end_timestamp)
+        finally:
+            reader.close()
+
     def get_archive_data_fast(self, arch_path):
         arch_name = os.path.basename(arch_path)
         match = JOB_ARCHIVE_RE.match(arch_name)
@@ -443,6 +471,11 @@ def runindexing():
 
     config = Config(opts['config'])
 
+    try:
+        archive_reader = config.getsection("summary").get("archive_reader", "pmapi")
+    except KeyError:
+        archive_reader = "pmapi"
+
     logging.info("archive indexer starting")
 
     pool = None
@@ -456,7 +489,7 @@ def runindexing():
             if not resource.get('pcp_log_dir'):
                 continue
 
-            acache = PcpArchiveProcessor(resource)
+            acache = PcpArchiveProcessor(resource, archive_reader)
             afind = PcpArchiveFinder(opts['mindate'], opts['maxdate'], opts['all'])
             if pool is not None:
                 index_resource_multiprocessing(config, resource, acache, afind, pool, keep_csv, dry_run)
@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+""" Checkpoint journal for long running summarization jobs. The journal is an
+    append-only file that records the jobs that have been summarized and the
+    watermark for each resource. A run that is restarted with the same journal
+    resumes the query at the watermark and skips the jobs that were completed.
+    The journal entries are written in batches so an interrupted run may redo
+    the jobs that were completed after the last write. The jobs that end before
+    the watermark are not read again so their entries are dropped and the file
+    is compacted when most of its entries have been dropped.
+"""
+
+import logging
+import os
+import threading
+
+
+def prunecompleted(completed, watermark):
+    """ remove the jobs that end before the watermark from the dict of
+        completed job id to end time """
+    for jobid in [x for x, endtime in completed.iteritems() if endtime < watermark]:
+        del completed[jobid]
+
+
+class Journal(object):
+    """ Append-only journal file. Each line is either
+            done RESOURCE_ID JOB_ID END_TIME
+        for a completed job or
+            watermark RESOURCE_ID END_TIME
+        when the watermark for a resource changes. Lines that are incomplete
+        because a write was interrupted are ignored """
+
+    def __init__(self, path, flushsize=100):
+        self.path = path
+        self.flushsize = flushsize
+        self._completed = {}
+        self._watermarks = {}
+        self._resources = []
+        self._lines = []
+        self._filelines = 0
+        self._lock = threading.Lock()
+
+        self._load()
+
+    def _load(self):
+        """ read the entries from a previous run """
+        if not os.path.exists(self.path):
+            return
+
+        with open(self.path, "r") as fp:
+            for line in fp:
+                self._filelines += 1
+                if not line.endswith("\n"):
+                    continue
+                fields = line.split()
+                if len(fields) == 4 and fields[0] == "done":
+                    self._completed.setdefault(fields[1], {})[fields[2]] = int(fields[3])
+                elif len(fields) == 3 and fields[0] == "watermark":
+                    self._watermarks[fields[1]] = int(fields[2])
+
+        for resource_id, watermark in self._watermarks.iteritems():
+            prunecompleted(self._completed.get(resource_id, {}), watermark)
+
+        logging.info("Journal %s has %s completed jobs", self.path, sum(len(x) for x in self._completed.itervalues()))
+
+        if self._filelines > len(self._watermarks) + sum(len(x) for x in self._completed.itervalues()):
+            self._compact()
+
+    def resource(self, resource_id):
+        """ returns the journal for the jobs on a resource """
+        resource_id = str(resource_id)
+        journal = ResourceJournal(self, resource_id, self._completed.setdefault(resource_id, {}), self._watermarks.get(resource_id))
+        self._resources.append(journal)
+        return journal
+
+    def write(self, line):
+        """ add an entry. The entries are written once there are flushsize of them """
+        with self._lock:
+            self._lines.append(line)
+            if len(self._lines) < self.flushsize:
+                return
+        self.flush()
+
+    def flush(self):
+        """ write the pending entries and the watermarks that have changed. The
+            completed jobs that end before the watermark are dropped and the
+            file is compacted once it has more than twice as many lines as
+            there are entries """
+        with self._lock:
+            lines = self._lines
+            self._lines = []
+            for journal in self._resources:
+                watermark = journal.watermark
+                if watermark != None and watermark != self._watermarks.get(journal.resource_id):
+                    lines.append("watermark {0} {1}".format(journal.resource_id, watermark))
+                    self._watermarks[journal.resource_id] = watermark
+                    journal.prune(watermark)
+
+            if len(lines) == 0:
+                return
+
+            with open(self.path, "a") as fp:
+                fp.write("".join(x + "\n" for x in lines))
+                fp.flush()
+                os.fsync(fp.fileno())
+            self._filelines += len(lines)
+
+            entries = len(self._watermarks) + sum(len(x) for x in self._completed.itervalues())
+            if self._filelines > 2 * entries:
+                self._compact()
+
+    def _compact(self):
+        """ replace the file with one that only has the current entries. The
+            new file is renamed over the old one so that an interrupted write
+            does not lose the entries """
+        lines = ["watermark {0} {1}".format(x, y) for x, y in sorted(self._watermarks.iteritems())]
+        for resource_id, completed in sorted(self._completed.iteritems()):
+            lines.extend("done {0} {1} {2}".format(resource_id, x, y) for x, y in sorted(completed.items()))
+
+        tmppath = self.path + ".tmp"
+        with open(tmppath, "w") as fp:
+            fp.write("".join(x + "\n" for x in lines))
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.rename(tmppath, self.path)
+
+        logging.debug("Compacted journal %s from %s to %s lines", self.path, self._filelines, len(lines))
+        self._filelines = len(lines)
+
+    def close(self):
+        """ write any pending entries """
+        self.flush()
+
+
+class ResourceJournal(object):
+    """ The journal for the jobs on one resource. The watermark is the end
+        time of the earliest job that has been read and not completed, or the
+        end time of the last job that was read if all of them are completed.
+        The jobs must be read in order of end time """
+
+    def __init__(self, journal, resource_id, completed, watermark):
+        self._journal = journal
+        self.resource_id = resource_id
+        self._completed = completed
+        self.watermark = watermark
+        self._outstanding = {}
+        self._lastread = None
+        self._lock = threading.Lock()
+
+    def track(self, jobs):
+        """ yields the jobs that have not been completed and records them
+            as outstanding """
+        for job in jobs:
+            jobid = str(job.job_pk_id)
+            with self._lock:
+                if jobid in self._completed:
+                    logging.debug("Skipping %s, completed in journal", job.job_id)
+                    continue
+                self._outstanding[jobid] = job.acct['end_time']
+                if self._lastread is None or job.acct['end_time'] > self._lastread:
+                    self._lastread = job.acct['end_time']
+            yield job
+
+    def done(self, job):
+        """ record that a job has been completed """
+        jobid = str(job.job_pk_id)
+        with self._lock:
+            endtime = self._outstanding.pop(jobid, job.acct['end_time'])
+            self._completed[jobid] = endtime
+            if len(self._outstanding) > 0:
+                self.watermark = min(self._outstanding.itervalues())
+            elif self._lastread != None:
+                self.watermark = self._lastread
+
+        self._journal.write("done {0} {1} {2}".format(self.resource_id, jobid, endtime))
+
+    def prune(self, watermark):
+        """ forget the completed jobs that end before the watermark. The jobs
+            are read from the watermark so these jobs are not read again """
+        with self._lock:
+            prunecompleted(self._completed, watermark)
+
+
+class NullJournal(object):
+    """ Used when there is no journal. Does not record anything """
+
+    watermark = None
+
+    def resource(self, resource_id):
+        return self
+
+    def track(self, jobs):
+        return jobs
+
+    def done(self, job):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
@@ -80,6 +80,14 @@ class FileOutput(object):
             self._jsonarray.append(summary)
             self._jsonarray.append(mdata)
 
+    def getversions(self, job):
+        """ previous results are not read back from the file """
+        return {}
+
+    def update(self, summary, mdata):
+        """ partial summaries are written in the same way as full ones """
+        self.process(summary, mdata)
+
     def __exit__(self, exception_type, exception_val, trace):
         if self._fragjson:
             self._fragfile.close()
@@ -117,6 +125,72 @@ class MongoOutput(object):
 
         self._outdb[self._collection].update({"_id": summary["_id"]}, summary, upsert=True)
 
+    def getversions(self, job):
+        """ returns the versions of the plugins and preprocessors that were used
+            for the existing summary of the job keyed by class name. Summaries
+            that were created before the versions were recorded by class name
+            have no versions so all of the plugins are run for them """
+
+        mongoid = str(job.job_id) + '-' + str(job.acct['end_time'])
+        doc = self._outdb[self._collection].find_one({"_id": mongoid}, {"summarization.plugins": 1})
+        if doc is None:
+            return {}
+
+        plugins = doc.get('summarization', {}).get('plugins', {})
+        return dict((name, info['version']) for name, info in plugins.iteritems() if isinstance(info, dict))
+
+    def update(self, summary, mdata):
+        """ merge the summary from a subset of the plugins into the existing
+            summary and timeseries documents. The output of each plugin that was
+            run replaces the previous output of that plugin and the output of
+            the other plugins is left unchanged """
+
+        mongoid = str(summary['acct']['id']) + '-' + str(summary['acct']['end_time'])
+        summary['summarization'].update(mdata)
+
+        plugins = summary['summarization'].pop('plugins', {})
+        timeseries = summary.pop('timeseries', None)
+
+        docset = {}
+        for key, value in summary.iteritems():
+            if key in ('summarization', 'errors'):
+                for subkey, subvalue in value.iteritems():
+                    docset[key + '.' + subkey] = subvalue
+            else:
+                docset[key] = value
+        for name, info in plugins.iteritems():
+            docset['summarization.plugins.' + name] = info
+
+        # The plugins that were run and no longer produce output have their
+        # previous output removed. Only the key that each plugin writes is
+        # removed since the other plugins may use the same name
+        docunset = {}
+        tsunset = {}
+        for info in plugins.itervalues():
+            output = info['output']
+            if output is None:
+                continue
+            if output.startswith("timeseries."):
+                name = output[len("timeseries."):]
+                if timeseries is None or name not in timeseries:
+                    tsunset[name] = ""
+            elif output not in summary:
+                docunset[output] = ""
+
+        docupdate = {"$set": docset}
+        if len(docunset) > 0:
+            docupdate["$unset"] = docunset
+
+        if timeseries is not None:
+            tsupdate = {"$set": timeseries}
+            if len(tsunset) > 0:
+                tsupdate["$unset"] = tsunset
+            self._outdb[self._timeseries].update({"_id": mongoid}, tsupdate, upsert=True)
+        elif len(tsunset) > 0:
+            self._outdb[self._timeseries].update({"_id": mongoid}, {"$unset": tsunset})
+
+        self._outdb[self._collection].update({"_id": mongoid}, docupdate, upsert=True)
+
     def __exit__(self, exception_type, exception_val, trace):
         if self._client != None:
             self._outdb = None
@@ -141,6 +215,14 @@ class StdoutOutput(object):
         print(self._resid, json.dumps(summary, default=str, indent=4))
         print("MDATA: ", json.dumps(mdata, default=str, indent=4))
 
+    def getversions(self, job):
+        """ there are no previous results """
+        return {}
+
+    def update(self, summary, mdata):
+        """ partial summaries are printed in the same way as full ones """
+        self.process(summary, mdata)
+
     def __exit__(self, exception_type, exception_val, trace):
         pass
 
@@ -156,5 +238,11 @@ class NullOutput(object):
     def process(self, summary, mdata):
         pass
 
+    def getversions(self, job):
+        return {}
+
+    def update(self, summary, mdata):
+        pass
+
     def __exit__(self, exception_type, exception_val, trace):
         pass
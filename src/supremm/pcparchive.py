@@ -4,17 +4,23 @@
 """
 import logging
 import datetime
+import calendar
 import os
 import shutil
 import subprocess
 import math
 import time
 import traceback
+import itertools
+import re
+from multiprocessing.pool import ThreadPool
 
 from pcp import pmapi
 import cpmapi as c_pmapi
 
 from supremm.pypmlogextract import pypmlogextract
+from supremm import archivereader
+from supremm.extractcache import ExtractCache
 
 def get_datetime_from_timeval(tv):
     """
@@ -31,6 +37,11 @@ def get_datetime_from_timeval(tv):
     dt = dt.replace(microsecond=tv.tv_usec)
     return dt
 
+def get_timeval_from_timestamp(timestamp):
+    """ returns the pmapi.timeval for a time in seconds since the epoch """
+    sec = int(timestamp)
+    return pmapi.timeval(sec, int(round((timestamp - sec) * 1000000)))
+
 def adjust_job_start_end(job):
     """ Set the job node start and end times based on the presence of the special
      job-X-begin and job-X-end archives. Do nothing if these archives are absent.
@@ -82,16 +93,142 @@ def get_datetime_from_pmResult(result):
     """
     return get_datetime_from_timeval(result.contents.timestamp)
 
-def extract_and_merge_logs(job, conf, resconf, opts):
+def extract_and_merge_logs(job, conf, resconf, opts, metrics=None):
     """ merge all of the raw pcp archives into one archive per node for each
-        node in the job """
+        node in the job. If metrics is specified then only those metrics are
+        copied to the job archives """
+
+    adjust_job_start_end(job)
+
+    return pmlogextract(job, conf, resconf, opts, metrics)
+
+def getextractmetrics(analytics):
+    """ returns the sorted list of the names of all of the metrics that
+        the plugins and preprocessors could request from an archive. This
+        includes all of the alternatives for the required metrics and the
+        metrics used in the derived metric formulae """
+
+    metrics = set()
+    for analytic in analytics:
+        for required in analytic.requiredMetrics:
+            if isinstance(required, basestring):
+                metrics.add(required)
+            else:
+                metrics.update(required)
+        metrics.update(analytic.optionalMetrics)
+        for derived in analytic.derivedMetrics:
+            metrics.update(re.findall(r"[A-Za-z_]\w*(?:\.\w+)+", derived['formula']))
+
+    return sorted(metrics)
+
+def archivemetrics(archives, metrics):
+    """ returns the metrics from the list that are in the metadata of any of the
+        archives. pmlogextract warns about the metrics in the configuration
+        that are not in the archives, so only these metrics are selected. A
+        name may be a non-leaf node of the namespace. Returns None if the
+        metadata could not be read """
+
+    names = set()
+    for archive in archives:
+        try:
+            reader = archivereader.ArchiveReader(archive)
+        except archivereader.ArchiveError as exc:
+            logging.debug("Unable to read the metric names from %s: %s", archive, str(exc))
+            return None
+        try:
+            for name in reader.names:
+                parts = name.split(".")
+                names.update(".".join(parts[:x]) for x in xrange(1, len(parts) + 1))
+        finally:
+            reader.close()
+
+    return [x for x in metrics if x in names]
+
+def writeextractconfig(jobdir, metrics, nodename=None):
+    """ write the pmlogextract configuration file that selects the metrics
+        and return its path. The file is for one node if nodename is set """
+
+    configfile = os.path.join(jobdir, "pmlogextract.config" if nodename is None else "pmlogextract-{0}.config".format(nodename))
+    with open(configfile, "w") as fp:
+        for metric in metrics:
+            fp.write(metric + "\n")
+
+    return configfile
+
+
+def get_timestamp_from_datetime(dt):
+    """ Converts a naive UTC datetime object into seconds since the epoch """
+    return calendar.timegm(dt.utctimetuple()) + dt.microsecond / 1000000.0
+
+class RawArchiveSet(object):
+    """ The raw pcp archives for a node in a job and the time range of the job
+        on the node. This is used in place of the path to a pmlogextract
+        generated archive when the raw archives are read directly. shared is
+        set to the archivereader.SharedArchives when the decoded archives are
+        shared with other jobs """
+    def __init__(self, archives, begin, end):
+        self.archives = list(archives)
+        self.begin = begin
+        self.end = end
+        self.shared = None
+
+    start_timestamp = property(lambda x: get_timestamp_from_datetime(x.begin))
+    end_timestamp = property(lambda x: get_timestamp_from_datetime(x.end))
+
+    def __str__(self):
+        return ",".join(self.archives)
+
+class BoundedContext(object):
+    """ Wrapper for a libpcp multi-archive context that only returns the
+        records in the time range [start, end] """
+    def __init__(self, archiveset):
+        self._context = pmapi.pmContext(c_pmapi.PM_CONTEXT_ARCHIVE, str(archiveset))
+        self.start = archiveset.start_timestamp
+        self.end = archiveset.end_timestamp
+        self._mode = c_pmapi.PM_MODE_FORW
+
+    def pmGetArchiveEnd(self):
+        """ returns the earlier of the end of the archives and the end of the time range """
+        archiveend = self._context.pmGetArchiveEnd()
+        if float(archiveend) > self.end:
+            return get_timeval_from_timestamp(self.end)
+        return archiveend
+
+    def pmSetMode(self, mode, timestamp, delta):
+        """ set the mode. The time is limited to the time range """
+        position = min(max(float(timestamp), self.start), self.end)
+        self._mode = mode
+        return self._context.pmSetMode(mode, get_timeval_from_timestamp(position), delta)
+
+    def pmFetch(self, pmids):
+        """ fetch the next record. Raises PM_ERR_EOL when the next record is
+            outside the time range """
+        result = self._context.pmFetch(pmids)
+        timestamp = float(result.contents.timestamp)
+        if (self._mode == c_pmapi.PM_MODE_BACK and timestamp < self.start) or (self._mode != c_pmapi.PM_MODE_BACK and timestamp > self.end):
+            self._context.pmFreeResult(result)
+            raise pmapi.pmErr(c_pmapi.PM_ERR_EOL)
+        return result
+
+    def __getattr__(self, name):
+        """ all other calls are passed to the context """
+        return getattr(self._context, name)
+
+def direct_read_logs(job):
+    """ Use the raw pcp archives for each node directly instead of merging them
+        with pmlogextract. Returns 0 if all nodes have archives, otherwise the
+        negative number of nodes that are missing """
 
     adjust_job_start_end(job)
 
-    return pmlogextract(job, conf, resconf, opts)
+    nodes_seen = 0
+    for nodename, nodearchives in job.rawarchives():
+        nodes_seen += 1
+        job.addnodearchive(nodename, RawArchiveSet(nodearchives, job.getnodebegin(nodename), job.getnodeend(nodename)))
 
+    return nodes_seen - job.nodecount
 
-def getlibextractcmdline(startdate, enddate, inputarchives, outputarchive):
+def getlibextractcmdline(startdate, enddate, inputarchives, outputarchive, configfile=None):
     """ build the pmlogextract commmandline """
 
     # The time format used by the archive merging tool.
@@ -100,13 +237,16 @@ def getlibextractcmdline(startdate, enddate, inputarchives, outputarchive):
     cmdline = ["-S", startdate.strftime(pcp_time_format),
                "-T", enddate.strftime(pcp_time_format)]
 
+    if configfile != None:
+        cmdline.extend(["-c", configfile])
+
     cmdline.extend(inputarchives)
 
     cmdline.append(outputarchive)
 
     return cmdline
 
-def getextractcmdline(startdate, enddate, inputarchives, outputarchive):
+def getextractcmdline(startdate, enddate, inputarchives, outputarchive, configfile=None):
     """ build the pmlogextract commmandline """
 
     # The time format used by the archive merging tool.
@@ -116,6 +256,9 @@ def getextractcmdline(startdate, enddate, inputarchives, outputarchive):
                "-S", startdate.strftime(pcp_time_format),
                "-T", enddate.strftime(pcp_time_format)]
 
+    if configfile != None:
+        cmdline.extend(["-c", configfile])
+
     cmdline.extend(inputarchives)
 
     cmdline.append(outputarchive)
@@ -142,7 +285,24 @@ def genoutputdir(job, conf, resconf):
 
     return jobdir
 
-def pmlogextract(job, conf, resconf, opts):
+def extractlimit(opts):
+    """ returns the number of pmlogextract processes to run concurrently for a
+        job. The extract_threads setting is the limit for the host, which is
+        shared between the jobs that are extracted at the same time """
+    if opts['prefetch'] > 0:
+        workers = opts['prefetch_threads']
+    else:
+        workers = opts['threads']
+    return max(1, opts['extract_threads'] // max(1, workers))
+
+def runpmlogextract(pcp_cmd):
+    """ run pmlogextract and return the return code and the output on stderr """
+    logging.debug("Calling %s", " ".join(pcp_cmd))
+    proc = subprocess.Popen(pcp_cmd, stderr=subprocess.PIPE)
+    (_, errdata) = proc.communicate()
+    return proc.returncode, errdata
+
+def pmlogextract(job, conf, resconf, opts, metrics=None):
     """
     Takes a job description and merges logs for the time it ran.
 
@@ -150,6 +310,7 @@ def pmlogextract(job, conf, resconf, opts):
         job: A Job object describing the job to process.
         pcp_job_dir: The directory per-job logs will be placed in.
         pcp_log_dir: The directory containing the source PCP archives, one subdir per host
+        metrics: The list of metrics to extract. All metrics are extracted if this is empty or None
     Returns:
         0 if the merge completed successfully. Otherwise, an error value.
     """
@@ -177,8 +338,13 @@ def pmlogextract(job, conf, resconf, opts):
 
     job.setjobdir(jobdir)
 
+    # Job archives from previous runs are reused if the cache is configured
+    cache = ExtractCache.fromconfig(conf)
+
     node_error = 0
-    nodes_seen = 0;
+    nodes_seen = 0
+
+    extracts = []
 
     # For every node the job ran on...
     for nodename, nodearchives in job.rawarchives():
@@ -187,37 +353,77 @@ def pmlogextract(job, conf, resconf, opts):
         # Merge the job logs for the node.
         node_archive = os.path.join(jobdir, nodename)
 
+        # The configuration only has the metrics that are in the raw archives
+        # for the node so that pmlogextract does not warn about the others
+        configfile = None
+        nodemetrics = None
+        if metrics:
+            nodemetrics = archivemetrics(nodearchives, metrics)
+            if nodemetrics is None:
+                nodemetrics = metrics
+            if len(nodemetrics) > 0:
+                try:
+                    configfile = writeextractconfig(jobdir, nodemetrics, nodename)
+                except EnvironmentError as e:
+                    logging.warning("Unable to write pmlogextract config in %s. All metrics will be extracted. Error: %s", jobdir, str(e))
+
+        cachekey = None
+        if cache is not None:
+            cachekey = cache.fingerprint(nodename, nodearchives, job.getnodebegin(nodename), job.getnodeend(nodename), nodemetrics if configfile != None else None)
+            if cache.fetch(cachekey, node_archive):
+                logging.debug("Using cached archive for %s %s", job.job_id, nodename)
+                job.addnodearchive(nodename, node_archive)
+                continue
+
         # Call the library version of pmlogextract to avoid fork calls in MPI
         if opts['libextract']:
-            pcp_cmd = getlibextractcmdline(job.getnodebegin(nodename), job.getnodeend(nodename), nodearchives, node_archive)
+            pcp_cmd = getlibextractcmdline(job.getnodebegin(nodename), job.getnodeend(nodename), nodearchives, node_archive, configfile)
             logging.debug("Calling pypmlogextract.pypmlogextract(%s)", " ".join(pcp_cmd))
             returncode = pypmlogextract.pypmlogextract(pcp_cmd)
             if returncode == 0:
                 job.addnodearchive(nodename, node_archive)
+                if cachekey is not None:
+                    cache.store(cachekey, node_archive)
             else:
                 node_error -= 1
                 errdata="pypmlogextract.pypmlogextract(%s) FAILED" % " ".join(pcp_cmd)
                 logging.warning(errdata)
                 job.record_error(errdata)
         else:
-            pcp_cmd = getextractcmdline(job.getnodebegin(nodename), job.getnodeend(nodename), nodearchives, node_archive)
+            pcp_cmd = getextractcmdline(job.getnodebegin(nodename), job.getnodeend(nodename), nodearchives, node_archive, configfile)
+            extracts.append((nodename, node_archive, pcp_cmd, cachekey))
+
+    # The pmlogextract processes for the nodes are run concurrently. The
+    # results are processed in node order.
+    limit = extractlimit(opts)
+    pool = None
+    if limit > 1 and len(extracts) > 1:
+        pool = ThreadPool(min(limit, len(extracts)))
+        results = pool.imap(runpmlogextract, [x[2] for x in extracts])
+    else:
+        results = itertools.imap(runpmlogextract, [x[2] for x in extracts])
 
-            logging.debug("Calling %s", " ".join(pcp_cmd))
-            proc = subprocess.Popen(pcp_cmd, stderr=subprocess.PIPE)
-            (_, errdata) = proc.communicate()
+    try:
+        for (nodename, node_archive, pcp_cmd, cachekey), (returncode, errdata) in itertools.izip(extracts, results):
 
             if errdata != None and len(errdata) > 0:
                 logging.warning(errdata)
                 job.record_error(errdata)
 
-            if proc.returncode:
-                errmsg = "pmlogextract return code: %s source command was: %s" % (proc.returncode, " ".join(pcp_cmd))
+            if returncode:
+                errmsg = "pmlogextract return code: %s source command was: %s" % (returncode, " ".join(pcp_cmd))
                 logging.warning(errmsg)
                 node_error -= 1
                 job.record_error(errmsg)
             else:
                 job.addnodearchive(nodename, node_archive)
-    
+                if cachekey is not None:
+                    cache.store(cachekey, node_archive)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
     # We care about errors, but also how many nodes didn't have archives at all
     nodes_missing = job.nodecount - nodes_seen
     node_error -= nodes_missing
@@ -2,7 +2,8 @@ from pcp import pmapi # Python bindings
 
 cdef extern from "sys/time.h":
     ctypedef struct timeval:
-        pass
+        long tv_sec
+        long tv_usec
 
 cdef extern from "pcp/pmapi.h":
     # Errors
@@ -16,6 +17,9 @@ cdef extern from "pcp/pmapi.h":
     int PM_ERR_NAME      =  "PM_ERR_NAME"
     int PM_ERR_SIGN      =  "PM_ERR_SIGN"
     enum: PM_ERR_VALUE
+    enum: PM_ERR_TYPE
+    enum: PM_ERR_TOOBIG
+    enum: PM_ERR_EOL
 
     # pmDesc.type -- data type of metric values 
     int PM_TYPE_NOSUPPORT        = "PM_TYPE_NOSUPPORT"
@@ -37,7 +41,7 @@ cdef extern from "pcp/pmapi.h":
     ctypedef unsigned int pmID
     ctypedef unsigned int pmInDom
     ctypedef struct pmValueBlock:
-        pass
+        char vbuf[1]
     ctypedef union myvalue:
         pmValueBlock* pval
         int lval
@@ -70,6 +74,9 @@ cdef extern from "pcp/pmapi.h":
         double d
 
     pmInDom PM_INDOM_NULL
+    enum: PM_VAL_INSITU
+    enum: PM_MODE_FORW
+    pmID PM_ID_NULL
 
     int pmLookupName(int, char **, pmID *)
     int pmLookupDesc(pmID, pmDesc *)
@@ -81,4 +88,7 @@ cdef extern from "pcp/pmapi.h":
     int pmGetInDom(pmInDom, int **, char ***)
     int pmGetInDomArchive(pmInDom, int **, char ***)
     int pmExtractValue(int, const pmValue *, int, pmAtomValue *, int)
+    int pmFetch(int, pmID *, pmResult **) nogil
+    void pmFreeResult(pmResult *) nogil
+    int pmSetMode(int, const timeval *, int) nogil
     char *pmErrStr(int)
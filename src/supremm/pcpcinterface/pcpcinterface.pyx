@@ -2,11 +2,13 @@
 
 from pcp import pmapi
 from libc.stdlib cimport free, malloc
+from libc.string cimport memcpy, memset
 from libc.stdint cimport uintptr_t
 from cpython cimport PyObject_GetBuffer, PyBuffer_Release, PyBUF_SIMPLE
 import cpmapi as c_pmapi
 import numpy
 from ctypes import c_uint
+from collections import OrderedDict
 
 from supremm.pcpcinterface cimport c_pcp
 cimport numpy
@@ -169,16 +171,402 @@ cdef object extractValuesInnerLoop(Py_ssize_t numval, c_pcp.pmResult* res, int d
     else: # Don't know how to handle data type
         return []
 
-cdef char* lookup(int val, int len, int* instlist, char** namelist):
-    cdef int i
-    for i in xrange(len):
-        if instlist[i] == val:
-            return namelist[i]
-    return NULL
+def bufferdtype(int dtype):
+    """ returns the numpy datatype of the buffer that extractValuesInto() uses
+        for metrics with the pcp datatype dtype. None is returned for
+        datatypes that are not supported """
+    if dtype == c_pcp.PM_TYPE_32 or dtype == c_pcp.PM_TYPE_64:
+        return numpy.int64
+    elif dtype == c_pcp.PM_TYPE_U32 or dtype == c_pcp.PM_TYPE_U64:
+        return numpy.uint64
+    elif dtype == c_pcp.PM_TYPE_FLOAT or dtype == c_pcp.PM_TYPE_DOUBLE:
+        return numpy.float64
+    return None
 
-def extractValues(context, result, py_metric_id_array, mtypes, logerr):
+def allocatebuffers(mtypes, Py_ssize_t size):
+    """ returns the value buffers and instance buffers for extractValuesInto()
+        with space for size instances for each metric. The buffers are None for
+        metrics with unsupported datatypes """
+    buffers = []
+    instances = []
+    for dtype in mtypes:
+        btype = bufferdtype(dtype)
+        if btype is None:
+            buffers.append(None)
+            instances.append(None)
+        else:
+            buffers.append(numpy.empty(size, dtype=btype))
+            instances.append(numpy.empty(size, dtype=numpy.int32))
+    return buffers, instances
+
+cdef int supportedtype(int dtype) nogil:
+    """ returns 1 if the datatype can be extracted into a typed buffer """
+    return dtype == c_pcp.PM_TYPE_32 or dtype == c_pcp.PM_TYPE_U32 or dtype == c_pcp.PM_TYPE_64 or \
+        dtype == c_pcp.PM_TYPE_U64 or dtype == c_pcp.PM_TYPE_FLOAT or dtype == c_pcp.PM_TYPE_DOUBLE
+
+cdef void writevalue(c_pcp.pmValue* v, int insitu, int dtype, void* out, Py_ssize_t idx) nogil:
+    """ write the value to index idx in the typed buffer. The value is read
+        directly from the pmValue or pmValueBlock """
+    cdef numpy.int32_t i32
+    cdef numpy.uint32_t u32
+    cdef float f
+
+    if dtype == c_pcp.PM_TYPE_32:
+        if insitu:
+            i32 = v.value.lval
+        else:
+            memcpy(&i32, v.value.pval.vbuf, sizeof(i32))
+        (<numpy.int64_t*>out)[idx] = i32
+    elif dtype == c_pcp.PM_TYPE_U32:
+        if insitu:
+            u32 = <numpy.uint32_t>v.value.lval
+        else:
+            memcpy(&u32, v.value.pval.vbuf, sizeof(u32))
+        (<numpy.uint64_t*>out)[idx] = u32
+    elif dtype == c_pcp.PM_TYPE_64:
+        memcpy(&(<numpy.int64_t*>out)[idx], v.value.pval.vbuf, sizeof(numpy.int64_t))
+    elif dtype == c_pcp.PM_TYPE_U64:
+        memcpy(&(<numpy.uint64_t*>out)[idx], v.value.pval.vbuf, sizeof(numpy.uint64_t))
+    elif dtype == c_pcp.PM_TYPE_DOUBLE:
+        memcpy(&(<double*>out)[idx], v.value.pval.vbuf, sizeof(double))
+    else:
+        if insitu:
+            memcpy(&f, &v.value.lval, sizeof(f))
+        else:
+            memcpy(&f, v.value.pval.vbuf, sizeof(f))
+        (<double*>out)[idx] = f
+
+cdef Py_ssize_t filltyped(c_pcp.pmValueSet* vset, int dtype, void* out, int* inst, Py_ssize_t size) nogil:
+    """ copy the values from the value set into the typed buffer """
+    cdef Py_ssize_t j
+    cdef int insitu = vset.valfmt == c_pcp.PM_VAL_INSITU
+
+    if vset.numval <= 0:
+        return vset.numval
+
+    if not supportedtype(dtype):
+        return c_pcp.PM_ERR_TYPE
+
+    if vset.numval > size:
+        return c_pcp.PM_ERR_TOOBIG
+
+    for j in range(vset.numval):
+        inst[j] = vset.vlist[j].inst
+        writevalue(&vset.vlist[j], insitu, dtype, out, j)
+
+    return vset.numval
+
+def extractValuesInto(result, mtypes, buffers, instances, vsetidx=None):
+    """
+    Extract the values for each metric in the result into caller provided
+    buffers. No python objects are created for the values and the extraction
+    runs without holding the GIL. Integer values keep their full precision
+    (U64 counters are not converted to double).
+
+    buffers[i] is a contiguous 1-d numpy array with datatype
+    bufferdtype(mtypes[i]) and instances[i] is a contiguous int32 array. These
+    are filled with the values and instance ids of metric i. allocatebuffers()
+    creates suitable buffers. vsetidx has the same meaning as for
+    extractValues().
+
+    returns an int64 numpy array with the number of values written for each
+    metric. Negative entries are pcp error codes: the error from the result,
+    PM_ERR_TOOBIG if a buffer was too small or PM_ERR_TYPE if the datatype is
+    not supported.
+    """
+    mem = Pool()
+
+    cdef Py_ssize_t nmetrics = len(mtypes)
+    cdef Py_ssize_t i
+    counts = numpy.zeros(nmetrics, dtype=numpy.int64)
+    cdef numpy.int64_t[::1] countsview = counts
+
+    if nmetrics == 0:
+        return counts
+
+    cdef void** outp = <void**>malloc(nmetrics * sizeof(void*))
+    mem.add(outp)
+    cdef int** instp = <int**>malloc(nmetrics * sizeof(int*))
+    mem.add(instp)
+    cdef int* dtypes = <int*>malloc(nmetrics * sizeof(int))
+    mem.add(dtypes)
+    cdef Py_ssize_t* sizes = <Py_ssize_t*>malloc(nmetrics * sizeof(Py_ssize_t))
+    mem.add(sizes)
+    cdef Py_ssize_t* vsets = <Py_ssize_t*>malloc(nmetrics * sizeof(Py_ssize_t))
+    mem.add(vsets)
+
+    for i in xrange(nmetrics):
+        vsets[i] = i if vsetidx is None else vsetidx[i]
+        dtypes[i] = mtypes[i]
+        if buffers[i] is None:
+            outp[i] = NULL
+            instp[i] = NULL
+            sizes[i] = 0
+            continue
+        if buffers[i].dtype != bufferdtype(mtypes[i]) or instances[i].dtype != numpy.int32 or \
+                not buffers[i].flags['C_CONTIGUOUS'] or not instances[i].flags['C_CONTIGUOUS']:
+            raise ValueError("Invalid buffer for metric {0}".format(i))
+        outp[i] = <void*><uintptr_t>buffers[i].ctypes.data
+        instp[i] = <int*><uintptr_t>instances[i].ctypes.data
+        sizes[i] = min(len(buffers[i]), len(instances[i]))
+
+    cdef Py_buffer buf
+    PyObject_GetBuffer(result.contents, &buf, PyBUF_SIMPLE)
+    cdef c_pcp.pmResult* res = <c_pcp.pmResult*>buf.buf
+
+    for i in xrange(nmetrics):
+        if vsets[i] < 0 or vsets[i] >= res.numpmid:
+            PyBuffer_Release(&buf)
+            raise ValueError("Invalid value set index {0}".format(vsets[i]))
+
+    with nogil:
+        for i in range(nmetrics):
+            countsview[i] = filltyped(res.vset[vsets[i]], dtypes[i], outp[i], instp[i], sizes[i])
+
+    PyBuffer_Release(&buf)
+
+    return counts
+
+class RecordBlock(object):
+    """ Preallocated buffers for fetchblock(). For each metric there is a
+        (nrecords x maxinstances) array of values in the datatype given by
+        bufferdtype() and an array of the same shape that is True where there
+        is a value. Each column holds the values for one instance; the instance
+        ids of the columns are in instances[i][:ninstances[i]]. The columns
+        are assigned in the order that the instances are first seen and are
+        kept when the block is reused for the next set of records. """
+
+    def __init__(self, mtypes, nrecords, maxinstances):
+        for dtype in mtypes:
+            if bufferdtype(dtype) is None:
+                raise ValueError("Unsupported datatype {0}".format(dtype))
+
+        self.mtypes = list(mtypes)
+        self.maxinstances = max(maxinstances, 1)
+        self.timestamps = numpy.zeros(nrecords, dtype=numpy.float64)
+        self.values = [numpy.zeros((nrecords, self.maxinstances), dtype=bufferdtype(x)) for x in mtypes]
+        self.valid = [numpy.zeros((nrecords, self.maxinstances), dtype=numpy.bool_) for _ in mtypes]
+        self.instances = [numpy.zeros(self.maxinstances, dtype=numpy.int32) for _ in mtypes]
+        self.ninstances = numpy.zeros(len(mtypes), dtype=numpy.int64)
+        self.nrecords = 0
+
+    capacity = property(lambda x: len(x.timestamps))
+
+    def resize(self, maxinstances):
+        """ increase the number of instances that can be stored for each metric.
+            The instance columns are preserved, the data are not """
+        if maxinstances <= self.maxinstances:
+            return
+
+        for i in xrange(len(self.mtypes)):
+            self.values[i] = numpy.zeros((self.capacity, maxinstances), dtype=self.values[i].dtype)
+            self.valid[i] = numpy.zeros((self.capacity, maxinstances), dtype=numpy.bool_)
+            instances = numpy.zeros(maxinstances, dtype=numpy.int32)
+            instances[:self.maxinstances] = self.instances[i]
+            self.instances[i] = instances
+
+        self.maxinstances = maxinstances
+        self.nrecords = 0
+
+    def getrecords(self):
+        """ returns a copy of the data for the records in the block as
+            timestamps, values, instances. The values are numpy masked arrays
+            with dimension (nrecords x ninstances) where the mask is set if
+            there was no value. instances has the instance id of each column """
+        values = []
+        instances = []
+        for i in xrange(len(self.mtypes)):
+            ninst = self.ninstances[i]
+            values.append(numpy.ma.masked_array(self.values[i][:self.nrecords, :ninst].copy(), ~self.valid[i][:self.nrecords, :ninst]))
+            instances.append(self.instances[i][:ninst].astype(numpy.int64))
+
+        return self.timestamps[:self.nrecords].copy(), values, instances
+
+cdef Py_ssize_t findcolumn(int inst, Py_ssize_t hint, int* instances, Py_ssize_t ninstances) nogil:
+    """ returns the column for the instance or -1 if there is no column. The
+        instance order is normally the same as the previous record so the hint
+        is tried first """
+    cdef Py_ssize_t c
+    if hint < ninstances and instances[hint] == inst:
+        return hint
+    for c in range(ninstances):
+        if instances[c] == inst:
+            return c
+    return -1
+
+def fetchblock(context, py_metric_id_array, block):
+    """
+    Fetch consecutive records for the metrics from the archive context into
+    the RecordBlock until the block is full or the end of the archive. All of
+    the records are fetched and decoded in one call without holding the GIL.
+    Records where any of the metrics has an error (such as PM_ERR_VALUE) or
+    where none of the metrics have values are skipped; this is the same as
+    extractValues().
+
+    block.nrecords is set to the number of records that were stored. returns 0
+    if the block was filled, PM_ERR_EOL at the end of the archive or
+    PM_ERR_TOOBIG if a record had more instances than fit in the block. In the
+    last case the archive is positioned so that the next call fetches the same
+    record again and block.resize() should be called first. Other negative
+    values are the pcp error from pmFetch.
+    """
+    mem = Pool()
+
+    cdef int nmetrics = len(py_metric_id_array)
+    cdef Py_ssize_t nrecords = block.capacity
+    cdef Py_ssize_t maxinst = block.maxinstances
+    cdef Py_ssize_t i, j, col, row
+    cdef int ctx = context._ctx
+    cdef int status = 0
+    cdef int haveerr, havedata, insitu
+    cdef c_pcp.pmResult* res
+    cdef c_pcp.pmValueSet* vset
+
+    if nmetrics != len(block.mtypes):
+        raise ValueError("The block does not match the metrics")
+
+    block.nrecords = 0
+    if nmetrics == 0 or nrecords == 0:
+        return 0
+
+    cdef c_pcp.pmID* pmids = <c_pcp.pmID*>malloc(nmetrics * sizeof(c_pcp.pmID))
+    mem.add(pmids)
+    cdef void** outp = <void**>malloc(nmetrics * sizeof(void*))
+    mem.add(outp)
+    cdef numpy.uint8_t** validp = <numpy.uint8_t**>malloc(nmetrics * sizeof(numpy.uint8_t*))
+    mem.add(validp)
+    cdef int** instp = <int**>malloc(nmetrics * sizeof(int*))
+    mem.add(instp)
+    cdef int* dtypes = <int*>malloc(nmetrics * sizeof(int))
+    mem.add(dtypes)
+    cdef numpy.int64_t[::1] ninst = block.ninstances
+    cdef double[::1] timestamps = block.timestamps
+
+    for i in xrange(nmetrics):
+        pmids[i] = py_metric_id_array[i]
+        dtypes[i] = block.mtypes[i]
+        outp[i] = <void*><uintptr_t>block.values[i].ctypes.data
+        validp[i] = <numpy.uint8_t*><uintptr_t>block.valid[i].ctypes.data
+        instp[i] = <int*><uintptr_t>block.instances[i].ctypes.data
+
+    row = 0
+    c_pcp.pmUseContext(ctx)
+
+    with nogil:
+        while row < nrecords:
+            status = c_pcp.pmFetch(nmetrics, pmids, &res)
+            if status < 0:
+                break
+            status = 0
+
+            # Check the record before writing anything to the block
+            haveerr = 0
+            havedata = 0
+            for i in range(nmetrics):
+                vset = res.vset[i]
+                if vset.numval < 0:
+                    haveerr = 1
+                elif vset.numval > 0:
+                    havedata = 1
+                    for j in range(vset.numval):
+                        if findcolumn(vset.vlist[j].inst, j, instp[i], ninst[i]) < 0:
+                            if ninst[i] == maxinst:
+                                status = c_pcp.PM_ERR_TOOBIG
+                                break
+                            instp[i][ninst[i]] = vset.vlist[j].inst
+                            ninst[i] += 1
+                if status != 0:
+                    break
+
+            if status != 0:
+                # Position the archive so the record is fetched again
+                c_pcp.pmSetMode(c_pcp.PM_MODE_FORW, &res.timestamp, 0)
+                c_pcp.pmFreeResult(res)
+                break
+
+            if haveerr or not havedata:
+                c_pcp.pmFreeResult(res)
+                continue
+
+            timestamps[row] = res.timestamp.tv_sec + res.timestamp.tv_usec / 1000000.0
+            for i in range(nmetrics):
+                vset = res.vset[i]
+                memset(&validp[i][row * maxinst], 0, maxinst)
+                insitu = vset.valfmt == c_pcp.PM_VAL_INSITU
+                for j in range(vset.numval):
+                    col = findcolumn(vset.vlist[j].inst, j, instp[i], ninst[i])
+                    writevalue(&vset.vlist[j], insitu, dtypes[i], outp[i], row * maxinst + col)
+                    validp[i][row * maxinst + col] = 1
+
+            c_pcp.pmFreeResult(res)
+            row += 1
+
+    block.nrecords = row
+
+    return status
+
+cdef int sameinstances(numpy.ndarray[numpy.int64_t, ndim=1, mode="c"] previdx, c_pcp.pmValueSet* vset):
+    """ returns 1 if the instances in the value set are the same as previdx """
+    cdef Py_ssize_t j
+    if previdx.shape[0] != vset.numval:
+        return 0
+    for j in xrange(vset.numval):
+        if previdx[j] != vset.vlist[j].inst:
+            return 0
+    return 1
+
+def getinstances(context, indom):
+    """ returns a dict of instance id to instance name for the instance
+        domain or None if the instance domain could not be read """
+    cdef int* ivals
+    cdef char** inames
+    cdef int status
+    cdef Py_ssize_t j
+    cdef int ctx = context._ctx
+
+    c_pcp.pmUseContext(ctx)
+    status = c_pcp.pmGetInDom(indom, &ivals, &inames)
+    if status < 0:
+        return None
+
+    instances = {}
+    if status > 0:
+        for j in xrange(status):
+            instances[ivals[j]] = inames[j]
+        free(ivals)
+        free(inames)
+
+    return instances
+
+def getnumvals(result):
+    """ returns a list with the number of values in each of the value sets in
+        the result. Negative entries are pcp error codes """
+    cdef Py_buffer buf
+    PyObject_GetBuffer(result.contents, &buf, PyBUF_SIMPLE)
+    cdef c_pcp.pmResult* res = <c_pcp.pmResult*>buf.buf
+    cdef Py_ssize_t i
+    numvals = []
+    for i in xrange(res.numpmid):
+        numvals.append(res.vset[i].numval)
+    PyBuffer_Release(&buf)
+    return numvals
+
+def extractValues(context, result, py_metric_id_array, mtypes, logerr, vsetidx=None, cache=None):
     """
     returns data, description
+
+    If vsetidx is provided then only the value sets at those indices in the
+    result are extracted. This is used when one pmResult contains the metrics
+    for more than one analytic. vsetidx[i] is the index in the result of the
+    metric py_metric_id_array[i].
+
+    The MetricCache for the context should be provided if the function is called
+    for more than one result from the same context. The instance domains are then
+    only read when they change and the description for a metric is the same
+    object as the previous call if the instances are unchanged. If the
+    instances of all of the metrics are unchanged then the description list is
+    also the same object.
+
     data is in format:  list (entry for each pmid)
                            |--> numpy array for pmid 0
                                    |--> inst 0 value
@@ -201,37 +589,30 @@ def extractValues(context, result, py_metric_id_array, mtypes, logerr):
     """
     data = []
     description = []
-    mem = Pool()
+
+    if cache is None:
+        cache = MetricCache(context)
 
     cdef Py_buffer buf
     PyObject_GetBuffer(result.contents, &buf, PyBUF_SIMPLE)
     cdef c_pcp.pmResult* res = <c_pcp.pmResult*>buf.buf
     cdef int ninstances
-    cdef int numpmid = res.numpmid
-    cdef Py_ssize_t i, j
-    cdef int ctx = context._ctx
-    cdef int status
-    cdef int* ivals
-    cdef char** inames
-    cdef char* name
-    cdef c_pcp.pmDesc metric_desc
-    cdef c_pcp.pmAtomValue atom
+    cdef int numpmid = res.numpmid if vsetidx is None else len(vsetidx)
+    cdef Py_ssize_t i, j, k
     cdef int dtype
     cdef int allempty = 1
+    cdef int allreused = 1
+    cdef int allnamed
+    cdef c_pcp.pmID pmid
 
     if numpmid < 0:
         logerr("negative number of pmid's")
         PyBuffer_Release(&buf)
         return None, None
 
-    cdef c_pcp.pmID* metric_id_array = <c_pcp.pmID*>malloc(numpmid * sizeof(c_pcp.pmID))
-    mem.add(metric_id_array)
-    for i in xrange(numpmid):
-        metric_id_array[i] = py_metric_id_array[i] # Implicit py object to c data type conversion
-    c_pcp.pmUseContext(ctx)
-
     for i in xrange(numpmid):
-        ninstances = res.vset[i].numval
+        k = i if vsetidx is None else vsetidx[i]
+        ninstances = res.vset[k].numval
         if ninstances == c_pcp.PM_ERR_VALUE:
             # Data missing at this timestep
             PyBuffer_Release(&buf)
@@ -244,61 +625,83 @@ def extractValues(context, result, py_metric_id_array, mtypes, logerr):
         elif ninstances == 0:
             data.append(numpy.empty(0, dtype=numpy.float64))
             description.append([numpy.empty(0, dtype=numpy.int64), []])
+            allreused = 0
         else:
             dtype = mtypes[i]
-            tmp_names = []
-            tmp_idx = numpy.empty(ninstances, dtype=int)
+            pmid = py_metric_id_array[i]
 
             # extractValueInnerLoop does own looping
-            data.append(extractValuesInnerLoop(ninstances, res, dtype, i))
+            data.append(extractValuesInnerLoop(ninstances, res, dtype, k))
             if len(data[i]) > 0:
                 allempty = 0
             elif data[i] == []:
                 logerr("unkown data type on extraction")
 
-            status = c_pcp.pmLookupDesc(metric_id_array[i], &metric_desc)
-            if status < 0:
-                PyBuffer_Release(&buf)
-                return None, None
-            status = c_pcp.pmGetInDom(metric_desc.indom, &ivals, &inames)
-            if status < 0:
+            previous = cache.getlastdescription(pmid)
+            if previous is not None and sameinstances(previous[0], res.vset[k]):
+                description.append(previous)
+                continue
+
+            allreused = 0
+
+            instances = cache.getinstances(pmid)
+            if instances is not None:
+                for j in xrange(ninstances):
+                    if res.vset[k].vlist[j].inst not in instances and res.vset[k].vlist[j].inst != 4294967295:
+                        # The instance domain has changed since it was read
+                        instances = cache.getinstances(pmid, True)
+                        break
+
+            if instances is None:
                 if len(data[i]) != 0: # Found data, so insert placeholder description
                     description.append([numpy.empty(0, dtype=numpy.int64), []])
                 else:
                     PyBuffer_Release(&buf)
                     return None, None
-            elif ninstances > status: # Missing a few indoms - try again
-                mem.add(ivals)
-                mem.add(inames)
+            elif ninstances > len(instances): # Missing a few indoms - try again
                 PyBuffer_Release(&buf)
                 return True, True
             else:
-                mem.add(ivals)
-                mem.add(inames)
+                tmp_names = []
+                tmp_idx = numpy.empty(ninstances, dtype=numpy.int64)
+                allnamed = 1
                 for j in xrange(ninstances):
-                    if res.vset[i].vlist[j].inst == 4294967295:
+                    if res.vset[k].vlist[j].inst == 4294967295:
                         logerr("inst is -1")
+                        allnamed = 0
                         continue
-                    # TODO - find way to just look for one name not generate list then find it in list
-                    name = lookup(res.vset[i].vlist[j].inst, status, ivals, inames)
-                    if name == NULL:
+                    name = instances.get(res.vset[k].vlist[j].inst)
+                    if name is None:
                         logerr("instance is not pcp archive")
+                        allnamed = 0
                         continue # Possibly add logging here
                     tmp_names.append(name)
-                    tmp_idx[j] = res.vset[i].vlist[j].inst
-                        
-                description.append([tmp_idx, tmp_names])
+                    tmp_idx[j] = res.vset[k].vlist[j].inst
 
+                desc = [tmp_idx, tmp_names]
+                if allnamed:
+                    cache.setlastdescription(pmid, desc)
+                description.append(desc)
 
     PyBuffer_Release(&buf)
     if allempty:
         return None, None
 
+    if allreused:
+        key = tuple(py_metric_id_array)
+        previouslist = cache.getlastdescription(key)
+        if previouslist is not None and all(x is y for x, y in zip(previouslist, description)):
+            return data, previouslist
+        cache.setlastdescription(key, description)
+
     return data, description
 
-def extractpreprocValues(context, result, py_metric_id_array, mtypes):
+def extractpreprocValues(context, result, py_metric_id_array, mtypes, vsetidx=None, cache=None):
     """
     populate and return data, description from pcp archive for preproc's
+    vsetidx and cache have the same meaning as for extractValues(). The
+    description dicts are shared between calls when a cache is used and
+    must not be modified.
     data is in format: list (entry for each pmid)
                         |--> list (entry for each instance)
                                 |--> list (pmid 0, instance 0)
@@ -326,14 +729,11 @@ def extractpreprocValues(context, result, py_metric_id_array, mtypes):
     PyObject_GetBuffer(result.contents, &buf, PyBUF_SIMPLE)
     cdef c_pcp.pmResult* res = <c_pcp.pmResult*> buf.buf
     cdef int mid_len = len(py_metric_id_array)
-    cdef int numpmid = res.numpmid
+    cdef int numpmid = res.numpmid if vsetidx is None else len(vsetidx)
     cdef int ninstances
-    cdef Py_ssize_t i, j
+    cdef Py_ssize_t i, j, k
     cdef int ctx = context._ctx
     cdef int status
-    cdef int* ivals
-    cdef char** inames
-    cdef c_pcp.pmDesc metric_desc
     cdef c_pcp.pmAtomValue atom
     cdef int dtype
 
@@ -347,37 +747,38 @@ def extractpreprocValues(context, result, py_metric_id_array, mtypes):
         metric_id_array[i] = py_metric_id_array[i] # Implicit py object to c data type conversion
     c_pcp.pmUseContext(ctx)
     
+    if cache is None:
+        cache = MetricCache(context)
+
     # Initialize description
     for i in xrange(mid_len):
-        c_pcp.pmLookupDesc(metric_id_array[i], &metric_desc)
-        if  metric_desc.indom == c_pcp.PM_INDOM_NULL: # Missing indom - skip
+        instances = cache.getinstances(metric_id_array[i])
+        if instances is None:
             description.append({})
             continue
-        status = c_pcp.pmGetInDom(metric_desc.indom, &ivals, &inames)
-        if status <= 0:
-            description.append({})
-        else:
-            mem.add(ivals)
-            mem.add(inames)
-            tmp_dict = dict()
-            for j in xrange(status):
-                tmp_dict[ivals[j]] = inames[j]
-            description.append(tmp_dict)
+        k = i if vsetidx is None else vsetidx[i]
+        if i < numpmid and res.vset[k].numval > 0:
+            for j in xrange(res.vset[k].numval):
+                if res.vset[k].vlist[j].inst not in instances:
+                    # The instance domain has changed since it was read
+                    instances = cache.getinstances(metric_id_array[i], True)
+                    break
+        description.append(instances if instances is not None else {})
 
     # Initialize data
     for i in xrange(numpmid):
-        ninstances = res.vset[i].numval
-        c_pcp.pmLookupDesc(metric_id_array[i], &metric_desc)
+        k = i if vsetidx is None else vsetidx[i]
+        ninstances = res.vset[k].numval
 
         tmp_data = []
         dtype = mtypes[i]
 
         for j in xrange(ninstances):
-            status = c_pcp.pmExtractValue(res.vset[i].valfmt, &res.vset[i].vlist[j], dtype, &atom, dtype)
+            status = c_pcp.pmExtractValue(res.vset[k].valfmt, &res.vset[k].vlist[j], dtype, &atom, dtype)
             if status < 0:
                 tmp_data.append([])
             else:
-                tmp_data.append((topyobj(atom, dtype), res.vset[i].vlist[j].inst))
+                tmp_data.append((topyobj(atom, dtype), res.vset[k].vlist[j].inst))
         data.append(tmp_data)
 
     PyBuffer_Release(&buf)
@@ -410,31 +811,178 @@ def loadrequiredmetrics(context, requiredMetrics):
 
     return ret
 
-def getmetricstofetch(context, analytic):
+# Derived metrics are registered with libpcp for the whole process, so each
+# one only needs to be registered once.
+_registeredderived = set()
+
+def registerderived(context, derived):
+    """ register the derived metric with libpcp if it has not already been
+        registered by this process """
+    if derived['name'] in _registeredderived:
+        return
+    context.pmRegisterDerived(derived['name'], derived['formula'])
+    _registeredderived.add(derived['name'])
+
+def lookupnames(context, names):
+    """ returns a list with the pmID for each of the names. The entry is None
+        for names that are not in the archive. All of the names are looked
+        up with a single call to libpcp """
+    mem = Pool()
+    cdef int num_met = len(names)
+    cdef int ctx = context._ctx
+    cdef Py_ssize_t i
+    cdef int status
+
+    if num_met == 0:
+        return []
+
+    c_pcp.pmUseContext(ctx)
+    cdef char** nameofmetrics = <char**>malloc(num_met * sizeof(char*))
+    mem.add(nameofmetrics)
+    for i in xrange(num_met):
+        nameofmetrics[i] = names[i]
+
+    cdef c_pcp.pmID* pmids = <c_pcp.pmID*>malloc(num_met * sizeof(c_pcp.pmID))
+    mem.add(pmids)
+    status = c_pcp.pmLookupName(num_met, nameofmetrics, pmids)
+
+    if status < 0:
+        if num_met > 1:
+            # The error code does not say which name failed
+            ret = []
+            for name in names:
+                ret.extend(lookupnames(context, [name]))
+            return ret
+
+        if status == c_pmapi.PM_ERR_NAME or status == c_pmapi.PM_ERR_NONLEAF:
+            return [None]
+        raise pmapi.pmErr(status)
+
+    ret = []
+    for i in xrange(num_met):
+        ret.append(pmids[i] if pmids[i] != c_pcp.PM_ID_NULL else None)
+
+    return ret
+
+def lookupdesc(context, pmid):
+    """ returns the type and instance domain of the metric """
+    cdef int ctx = context._ctx
+    cdef c_pcp.pmDesc d
+    cdef int status
+
+    c_pcp.pmUseContext(ctx)
+    status = c_pcp.pmLookupDesc(pmid, &d)
+    if status < 0:
+        return c_pcp.PM_TYPE_UNKNOWN, c_pcp.PM_INDOM_NULL
+
+    return d.type, d.indom
+
+class MetricCache(object):
+    """ Cache of the metric name to pmID and pmID to descriptor lookups for a
+        context. The pmIDs and descriptors are only valid for the archive
+        that the context was created for, so use a new instance for each
+        context. """
+
+    def __init__(self, context):
+        self.context = context
+        self._pmids = {}
+        self._descs = {}
+        self._instances = {}
+        self._lastdescription = {}
+
+    def prime(self, analytics):
+        """ look up all of the metrics for the analytics in one batch """
+        names = []
+        for analytic in analytics:
+            for derived in analytic.derivedMetrics:
+                registerderived(self.context, derived)
+                names.append(derived['name'])
+
+            if len(analytic.requiredMetrics) > 0:
+                if isinstance(analytic.requiredMetrics[0], basestring):
+                    names.extend(analytic.requiredMetrics)
+                else:
+                    for reqarray in analytic.requiredMetrics:
+                        names.extend(reqarray)
+
+            names.extend(analytic.optionalMetrics)
+
+        self.lookupnames(names)
+
+    def lookupnames(self, names):
+        """ returns a list with the pmID for each name (None if the metric
+            is not in the archive) """
+        missing = [x for x in OrderedDict.fromkeys(names) if x not in self._pmids]
+        if len(missing) > 0:
+            for name, pmid in zip(missing, lookupnames(self.context, missing)):
+                self._pmids[name] = pmid
+
+        return [self._pmids[x] for x in names]
+
+    def gettype(self, pmid):
+        """ returns the datatype of the metric """
+        return self.getdesc(pmid)[0]
+
+    def getindom(self, pmid):
+        """ returns the instance domain of the metric """
+        return self.getdesc(pmid)[1]
+
+    def getdesc(self, pmid):
+        """ returns the (type, indom) tuple for the metric """
+        if pmid not in self._descs:
+            self._descs[pmid] = lookupdesc(self.context, pmid)
+        return self._descs[pmid]
+
+    def getinstances(self, pmid, refresh=False):
+        """ returns a dict of instance id to instance name for the instance
+            domain of the metric or None if the metric has no instance domain.
+            The instance domain is re-read from the archive if refresh is True """
+        indom = self.getindom(pmid)
+        if indom == c_pcp.PM_INDOM_NULL:
+            return None
+        if refresh or indom not in self._instances:
+            self._instances[indom] = getinstances(self.context, indom)
+        return self._instances[indom]
+
+    def getlastdescription(self, key):
+        """ returns the description that was last stored for the key """
+        return self._lastdescription.get(key)
+
+    def setlastdescription(self, key, description):
+        """ store the description for the key """
+        self._lastdescription[key] = description
+
+def getmetricstofetch(context, analytic, cache=None):
     """ returns the c_type data structure with the list of metrics requested
-        for the analytic """
+        for the analytic. The lookups use the MetricCache for the context if
+        one is provided """
+
+    if cache is None:
+        cache = MetricCache(context)
 
     metriclist = []
     metricnames = []
 
     for derived in analytic.derivedMetrics:
-        context.pmRegisterDerived(derived['name'], derived['formula'])
-        required = context.pmLookupName(derived['name'])
+        registerderived(context, derived)
+        required = cache.lookupnames([derived['name']])
+        if required[0] is None:
+            raise pmapi.pmErr(c_pmapi.PM_ERR_NAME)
         metriclist.append(required[0])
         metricnames.append(derived['name'])
 
     if len(analytic.requiredMetrics) > 0:
         metricOk = False
         if isinstance(analytic.requiredMetrics[0], basestring):
-            r = loadrequiredmetrics(context, analytic.requiredMetrics)
-            if len(r) > 0:
+            r = cache.lookupnames(analytic.requiredMetrics)
+            if None not in r:
                 metriclist += r
                 metricnames.extend(analytic.requiredMetrics)
                 metricOk = True
         else:
             for reqarray in analytic.requiredMetrics:
-                r = loadrequiredmetrics(context, reqarray)
-                if len(r) > 0:
+                r = cache.lookupnames(reqarray)
+                if len(r) > 0 and None not in r:
                     metriclist += r
                     metricnames.extend(reqarray)
                     metricOk = True
@@ -443,18 +991,11 @@ def getmetricstofetch(context, analytic):
         if not metricOk:
             return [], []
 
-    for optional in analytic.optionalMetrics:
-        try:
-            opt = context.pmLookupName(optional)
-            metriclist.append(opt[0])
+    for optional, opt in zip(analytic.optionalMetrics, cache.lookupnames(analytic.optionalMetrics)):
+        # Optional metrics are allowed to not exist
+        if opt is not None:
+            metriclist.append(opt)
             metricnames.append(optional)
-        except pmapi.pmErr as e:
-            if e.args[0] == c_pmapi.PM_ERR_NAME or e.args[0] == c_pmapi.PM_ERR_NONLEAF:
-                # Optional metrics are allowed to not exist
-                pass
-            else:
-                raise e
-
 
     metricarray = (c_uint * len(metriclist))()
     cdef Py_ssize_t i
@@ -463,8 +1004,12 @@ def getmetricstofetch(context, analytic):
 
     return metricarray, metricnames
 
-def getmetrictypes(context, py_metric_ids):
+def getmetrictypes(context, py_metric_ids, cache=None):
     """ returns a list with the datatype of the provided array of metric ids """
+
+    if cache is not None:
+        return [cache.gettype(pmid) for pmid in py_metric_ids]
+
     mem = Pool()
 
     cdef int num_mid = len(py_metric_ids)
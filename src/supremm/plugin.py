@@ -3,9 +3,10 @@
 
 from abc import ABCMeta, abstractmethod, abstractproperty
 from supremm.statistics import calculate_stats
-from supremm.subsample import TimeseriesAccumulator
+from supremm.subsample import TimeseriesAccumulator, TimeBucketStats
 from supremm.errors import ProcessingError
 import os
+import datetime
 import numpy
 import pkgutil
 from collections import Counter
@@ -60,9 +61,20 @@ class NodeMetadata(object):
         """ returns a unique numerical identifier for the node """
         pass
 
+class PluginMeta(ABCMeta):
+    """ Metaclass for the plugins. process() is abstract so a plugin that does
+        not implement it cannot be instantiated, except for plugins that
+        implement process_block() (and set blockmode) instead """
+
+    def __new__(mcs, name, bases, namespace):
+        cls = super(PluginMeta, mcs).__new__(mcs, name, bases, namespace)
+        if "process_block" in namespace and not getattr(namespace.get("process"), "__isabstractmethod__", False):
+            cls.__abstractmethods__ = cls.__abstractmethods__ - frozenset(["process"])
+        return cls
+
 class Plugin(object):
     """ abstract base class describing the plugin interface """
-    __metaclass__ = ABCMeta
+    __metaclass__ = PluginMeta
 
     def __init__(self, job):
         self._job = job
@@ -81,14 +93,63 @@ class Plugin(object):
 
     @abstractmethod
     def process(self, nodemeta, timestamp, data, description):
-        """ process is called for every requested data point """
+        """ process is called for every requested data point. All plugins must
+            implement either this function or process_block() """
         pass
 
+    blockmode = property(lambda x: False)
+
+    def process_block(self, nodemeta, timestamps, values, description):
+        """ Optional extension to the plugin API for plugins with mode "all" or
+            "timeseries". Plugins that implement this must also set blockmode to
+            True and then process_block() is called once per node instead of calling
+            process() for every datapoint. timestamps is an array with the
+            timestamp of each datapoint. values is a list with an entry for each
+            requested metric. Each entry is a numpy masked array with dimension
+            (ntimesteps x ninstances), the mask is set where an instance had no
+            data at a timestep. description has the same format as for process()
+            and lists the instances for the columns of the arrays.
+        """
+        raise NotImplementedError()
+
     @abstractmethod
     def results(self):
         """ results will be called once after all the datapoints have had calls to  process()"""
         pass
 
+    # The version of the plugin. This should be incremented whenever a change
+    # to the plugin changes its results so that the incremental mode reprocesses
+    # the jobs that were summarized with an older version.
+    version = property(lambda x: 1)
+
+    # The names of the preprocessors whose data the plugin uses in results()
+    requiredPreprocessors = property(lambda x: [])
+
+    # Timeseries plugins that only store the datapoints that are kept by a
+    # TimeseriesAccumulator can set this to True. The framework then only
+    # fetches the records that the accumulator would keep rather than every
+    # record in the archive.
+    subsample = property(lambda x: False)
+
+    # Plugins that combine the data across the nodes at each time can set this
+    # to True. When the job is processed in interleaved mode the records from
+    # all of the nodes are then passed to process() in timestamp order rather
+    # than node by node. The mode is optional so the results must not depend
+    # on the order that the records are processed.
+    interleave = property(lambda x: False)
+
+    mergeable = property(lambda x: False)
+
+    def merge(self, other):
+        """ Optional extension to the plugin API. Combine the state of other, an
+            instance of the same plugin that processed a different set of nodes
+            from the same job, into this instance. Plugins that implement this
+            must also set mergeable to True. When the node archives for a job are
+            processed in parallel the plugins that are not mergeable process
+            all of the nodes in turn in the main process.
+        """
+        raise NotImplementedError()
+
     @abstractproperty
     def name(self):
         pass
@@ -161,6 +222,20 @@ class PreProcessor(object):
         """ Called after all of the data available for a host has been processed. """
         pass
 
+    # The version of the preprocessor. The plugins that use the preprocessor
+    # are also reprocessed in incremental mode when this changes.
+    version = property(lambda x: 1)
+
+    mergeable = property(lambda x: False)
+
+    def merge(self, other):
+        """ Optional extension to the preprocessor API. Combine the state of other,
+            an instance of the same preprocessor that processed a different set of
+            nodes from the same job, into this instance. The merged data must also
+            be added to the job object since the plugins use it in results().
+        """
+        raise NotImplementedError()
+
     @abstractproperty
     def name(self):
         pass
@@ -190,6 +265,7 @@ class DeviceBasedPlugin(Plugin):
     __metaclass__ = ABCMeta
 
     mode = property(lambda x: "firstlast")
+    mergeable = property(lambda x: True)
 
     def __init__(self, job):
         super(DeviceBasedPlugin, self).__init__(job)
@@ -198,6 +274,21 @@ class DeviceBasedPlugin(Plugin):
         self._error = None
         self.allmetrics = self.requiredMetrics + self.optionalMetrics
 
+    def merge(self, other):
+
+        self._first.update(other._first)
+
+        for indom, metrics in other._data.iteritems():
+            if indom not in self._data:
+                self._data[indom] = {}
+            for metricname, values in metrics.iteritems():
+                if metricname not in self._data[indom]:
+                    self._data[indom][metricname] = []
+                self._data[indom][metricname].extend(values)
+
+        if self._error == None:
+            self._error = other._error
+
     def process(self, nodemeta, timestamp, data, description):
 
         if len(data[0]) == 0:
@@ -256,6 +347,7 @@ class DeviceInstanceBasedPlugin(Plugin):
     __metaclass__ = ABCMeta
 
     mode = property(lambda x: "firstlast")
+    mergeable = property(lambda x: True)
 
     def __init__(self, job):
         super(DeviceInstanceBasedPlugin, self).__init__(job)
@@ -263,6 +355,18 @@ class DeviceInstanceBasedPlugin(Plugin):
         self._data = {}
         self._error = None
 
+    def merge(self, other):
+
+        self._first.update(other._first)
+
+        for metricname, values in other._data.iteritems():
+            if metricname not in self._data:
+                self._data[metricname] = []
+            self._data[metricname].extend(values)
+
+        if self._error == None:
+            self._error = other._error
+
     def process(self, nodemeta, timestamp, data, description):
 
         if len(data[0]) == 0:
@@ -305,12 +409,19 @@ class RateConvertingTimeseriesPlugin(Plugin):
     __metaclass__ = ABCMeta
 
     mode = property(lambda x: "timeseries")
+    version = property(lambda x: 2)
+    mergeable = property(lambda x: True)
+    subsample = property(lambda x: True)
 
     def __init__(self, job):
         super(RateConvertingTimeseriesPlugin, self).__init__(job)
         self._data = TimeseriesAccumulator(job.nodecount, self._job.walltime)
         self._hostdata = {}
 
+    def merge(self, other):
+        self._data.merge(other._data)
+        self._hostdata.update(other._hostdata)
+
     @abstractmethod
     def computetimepoint(self, data):
         """ Called with the data for each timepoint on each host """
@@ -382,3 +493,62 @@ class RateConvertingTimeseriesPlugin(Plugin):
                 pass
 
         return result
+
+
+class CrossNodeTimeseriesPlugin(Plugin):
+    """
+    A base abstract class for generating a timeseries of the minimum, maximum and
+    median across the nodes of a value that should be converted to a rate. The
+    statistics for each time bucket are computed as soon as all of the nodes have
+    data for it, so in interleaved mode the plugin only stores the data for the
+    current buckets rather than a timeseries for every node.
+    The plugin name, list of required metrics and generator function must be provided by the implementation
+    """
+    __metaclass__ = ABCMeta
+
+    mode = property(lambda x: "timeseries")
+    interleave = property(lambda x: True)
+    mergeable = property(lambda x: True)
+
+    def __init__(self, job):
+        super(CrossNodeTimeseriesPlugin, self).__init__(job)
+        start = (job.start_datetime - datetime.datetime(1970, 1, 1)).total_seconds()
+        self._data = TimeBucketStats(job.nodecount, start, job.walltime)
+        self._hostdata = {}
+
+    def merge(self, other):
+        self._data.merge(other._data)
+        self._hostdata.update(other._hostdata)
+
+    @abstractmethod
+    def computetimepoint(self, data):
+        """ Called with the data for each timepoint on each host """
+        pass
+
+    def process(self, nodemeta, timestamp, data, description):
+
+        if nodemeta.nodeindex not in self._hostdata:
+            self._hostdata[nodemeta.nodeindex] = 1
+
+        datum = self.computetimepoint(data)
+        if datum != None:
+            self._data.adddata(nodemeta.nodeindex, timestamp, datum)
+
+        return True
+
+    def results(self):
+
+        if len(self._hostdata) != self._job.nodecount:
+            return {"error": ProcessingError.INSUFFICIENT_HOSTDATA}
+
+        times, minimum, maximum, median = self._data.get()
+
+        if len(times) < 3:
+            return {"error": ProcessingError.JOB_TOO_SHORT}
+
+        return {
+            "times": times,
+            "min": minimum,
+            "max": maximum,
+            "med": median
+        }
@@ -16,6 +16,7 @@ class Catastrophe(Plugin):
                                           ["perfevent.hwcounters.DATA_CACHE_MISSES_DC_MISS_STREAMING_STORE.value"]])
     optionalMetrics = property(lambda x: [])
     derivedMetrics = property(lambda x: [])
+    requiredPreprocessors = property(lambda x: ["perf"])
 
     def __init__(self, job):
         super(Catastrophe, self).__init__(job)
@@ -42,6 +42,7 @@ class CpuPerfCounters(Plugin):
     requiredMetrics = property(lambda x: [SNB_METRICS, NHM_METRICS, NHM_ALT_METRICS, GENERIC_INTEL_METRICS, AMD_INTERLAGOS_METRICS])
     optionalMetrics = property(lambda x: [])
     derivedMetrics = property(lambda x: [])
+    requiredPreprocessors = property(lambda x: ["perf"])
 
     def __init__(self, job):
         super(CpuPerfCounters, self).__init__(job)
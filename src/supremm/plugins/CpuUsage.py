@@ -34,6 +34,7 @@ class CpuUsage(Plugin):
 
     optionalMetrics = property(lambda x: [])
     derivedMetrics = property(lambda x: [])
+    requiredPreprocessors = property(lambda x: ["proc"])
 
     def __init__(self, job):
         super(CpuUsage, self).__init__(job)
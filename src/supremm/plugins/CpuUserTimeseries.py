@@ -12,9 +12,13 @@ class CpuUserTimeseries(Plugin):
 
     name = property(lambda x: "cpuuser")
     mode = property(lambda x: "timeseries")
+    version = property(lambda x: 2)
     requiredMetrics = property(lambda x: ["kernel.percpu.cpu.user"])
     optionalMetrics = property(lambda x: [])
     derivedMetrics = property(lambda x: [])
+    requiredPreprocessors = property(lambda x: ["proc"])
+    blockmode = property(lambda x: True)
+    subsample = property(lambda x: True)
 
     def __init__(self, job):
         super(CpuUserTimeseries, self).__init__(job)
@@ -29,24 +33,25 @@ class CpuUserTimeseries(Plugin):
         else:
             self._cpusallowed = {}
 
-    def process(self, nodemeta, timestamp, data, description):
+    def process_block(self, nodemeta, timestamps, values, description):
 
         if self._cpusallowed == None:
             self.initcpus()
 
-        if len(data[0]) == 0:
-            # Skip datapoints that have no values
+        # Skip datapoints that have no values
+        valid = numpy.ma.count(values[0], axis=1) > 0
+        if not numpy.any(valid):
             return True
 
         if nodemeta.nodename in self._cpusallowed and 'error' not in self._cpusallowed[nodemeta.nodename]:
-            cpudata = data[0][self._cpusallowed[nodemeta.nodename]]
+            cpudata = values[0][valid][:, self._cpusallowed[nodemeta.nodename]]
         else:
-            cpudata = data[0]
+            cpudata = values[0][valid]
 
         hostidx = nodemeta.nodeindex
 
         if nodemeta.nodeindex not in self._hostdata:
-            self._hostdata[hostidx] = numpy.empty((TimeseriesAccumulator.MAX_DATAPOINTS, len(cpudata)))
+            self._hostdata[hostidx] = numpy.empty((TimeseriesAccumulator.MAX_DATAPOINTS, cpudata.shape[1]))
             if nodemeta.nodename in self._cpusallowed and 'error' not in self._cpusallowed[nodemeta.nodename]:
                 self._hostdevnames[hostidx] = {}
                 for i, cpuidx in enumerate(self._cpusallowed[nodemeta.nodename]):
@@ -54,9 +59,10 @@ class CpuUserTimeseries(Plugin):
             else:
                 self._hostdevnames[hostidx] = dict((str(k), v) for k, v in zip(description[0][0], description[0][1]))
 
-        insertat = self._data.adddata(hostidx, timestamp, numpy.mean(cpudata)/10.0)
-        if insertat != None:
-            self._hostdata[hostidx][insertat] = cpudata / 10.0
+        cpudata = cpudata.filled(0) / 10.0
+        stored = self._data.adddatablock(hostidx, timestamps[valid], numpy.mean(cpudata, axis=1))
+        for insertat, blockidx in stored:
+            self._hostdata[hostidx][insertat] = cpudata[blockidx]
 
         return True
 
@@ -0,0 +1,20 @@
+#!/usr/bin/env python
+""" Timeseries generator module """
+
+from supremm.plugin import CrossNodeTimeseriesPlugin
+import numpy
+
+class GpfsSpreadTimeseries(CrossNodeTimeseriesPlugin):
+    """ Generate the minimum, maximum and median GPFS usage across the nodes as
+        timeseries data """
+
+    name = property(lambda x: "gpfsspread")
+    requiredMetrics = property(lambda x: ["gpfs.fsios.read_bytes", "gpfs.fsios.write_bytes"])
+    optionalMetrics = property(lambda x: [])
+    derivedMetrics = property(lambda x: [])
+
+    def __init__(self, job):
+        super(GpfsSpreadTimeseries, self).__init__(job)
+
+    def computetimepoint(self, data):
+        return (numpy.sum(data[0]) + numpy.sum(data[1])) / 1048576.0
@@ -13,11 +13,15 @@ class GpuPower(Plugin):
     requiredMetrics = property(lambda x: ["nvidia.powerused"])
     optionalMetrics = property(lambda x: [])
     derivedMetrics = property(lambda x: [])
+    mergeable = property(lambda x: True)
 
     def __init__(self, job):
         super(GpuPower, self).__init__(job)
         self._data = {}
 
+    def merge(self, other):
+        self._data.update(other._data)
+
     def process(self, nodemeta, timestamp, data, description):
         """ Power measurements are similar to the memory measurements the first and last data points
         are ignored and the statistics are computed over all of the other measurements.
@@ -12,12 +12,18 @@ class GpuUsage(Plugin):
     requiredMetrics = property(lambda x: ["nvidia.gpuactive", "nvidia.memused"])
     optionalMetrics = property(lambda x: ["nvidia.memactive"])
     derivedMetrics = property(lambda x: [])
+    mergeable = property(lambda x: True)
 
     def __init__(self, job):
         super(GpuUsage, self).__init__(job)
         self._data = {}
         self.statnames = None
 
+    def merge(self, other):
+        self._data.update(other._data)
+        if self.statnames == None:
+            self.statnames = other.statnames
+
     def process(self, nodemeta, timestamp, data, description):
 
         if len(description) == 0 or len(data[0]) == 0:
@@ -11,9 +11,11 @@ class GpuUsageTimeseries(Plugin):
 
     name = property(lambda x: "gpu_usage")
     mode = property(lambda x: "timeseries")
+    version = property(lambda x: 2)
     requiredMetrics = property(lambda x: ["nvidia.gpuactive"])
     optionalMetrics = property(lambda x: [])
     derivedMetrics = property(lambda x: [])
+    subsample = property(lambda x: True)
 
     def __init__(self, job):
         super(GpuUsageTimeseries, self).__init__(job)
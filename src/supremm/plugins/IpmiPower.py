@@ -15,34 +15,50 @@ class IpmiPower(Plugin):
     requiredMetrics = property(lambda x: ["ipmi.dcmi.power"])
     optionalMetrics = property(lambda x: [])
     derivedMetrics = property(lambda x: [])
+    mergeable = property(lambda x: True)
+    blockmode = property(lambda x: True)
 
     def __init__(self, job):
         super(IpmiPower, self).__init__(job)
         self._data = {}
 
-    def process(self, nodemeta, timestamp, data, description):
-        """ Power measurements are similar to the memory measurements the first and last data points
-        are ignored and the statistics are computed over all of the other measurements.
+    def merge(self, other):
+        self._data.update(other._data)
+
+    def process_block(self, nodemeta, timestamps, values, description):
+        """ Power measurements are similar to the memory measurements the first data point
+        is ignored and the statistics are computed over all of the other measurements.
         """
 
-        if not data or data[0].size == 0:
+        if not values or values[0].shape[1] == 0:
             return True
 
-        if data[0][0] < numpy.finfo(numpy.float64).eps:
-            # Some IPMI stacks return a zero value if they don't support power metrics
-            return False
+        valid = ~numpy.ma.getmaskarray(values[0][:, 0])
+        timestamps = timestamps[valid]
+        power = values[0][:, 0].compressed()
+
+        # Some IPMI stacks return a zero value if they don't support power metrics.
+        # No data is used after the first zero value.
+        zeros = numpy.flatnonzero(power < numpy.finfo(numpy.float64).eps)
+        if zeros.size > 0:
+            timestamps = timestamps[:zeros[0]]
+            power = power[:zeros[0]]
+
+        if power.size == 0:
+            return True
 
         if nodemeta.nodeindex not in self._data:
             self._data[nodemeta.nodeindex] = {
                 'power': RollingStats(),
-                'energy': Integrator(timestamp)
+                'energy': Integrator(timestamps[0])
             }
-            return True
+            timestamps = timestamps[1:]
+            power = power[1:]
 
         hdata = self._data[nodemeta.nodeindex]
 
-        hdata['power'].append(data[0][0])
-        hdata['energy'].add(timestamp, data[0][0])
+        hdata['power'].extend(power)
+        hdata['energy'].extend(timestamps, power)
 
         return True
 
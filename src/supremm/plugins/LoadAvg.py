@@ -13,24 +13,36 @@ class LoadAvg(Plugin):
     requiredMetrics = property(lambda x: ["kernel.all.load"])
     optionalMetrics = property(lambda x: [])
     derivedMetrics = property(lambda x: [])
+    requiredPreprocessors = property(lambda x: ["hinv"])
+    mergeable = property(lambda x: True)
+    blockmode = property(lambda x: True)
 
     def __init__(self, job):
         super(LoadAvg, self).__init__(job)
         self._data = {}
 
-    def process(self, nodemeta, timestamp, data, description):
+    def merge(self, other):
+        self._data.update(other._data)
+
+    def process_block(self, nodemeta, timestamps, values, description):
         """ Computes the mean and max values of the load average for each node
-           optionally normalizes this data to be per core (if the core count is available)
+           optionally normalizes this data to be per core (if the core count is available).
+           The first datapoint for each node is ignored.
         """
 
-        if data[0].size < 1:
+        if values[0].shape[1] < 1:
+            return True
+
+        load = values[0][:, 0].compressed()
+
+        if load.size < 1:
             return True
 
         if nodemeta.nodename not in self._data:
             self._data[nodemeta.nodename] = RollingStats()
-            return True
+            load = load[1:]
 
-        self._data[nodemeta.nodename].append(data[0][0])
+        self._data[nodemeta.nodename].extend(load)
 
         return True
 
@@ -33,9 +33,12 @@ class MemBwTimeseries(Plugin):
 
     name = property(lambda x: "membw")
     mode = property(lambda x: "timeseries")
+    version = property(lambda x: 2)
     requiredMetrics = property(lambda x: [SNB_METRICS, IVB_METRICS, NHM_METRICS])
     optionalMetrics = property(lambda x: [])
     derivedMetrics = property(lambda x: [])
+    requiredPreprocessors = property(lambda x: ["perf"])
+    subsample = property(lambda x: True)
 
     def __init__(self, job):
         super(MemBwTimeseries, self).__init__(job)
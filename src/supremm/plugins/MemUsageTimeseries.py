@@ -11,9 +11,11 @@ class MemUsageTimeseries(Plugin):
 
     name = property(lambda x: "memused_minus_diskcache")
     mode = property(lambda x: "timeseries")
+    version = property(lambda x: 2)
     requiredMetrics = property(lambda x: ["mem.numa.util.used", "mem.numa.util.filePages", "mem.numa.util.slab"])
     optionalMetrics = property(lambda x: [])
     derivedMetrics = property(lambda x: [])
+    subsample = property(lambda x: True)
 
     def __init__(self, job):
         super(MemUsageTimeseries, self).__init__(job)
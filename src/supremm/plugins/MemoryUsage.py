@@ -1,6 +1,8 @@
 #!/usr/bin/env python
 """ Memory usage plugin """
 
+import numpy
+
 from supremm.plugin import Plugin
 from supremm.statistics import RollingStats, calculate_stats
 from supremm.errors import ProcessingError
@@ -13,38 +15,39 @@ class MemoryUsage(Plugin):
     requiredMetrics = property(lambda x: ["mem.numa.util.used", "mem.numa.util.filePages", "mem.numa.util.slab", "kernel.percpu.cpu.user"])
     optionalMetrics = property(lambda x: [])
     derivedMetrics = property(lambda x: [])
+    mergeable = property(lambda x: True)
+    blockmode = property(lambda x: True)
 
     def __init__(self, job):
         super(MemoryUsage, self).__init__(job)
         self._data = {}
         self._hostcpucounts = {}
 
-    def process(self, nodemeta, timestamp, data, description):
+    def merge(self, other):
+        self._data.update(other._data)
+        self._hostcpucounts.update(other._hostcpucounts)
+
+    def process_block(self, nodemeta, timestamps, values, description):
         """ Memory statistics are the aritmetic mean of all values except the
-            first and last rather than storing all of the meory measurements for
-            the job, we use the RollingStats() class to keep track of the mean
-            values. Since we don't know which data point is the last one, we update
-            the RollingStats with the value from the previous timestep at each timestep.  
+            first and last. The memory usage is the sum over the numa nodes
+            at each timestep and the RollingStats() class keeps track of the
+            mean values.
         """
 
         if nodemeta.nodeindex not in self._data:
-            self._data[nodemeta.nodeindex] = {'usedval': None, 
-                                              'used': RollingStats(), 
-                                              'usedminusval': None, 
+            self._data[nodemeta.nodeindex] = {'used': RollingStats(),
                                               'usedminus': RollingStats()}
-            return True
 
-        if nodemeta.nodeindex not in self._hostcpucounts and data[3].size > 0:
-            self._hostcpucounts[nodemeta.nodeindex] = data[3].size
+        cpucounts = numpy.ma.count(values[3][1:], axis=1)
+        if nodemeta.nodeindex not in self._hostcpucounts and numpy.any(cpucounts):
+            self._hostcpucounts[nodemeta.nodeindex] = cpucounts[numpy.flatnonzero(cpucounts)[0]]
 
-        hdata = self._data[nodemeta.nodeindex]
+        used = values[0].filled(0).sum(axis=1)
+        usedminus = used - values[1].filled(0).sum(axis=1) - values[2].filled(0).sum(axis=1)
 
-        if hdata['usedval'] != None:
-            hdata['used'].append(hdata['usedval'])
-            hdata['usedminus'].append(hdata['usedminusval'])
-            
-        hdata['usedval'] = sum(data[0])
-        hdata['usedminusval'] = (sum(data[0]) - sum(data[1]) - sum(data[2]))
+        hdata = self._data[nodemeta.nodeindex]
+        hdata['used'].extend(used[1:-1])
+        hdata['usedminus'].extend(usedminus[1:-1])
 
         return True
 
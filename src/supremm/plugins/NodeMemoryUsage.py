@@ -13,11 +13,15 @@ class NodeMemoryUsage(Plugin):
     requiredMetrics = property(lambda x: [["mem.freemem", "mem.physmem"], ["mem.util.free", "hinv.physmem", "mem.util.cached"]])
     optionalMetrics = property(lambda x: [])
     derivedMetrics = property(lambda x: [])
+    mergeable = property(lambda x: True)
 
     def __init__(self, job):
         super(NodeMemoryUsage, self).__init__(job)
         self._data = {}
 
+    def merge(self, other):
+        self._data.update(other._data)
+
     def process(self, nodemeta, timestamp, data, description):
         """ Memory statistics are the aritmetic mean of all values except the
             first and last rather than storing all of the memory measurements for
@@ -13,9 +13,11 @@ class PowerUsageTimeseries(Plugin):
 
     name = property(lambda x: "power")
     mode = property(lambda x: "timeseries")
+    version = property(lambda x: 2)
     requiredMetrics = property(lambda x: ["ipmi.dcmi.power"])
     optionalMetrics = property(lambda x: [])
     derivedMetrics = property(lambda x: [])
+    subsample = property(lambda x: True)
 
     def __init__(self, job):
         super(PowerUsageTimeseries, self).__init__(job)
@@ -22,9 +22,12 @@ class SimdInsTimeseries(Plugin):
 
     name = property(lambda x: "simdins")
     mode = property(lambda x: "timeseries")
+    version = property(lambda x: 2)
     requiredMetrics = property(lambda x: [SNB_METRICS, NHM_METRICS, INTERLAGOS_METRICS])
     optionalMetrics = property(lambda x: [])
     derivedMetrics = property(lambda x: [])
+    requiredPreprocessors = property(lambda x: ["perf"])
+    subsample = property(lambda x: True)
 
     def __init__(self, job):
         super(SimdInsTimeseries, self).__init__(job)
@@ -14,6 +14,7 @@ class SlurmCgroupMemTimeseries(Plugin):
 
     name = property(lambda x: "process_mem_usage")
     mode = property(lambda x: "timeseries")
+    version = property(lambda x: 2)
     requiredMetrics = property(lambda x: ["cgroup.memory.usage"])
     optionalMetrics = property(lambda x: [])
     derivedMetrics = property(lambda x: [])
@@ -14,6 +14,7 @@ class SlurmCgroupMemory(Plugin):
 
     optionalMetrics = property(lambda x: [])
     derivedMetrics = property(lambda x: [])
+    mergeable = property(lambda x: True)
 
     def __init__(self, job):
         super(SlurmCgroupMemory, self).__init__(job)
@@ -21,6 +22,10 @@ class SlurmCgroupMemory(Plugin):
         self._hostcounts = {}
         self._expectedcgroup = "/slurm/uid_{0}/job_{1}".format(job.acct['uid'], job.job_id)
 
+    def merge(self, other):
+        self._data.update(other._data)
+        self._hostcounts.update(other._hostcounts)
+
     def process(self, nodemeta, timestamp, data, description):
         """ CGroup Memory statistics are the aritmetic mean of all values except the
             first. Rather than storing all of the meory measurements for
@@ -11,9 +11,11 @@ class TotalMemUsageTimeseries(Plugin):
 
     name = property(lambda x: "memused")
     mode = property(lambda x: "timeseries")
+    version = property(lambda x: 2)
     requiredMetrics = property(lambda x: ["mem.numa.util.used"])
     optionalMetrics = property(lambda x: [])
     derivedMetrics = property(lambda x: [])
+    subsample = property(lambda x: True)
 
     def __init__(self, job):
         super(TotalMemUsageTimeseries, self).__init__(job)
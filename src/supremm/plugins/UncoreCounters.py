@@ -37,6 +37,7 @@ class UncoreCounters(Plugin):
     requiredMetrics = property(lambda x: [SNB_METRICS, IVB_METRICS, NHM_METRICS, INTERLAGOS_METRICS])
     optionalMetrics = property(lambda x: [])
     derivedMetrics = property(lambda x: [])
+    requiredPreprocessors = property(lambda x: ["perf"])
 
     def __init__(self, job):
         super(UncoreCounters, self).__init__(job)
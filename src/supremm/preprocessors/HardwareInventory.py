@@ -14,6 +14,7 @@ class HardwareInventory(PreProcessor):
     requiredMetrics = property(lambda x: [["kernel.percpu.cpu.user"], ["hinv.ncpu"]])
     optionalMetrics = property(lambda x: [])
     derivedMetrics = property(lambda x: [])
+    mergeable = property(lambda x: True)
 
     def __init__(self, job):
         super(HardwareInventory, self).__init__(job)
@@ -22,6 +23,12 @@ class HardwareInventory(PreProcessor):
         self.data = {}
         self.cores = []
 
+    def merge(self, other):
+        self.data.update(other.data)
+        self.cores.extend(other.cores)
+
+        self._job.adddata(self.name, self.data)
+
     def hoststart(self, hostname):
         self.hostname = hostname
 
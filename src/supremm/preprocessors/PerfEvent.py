@@ -15,11 +15,19 @@ class PerfEvent(PreProcessor):
     requiredMetrics = property(lambda x: ["perfevent.active"])
     optionalMetrics = property(lambda x: [])
     derivedMetrics = property(lambda x: [])
+    mergeable = property(lambda x: True)
 
     def __init__(self, job):
         super(PerfEvent, self).__init__(job)
         self.perfactive = None
 
+    def merge(self, other):
+        # The counters are only valid if they were active on every host
+        if self.perfactive != False and other.perfactive != None:
+            self.perfactive = other.perfactive
+
+        self._job.adddata(self.name, {"active": self.perfactive})
+
     def hoststart(self, hostname):
         pass
 
@@ -30,6 +30,7 @@ class SlurmProc(PreProcessor):
 
     optionalMetrics = property(lambda x: ["cgroup.cpuset.cpus"])
     derivedMetrics = property(lambda x: [])
+    mergeable = property(lambda x: True)
 
     def __init__(self, job):
         super(SlurmProc, self).__init__(job)
@@ -45,6 +46,21 @@ class SlurmProc(PreProcessor):
 
         self.output = {"procDump": {"constrained": Counter(), "unconstrained": Counter()}, "cpusallowed": {}}
 
+    def merge(self, other):
+        self.output['procDump']['constrained'].update(other.output['procDump']['constrained'])
+        self.output['procDump']['unconstrained'].update(other.output['procDump']['unconstrained'])
+        self.output['cpusallowed'].update(other.output['cpusallowed'])
+
+        if 'errors' in other.output:
+            if 'errors' not in self.output:
+                self.output['errors'] = {}
+            for hostname, errors in other.output['errors'].iteritems():
+                if hostname not in self.output['errors']:
+                    self.output['errors'][hostname] = set()
+                self.output['errors'][hostname].update(errors)
+
+        self._job.adddata(self.name, self.output)
+
     @staticmethod
     def slurmcgroupparser(s):
         """ Parse linux cgroup string for slurm-specific settings and extract
@@ -3,8 +3,9 @@
   Commandline options
 """
 from supremm.scripthelpers import parsetime
-from supremm.pcparchive import extract_and_merge_logs
+from supremm.pcparchive import extract_and_merge_logs, direct_read_logs, getextractmetrics, genoutputdir
 from supremm.summarize import Summarize
+from supremm.columncache import ColumnCache
 from supremm.errors import ProcessingError
 
 import sys
@@ -13,6 +14,7 @@ import os
 import time
 import datetime
 import logging
+import random
 
 def usage(has_mpi):
     """ print usage """
@@ -22,6 +24,26 @@ def usage(has_mpi):
     print "  -r --resource RES     process only jobs on the specified resource"
     if not has_mpi:
         print "  -t --threads THEADS   number of concurrent processes to create"
+        print "     --node-threads N   number of concurrent processes to use to summarize the"
+        print "                        nodes in a job (only used when --threads is 1)"
+        print "     --extract-threads N   maximum number of concurrent pmlogextract processes."
+        print "                           This is shared between the --threads processes"
+        print "     --prefetch K       extract the archives for up to K jobs ahead of the summarization."
+        print "                        The extraction, summarization and output run concurrently"
+        print "     --prefetch-threads N   number of jobs to extract concurrently when --prefetch is set"
+        print "     --schedule-window N   process each group of N jobs in order of decreasing predicted"
+        print "                           cost (nodes x walltime x archive size) rather than end time"
+        print "     --daemon SECONDS   keep running and summarize the jobs that have ended every SECONDS"
+        print "                        seconds. The plugins, worker processes and database connections"
+        print "                        are kept open between polls (cannot be used with a job id or time range)"
+        print "     --daemon-delay SECONDS   in daemon mode only summarize jobs that ended at least SECONDS ago"
+        print "                              so that their archives are available (default 300)"
+        print "     --journal FILE     record the completed jobs in FILE. A run that is restarted with"
+        print "                        the same journal resumes the time range from the last completed"
+        print "                        job end time and skips the jobs that were already completed"
+        print "     --incremental      only run the plugins and preprocessors whose version differs from"
+        print "                        the version used for the existing summary of each job and merge"
+        print "                        the results into the existing summary"
     print "  -d --debug            set log level to debug"
     print "  -q --quiet            only log errors"
     print "  -s --start TIME       process all jobs that ended after the provided start"
@@ -40,6 +62,9 @@ def usage(has_mpi):
     print "  -M --max-nodes NODES  only process jobs with fewer than this many nodes"
     print "                        can be marked as processed even if the raw data is"
     print "                        absent"
+    print "     --shard-nodes N    split jobs with more than N nodes into shards of N nodes that are"
+    print "                        summarized by different workers and merged into one summary"
+    print "                        (only used with --threads and MPI)"
     print "     --min-duration SECONDS   only process jobs with a duration longer than SECONDS"
     print "                              (default no limit)"
     print "     --min-parallel-duration SECONDS   only process parallel jobs with a"
@@ -49,13 +74,28 @@ def usage(has_mpi):
     print "     --tag              tag to add to the summarization field in mongo"
     if has_mpi:
         print "     --dump-proclist    whether to output the MPI process information periodically"
+        print "     --prefetch K       number of jobs that are queued on each MPI worker (default 1)."
+        print "                        More jobs are requested when the queue is half empty"
     print "  -D --delete T|F       whether to delete job-level archives after processing."
     print "  -E --extract-only     only extract the job-level archives (sets delete=False)"
     print "  -L --use-lib-extract  use libpcp_pmlogextract.so.1 instead of pmlogextract"
+    print "     --direct-read      summarize directly from the raw archives for each node rather"
+    print "                        than extracting job-level archives with pmlogextract"
+    print "     --filter-metrics   only extract the metrics that are used by the plugins and"
+    print "                        preprocessors to the job-level archives"
+    print "     --batch N          summarize the jobs in batches of N jobs directly from the raw"
+    print "                        archives. Each raw archive is read once per batch"
     print "  -o --output DIR       override the output directory for the job archives."
     print "                        This directory will be emptied before used and no"
     print "                        subdirectories will be created. This option is ignored "
     print "                        if multiple jobs are to be processed."
+    print "     --fused-fetch      read each archive once for all of the plugins rather than once per plugin."
+    print "     --interleave N     process the records from all of the nodes in timestamp order for"
+    print "                        the plugins that support it for jobs with up to N nodes. The"
+    print "                        archive context and one record for each node are held in memory"
+    print "                        at once. Larger jobs are processed node by node."
+    print "     --profile RATE     record the time spent in each plugin and processing stage for the"
+    print "                        fraction RATE of the jobs (0 to 1) in summarization.profile"
     print "     --fail-fast        Don't suppress and log unknown exceptions during processing. Mainly used for testing."
     print "  -n --dry-run          process jobs but do not write to database."
     print "  -h --help             display this help message and exit."
@@ -73,6 +113,10 @@ def getoptions(has_mpi):
     retdata = {
         "log": logging.INFO,
         "threads": 1,
+        "node_threads": 1,
+        "extract_threads": 1,
+        "prefetch": 0,
+        "prefetch_threads": 1,
         "dodelete": True,
         "extractonly": False,
         "libextract": False,
@@ -94,13 +138,29 @@ def getoptions(has_mpi):
         "force_timeout": 2 * 24 * 3600,
         "resource": None,
         "dry_run": False,
-        "fail_fast": False
+        "fail_fast": False,
+        "fused_fetch": False,
+        "direct_read": False,
+        "filter_metrics": False,
+        "batch": 0,
+        "incremental": False,
+        "profile": 0.0,
+        "interleave": 0,
+        "schedule_window": 0,
+        "shard_nodes": 0,
+        "daemon": 0,
+        "daemon_delay": 300,
+        "journal": None
     }
 
     opts, _ = getopt(sys.argv[1:], "ABONCbP:M:j:r:t:dqs:e:LT:t:D:Eo:hn",
                      ["localjobid=",
                       "resource=",
                       "threads=",
+                      "node-threads=",
+                      "extract-threads=",
+                      "prefetch=",
+                      "prefetch-threads=",
                       "debug",
                       "quiet",
                       "start=",
@@ -126,7 +186,19 @@ def getoptions(has_mpi):
                       "output=",
                       "help",
                       "dry-run",
-                      "fail-fast"])
+                      "fail-fast",
+                      "fused-fetch",
+                      "direct-read",
+                      "filter-metrics",
+                      "batch=",
+                      "incremental",
+                      "profile=",
+                      "interleave=",
+                      "schedule-window=",
+                      "shard-nodes=",
+                      "daemon=",
+                      "daemon-delay=",
+                      "journal="])
 
     for opt in opts:
         if opt[0] in ("-j", "--localjobid"):
@@ -139,6 +211,14 @@ def getoptions(has_mpi):
             retdata['log'] = logging.ERROR
         if opt[0] in ("-t", "--threads"):
             retdata['threads'] = int(opt[1])
+        if opt[0] == "--node-threads":
+            retdata['node_threads'] = int(opt[1])
+        if opt[0] == "--extract-threads":
+            retdata['extract_threads'] = int(opt[1])
+        if opt[0] == "--prefetch":
+            retdata['prefetch'] = int(opt[1])
+        if opt[0] == "--prefetch-threads":
+            retdata['prefetch_threads'] = int(opt[1])
         if opt[0] in ("-s", "--start"):
             starttime = parsetime(opt[1])
         if opt[0] in ("-e", "--end"):
@@ -185,13 +265,48 @@ def getoptions(has_mpi):
             retdata["dry_run"] = True
         if opt[0] == "--fail-fast":
             retdata["fail_fast"] = True
+        if opt[0] == "--fused-fetch":
+            retdata["fused_fetch"] = True
+        if opt[0] == "--direct-read":
+            retdata["direct_read"] = True
+        if opt[0] == "--filter-metrics":
+            retdata["filter_metrics"] = True
+        if opt[0] == "--batch":
+            retdata["batch"] = int(opt[1])
+        if opt[0] == "--incremental":
+            retdata["incremental"] = True
+        if opt[0] == "--profile":
+            retdata["profile"] = float(opt[1])
+        if opt[0] == "--interleave":
+            retdata["interleave"] = int(opt[1])
+        if opt[0] == "--schedule-window":
+            retdata["schedule_window"] = int(opt[1])
+        if opt[0] == "--shard-nodes":
+            retdata["shard_nodes"] = int(opt[1])
+        if opt[0] == "--daemon":
+            retdata["daemon"] = int(opt[1])
+        if opt[0] == "--daemon-delay":
+            retdata["daemon_delay"] = int(opt[1])
+        if opt[0] == "--journal":
+            retdata["journal"] = opt[1]
         if opt[0] in ("-h", "--help"):
             usage(has_mpi)
             sys.exit(0)
 
+    if has_mpi and (retdata['incremental'] or retdata['journal'] != None):
+        usage(has_mpi)
+        sys.exit(1)
+
+    if retdata['daemon'] > 0 and (has_mpi or localjobid != None or starttime != None or endtime != None):
+        # The daemon polls for all of the new jobs
+        usage(has_mpi)
+        sys.exit(1)
+
     if retdata['extractonly']:
-        # extract-only supresses archive delete
+        # extract-only supresses archive delete and needs the extracted archives
         retdata['dodelete'] = False
+        retdata['direct_read'] = False
+        retdata['batch'] = 0
 
     # If all options selected, treat as all to optimize the job selection query
     if retdata['process_bad'] and retdata['process_old'] and retdata['process_notdone'] and retdata['process_current']:
@@ -233,89 +348,148 @@ def getoptions(has_mpi):
     sys.exit(1)
 
 
-def summarizejob(job, conf, resconf, plugins, preprocs, opts):
+def summarizejob(job, conf, resconf, plugins, preprocs, opts, nodepool=None):
     """
     Main job processing, called for every job to be processed.
     Returns a tuple representing the results of summarizing:
     (summary dict, metadata dict, boolean success, error code if any).
+    If nodepool is provided it is used to summarize the nodes in parallel.
     """
 
-    mdata = {}
-    mergestart = time.time()
+    extracted = extractjob(job, conf, resconf, plugins, preprocs, opts)
+
+    if opts['extractonly']:
+        if extracted[1] != 0:
+            logging.error("Failure extracting logs for job %s", job.job_id)
+        return None
 
+    return summarizeextracted(job, conf, plugins, preprocs, opts, extracted, nodepool)
+
+
+def checkjob(job, opts):
+    """
+    Checks whether the job should be summarized. Returns (metadata dict, error
+    code) where the error code is None if the job is to be summarized and the
+    metadata records why the job was skipped otherwise.
+    """
+
+    mdata = {}
     summarizeerror = None
 
     if job.nodecount > 1 and opts['min_parallel_duration'] != None and job.walltime < opts['min_parallel_duration']:
-        mergeresult = 1
         mdata["skipped_parallel_too_short"] = True
         summarizeerror = ProcessingError.PARALLEL_TOO_SHORT
         # Was "skipped"
-        missingnodes = job.nodecount
         logging.info("Skipping %s, skipped_parallel_too_short", job.job_id)
     elif opts['min_duration'] != None and job.walltime < opts['min_duration']:
-        mergeresult = 1
         mdata["skipped_too_short"] = True
         summarizeerror = ProcessingError.TIME_TOO_SHORT
-        missingnodes = job.nodecount
         logging.info("Skipping %s, skipped_too_short", job.job_id)
     elif job.nodecount < 1:
-        mergeresult = 1
         mdata["skipped_invalid_nodecount"] = True
         summarizeerror = ProcessingError.INVALID_NODECOUNT
-        missingnodes = job.nodecount
         logging.info("Skipping %s, skipped_invalid_nodecount", job.job_id)
     elif not job.has_any_archives():
-        mergeresult = 1
         mdata["skipped_noarchives"] = True
         summarizeerror = ProcessingError.NO_ARCHIVES
-        missingnodes = job.nodecount
         logging.info("Skipping %s, skipped_noarchives", job.job_id)
     elif not job.has_enough_raw_archives():
-        mergeresult = 1
         mdata["skipped_rawarchives"] = True
         summarizeerror = ProcessingError.RAW_ARCHIVES
-        missingnodes = job.nodecount
         logging.info("Skipping %s, skipped_rawarchives", job.job_id)
     elif opts['max_nodes'] > 0 and job.nodecount > opts['max_nodes']:
-        mergeresult = 1
         mdata["skipped_job_too_big"] = True
         summarizeerror = ProcessingError.JOB_TOO_BIG
-        missingnodes = job.nodecount
         logging.info("Skipping %s, skipped_job_too_big", job.job_id)
     elif opts['max_nodetime'] != None and (job.nodecount * job.walltime) > opts['max_nodetime']:
-        mergeresult = 1
         mdata["skipped_job_nodehours"] = True
         summarizeerror = ProcessingError.JOB_TOO_MANY_NODEHOURS
-        missingnodes = job.nodecount
         logging.info("Skipping %s, skipped_job_too_big (node time)", job.job_id)
     elif opts['max_duration'] > 0 and job.walltime >= opts['max_duration']:
-        mergeresult = 1
         mdata["skipped_too_long"] = True
         summarizeerror = ProcessingError.TIME_TOO_LONG
-        missingnodes = job.nodecount
         logging.info("Skipping %s, skipped_too_long", job.job_id)
+
+    return mdata, summarizeerror
+
+
+def extractjob(job, conf, resconf, plugins, preprocs, opts):
+    """
+    First step of the job processing. Checks whether the job should be
+    summarized and extracts the job-level archives. Returns
+    (metadata dict, merge result, number of missing nodes, error code if any)
+    which is passed to summarizeextracted().
+    """
+
+    mergestart = time.time()
+
+    mdata, summarizeerror = checkjob(job, opts)
+
+    if summarizeerror != None:
+        mergeresult = 1
+        missingnodes = job.nodecount
+    elif opts['direct_read'] or columncached(job, conf, plugins, preprocs):
+        mergeresult = direct_read_logs(job)
+        missingnodes = -1.0 * mergeresult
     else:
-        mergeresult = extract_and_merge_logs(job, conf, resconf, opts)
+        metrics = getextractmetrics([x(job) for x in preprocs + plugins]) if opts['filter_metrics'] else None
+        mergeresult = extract_and_merge_logs(job, conf, resconf, opts, metrics)
         missingnodes = -1.0 * mergeresult
     mergeend = time.time()
 
-    if opts['extractonly']:
-        if mergeresult == 0:
-            return None
-        else:
-            logging.error("Failure extracting logs for job %s", job.job_id)
-            return None
+    mdata["mergetime"] = mergeend - mergestart
+
+    return mdata, mergeresult, missingnodes, summarizeerror
+
+
+def columncached(job, conf, plugins, preprocs):
+    """ returns whether the column cache has the data that the plugins and
+        preprocessors need for all of the nodes in the job. If so there is
+        no need to extract the job-level archives """
+
+    cache = ColumnCache.fromconfig(conf)
+    if cache is None:
+        return False
+
+    analytics = [x(job) for x in preprocs + plugins]
+    if any(len(x.derivedMetrics) > 0 for x in analytics):
+        return False
+
+    metricnames = getextractmetrics(analytics)
+    nodenames = [nodename for nodename, _ in job.rawarchives()]
+
+    return len(nodenames) > 0 and all(cache.covers(job, x, metricnames) for x in nodenames)
+
+
+def sampleprofile(opts):
+    """ returns whether a job is selected to be profiled """
+    return opts['profile'] > 0 and random.random() < opts['profile']
+
+
+def summarizeextracted(job, conf, plugins, preprocs, opts, extracted, nodepool=None, partials=None):
+    """
+    Second step of the job processing. Summarizes the job using the result
+    of extractjob(). If partials is provided then it is the list of the
+    Summarize objects for the node shards of the job, which are merged rather
+    than processing the archives. Returns the same tuple as summarizejob()
+    """
+
+    mdata, mergeresult, missingnodes, summarizeerror = extracted
 
     preprocessors = [x(job) for x in preprocs]
     analytics = [x(job) for x in plugins]
-    s = Summarize(preprocessors, analytics, job, conf, opts["fail_fast"])
+    profile = any(x.profiled for x in partials) if partials is not None else sampleprofile(opts)
+    s = Summarize(preprocessors, analytics, job, conf, opts["fail_fast"], opts["fused_fetch"], profile, opts["interleave"])
 
     enough_nodes = False
 
     if 0 == mergeresult or (job.nodecount != 0 and (missingnodes / job.nodecount < 0.05)):
         enough_nodes = True
         logging.info("Success for %s files in %s (%s/%s)", job.job_id, job.jobdir, missingnodes, job.nodecount)
-        s.process()
+        if partials is not None:
+            s.mergeshards(partials)
+        else:
+            s.process(nodepool)
     elif summarizeerror == None and job.nodecount != 0 and (missingnodes / job.nodecount >= 0.05):
         # Don't overwrite existing error
         # Don't have enough node data to even try summarization
@@ -323,8 +497,6 @@ def summarizejob(job, conf, resconf, plugins, preprocs, opts):
         logging.info("Skipping %s, skipped_pmlogextract_error", job.job_id)
         summarizeerror = ProcessingError.PMLOGEXTRACT_ERROR
 
-    mdata["mergetime"] = mergeend - mergestart
-
     if opts['tag'] != None:
         mdata['tag'] = opts['tag']
 
@@ -349,6 +521,127 @@ def summarizejob(job, conf, resconf, plugins, preprocs, opts):
     return s, mdata, success or force_success, summarizeerror
 
 
+def shardjob(job, conf, resconf, plugins, preprocs, opts):
+    """
+    Splits a job that has more than opts['shard_nodes'] nodes into node shards
+    that are summarized separately by summarizeshard(). Returns a list of
+    (shard job, job-level archive directory, profile) for the shards or None
+    if the job is not sharded. Jobs that are skipped by checkjob() and jobs
+    with plugins or preprocessors that do not support merging are not sharded.
+    """
+
+    if opts['shard_nodes'] < 1 or job.nodecount <= opts['shard_nodes'] or opts['extractonly']:
+        return None
+
+    if checkjob(job, opts)[1] != None:
+        return None
+
+    unmergeable = [x(job) for x in preprocs + plugins]
+    unmergeable = [x.name for x in unmergeable if not x.mergeable]
+    if len(unmergeable) > 0:
+        logging.info("Not sharding %s, plugins do not support merging: %s", job.job_id, ", ".join(unmergeable))
+        return None
+
+    # Each shard has its own subdirectory of the job directory since the
+    # directory is emptied before the archives are extracted
+    jobdir = genoutputdir(job, conf, resconf)
+    profile = sampleprofile(opts)
+
+    shards = []
+    for idx, shard in enumerate(job.shards(opts['shard_nodes'])):
+        shards.append((shard, os.path.join(jobdir, "shard-{0}".format(idx)), profile))
+
+    logging.info("Split %s into %s shards", job.job_id, len(shards))
+
+    return shards
+
+
+def summarizeshard(job, conf, resconf, plugins, preprocs, opts, jobdir, profile):
+    """
+    Extracts the archives and runs the plugins for the nodes in one shard of a
+    job from shardjob(). Returns the Summarize object with the partial results
+    which are merged by summarizeshards().
+    """
+
+    if opts['direct_read'] or columncached(job, conf, plugins, preprocs):
+        direct_read_logs(job)
+    else:
+        shardresconf = dict(resconf)
+        shardresconf['job_output_dir'] = jobdir
+        metrics = getextractmetrics([x(job) for x in preprocs + plugins]) if opts['filter_metrics'] else None
+        extract_and_merge_logs(job, conf, shardresconf, opts, metrics)
+
+    s = Summarize([x(job) for x in preprocs], [x(job) for x in plugins], job, conf, opts["fail_fast"], opts["fused_fetch"], profile, opts["interleave"])
+    s.process()
+
+    return s
+
+
+def summarizeshards(job, conf, plugins, preprocs, opts, partials, mergetime):
+    """
+    Final step of the processing of a sharded job. Merges the results for the
+    shards from summarizeshard() into the summary for the whole job. Shards
+    that failed are omitted from partials and their nodes are counted as
+    missing. Returns the same tuple as summarizejob()
+    """
+
+    missingnodes = float(job.nodecount)
+    for partial in partials:
+        for nodename, _, archive in partial.job.nodearchives():
+            job.addnodearchive(nodename, archive)
+            missingnodes -= 1
+        for error in partial.job.get_errors():
+            job.record_error(error)
+        if partial.job.jobdir != None:
+            job.setjobdir(os.path.dirname(partial.job.jobdir))
+
+    mdata = {"mergetime": mergetime, "shards": len(partials)}
+
+    return summarizeextracted(job, conf, plugins, preprocs, opts, (mdata, -1 * missingnodes, missingnodes, None), partials=partials)
+
+
+class ShardedJobs(object):
+    """
+    The jobs that have been split into node shards and the results that have
+    been received for their shards. A job is summarized by summarizeshards()
+    once the results for all of its shards are in.
+    """
+
+    def __init__(self, config, resconf, opts):
+        self.config = config
+        self.resconf = resconf
+        self.opts = opts
+        self._jobs = {}
+
+    def split(self, job, preprocs, plugins):
+        """ returns the list of shards from shardjob() for the job or None if the
+            job is not sharded """
+        shards = shardjob(job, self.config, self.resconf, plugins, preprocs, self.opts)
+        if shards is not None:
+            self._jobs[job.job_pk_id] = (job, preprocs, plugins, len(shards), [], time.time())
+        return shards
+
+    def __contains__(self, job):
+        return job.job_pk_id in self._jobs
+
+    def add(self, shard, partial):
+        """ add the result for a shard. partial is None if the shard failed.
+            Returns (job, summarizejob() result, summarize time) once the results
+            for all of the shards of the job have been received, otherwise None """
+
+        job, preprocs, plugins, count, partials, start = self._jobs[shard.job_pk_id]
+        partials.append(partial)
+        if len(partials) < count:
+            return None
+
+        del self._jobs[shard.job_pk_id]
+
+        partials = [x for x in partials if x is not None]
+        result = summarizeshards(job, self.config, plugins, preprocs, self.opts, partials, time.time() - start)
+
+        return job, result, time.time() - start
+
+
 def override_defaults(resconf, opts):
     """ Commandline options that override the configuration file settings """
     if 'job_output_dir' in opts and opts['job_output_dir'] != None:
@@ -371,3 +664,27 @@ def filter_plugins(resconf, preprocs, plugins):
         filtered_plugins = [x for x in plugins if x.__name__ not in resconf['plugin_blacklist']]
 
     return filtered_preprocs, filtered_plugins
+
+def stale_analytics(job, preprocs, plugins, versions):
+    """ Returns the preprocessors and plugins that need to be run to bring the
+        existing summary of a job up to date. versions is the dict of the
+        plugin and preprocessor versions that were used for the existing summary,
+        keyed by class name. A plugin is run if its version differs or if a preprocessor that it uses
+        has a different version. The preprocessors that the selected plugins use
+        are run with them.
+    """
+
+    current = lambda cls, inst: versions.get(cls.__name__) == inst.version
+
+    preprocinsts = [(x, x(job)) for x in preprocs]
+    stalepreprocs = set(inst.name for cls, inst in preprocinsts if not current(cls, inst))
+
+    selected = []
+    required = set(stalepreprocs)
+    for plugin in plugins:
+        inst = plugin(job)
+        if not current(plugin, inst) or stalepreprocs.intersection(inst.requiredPreprocessors):
+            selected.append(plugin)
+            required.update(inst.requiredPreprocessors)
+
+    return [x for x, inst in preprocinsts if inst.name in required], selected
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+""" Timing information for the summarization of jobs. A Profile records the
+    wall time and number of calls for each stage of the processing of each
+    plugin in a job. The profile is stored in the summarization section of the
+    job summary and the ProfileReport aggregates the profiles of all of the jobs
+    that were processed.
+"""
+
+import logging
+import os
+import re
+import time
+
+class Profile(object):
+    """ The wall time and number of calls for each (plugin, stage) in the
+        summarization of a job, the number of archive fetches and the size
+        of the archives that were read. The plugins are identified by class
+        name since the plugin names are not unique. The plugin is None for
+        stages that are not specific to a plugin """
+
+    def __init__(self):
+        self.timings = {}
+        self.archives = {}
+
+    @staticmethod
+    def now():
+        """ the start time for a call to add() """
+        return time.time()
+
+    def add(self, name, stage, start):
+        """ record a call to stage for the plugin that started at start. Returns
+            the end time so that consecutive stages can be recorded with one
+            call each """
+        end = time.time()
+        timing = self.timings.get((name, stage))
+        if timing is None:
+            self.timings[(name, stage)] = [1, end - start]
+        else:
+            timing[0] += 1
+            timing[1] += end - start
+        return end
+
+    def addarchive(self, archive):
+        """ record the size of the files of the archive (or list of archives or
+            directory) that was opened """
+        if isinstance(archive, list):
+            for path in archive:
+                self.addarchive(path)
+            return
+        self.archives[archive] = self.archives.get(archive, 0) + archivebytes(archive)
+
+    def merge(self, other):
+        """ add the timings from another profile of the same job """
+        for key, (calls, elapsed) in other.timings.iteritems():
+            timing = self.timings.setdefault(key, [0, 0.0])
+            timing[0] += calls
+            timing[1] += elapsed
+        for archive, nbytes in other.archives.iteritems():
+            self.archives[archive] = self.archives.get(archive, 0) + nbytes
+
+    def get(self):
+        """ returns the profile in the format that is stored in the summary. The
+            archives are stored as a list since the paths are not valid key names
+            in mongo """
+        stages = {}
+        plugins = {}
+        for (name, stage), (calls, elapsed) in self.timings.iteritems():
+            total = stages.setdefault(stage, {"calls": 0, "time": 0.0})
+            total["calls"] += calls
+            total["time"] += elapsed
+            if name != None:
+                plugins.setdefault(name, {})[stage] = {"calls": calls, "time": elapsed}
+
+        return {
+            "fetches": stages.get("fetch", {"calls": 0})["calls"],
+            "stages": stages,
+            "plugins": plugins,
+            "archives": [{"archive": x, "bytes": y} for x, y in sorted(self.archives.iteritems())]
+        }
+
+
+class NullProfile(object):
+    """ Used when the job is not profiled. Does not record anything """
+
+    @staticmethod
+    def now():
+        return 0
+
+    def add(self, name, stage, start):
+        return start
+
+    def addarchive(self, archive):
+        pass
+
+    def merge(self, other):
+        pass
+
+    def get(self):
+        return None
+
+
+def archivebytes(archive):
+    """ returns the total size of the files of a pcp archive. If archive is a
+        directory then the total size of the files in it """
+
+    if os.path.isdir(archive):
+        return sum(os.path.getsize(os.path.join(archive, x)) for x in os.listdir(archive))
+
+    dirname, basename = os.path.split(archive)
+    basename = re.sub(r"\.(meta|index|\d+)$", "", basename)
+    pattern = re.compile(r"^" + re.escape(basename) + r"\.(meta|index|\d+)$")
+
+    total = 0
+    try:
+        for filename in os.listdir(dirname or "."):
+            if pattern.match(filename):
+                total += os.path.getsize(os.path.join(dirname, filename))
+    except OSError:
+        pass
+
+    return total
+
+
+class ProfileReport(object):
+    """ Aggregate of the profiles of the jobs that were processed """
+
+    def __init__(self):
+        self.jobs = 0
+        self.fetches = 0
+        self.archivebytes = 0
+        self.stages = {}
+        self.plugins = {}
+
+    @staticmethod
+    def _addtiming(totals, key, timing):
+        total = totals.setdefault(key, [0, 0.0])
+        total[0] += timing["calls"]
+        total[1] += timing["time"]
+
+    def add(self, profile):
+        """ add the profile from the summary of a job """
+        self.jobs += 1
+        self.fetches += profile["fetches"]
+        self.archivebytes += sum(x["bytes"] for x in profile["archives"])
+        for stage, timing in profile["stages"].iteritems():
+            self._addtiming(self.stages, stage, timing)
+        for name, stages in profile["plugins"].iteritems():
+            for stage, timing in stages.iteritems():
+                self._addtiming(self.plugins, (name, stage), timing)
+
+    def addstage(self, stage, elapsed):
+        """ add the time for a stage that is not part of the job profile (such
+            as the output of the summary) """
+        self._addtiming(self.stages, stage, {"calls": 1, "time": elapsed})
+
+    def log(self, top=20):
+        """ log the totals for each stage and the slowest plugin stages """
+        if self.jobs == 0:
+            return
+
+        logging.info("Profile: %s jobs, %s fetches, %.1f MB of archives", self.jobs, self.fetches, self.archivebytes / 1048576.0)
+        for stage, (calls, elapsed) in sorted(self.stages.iteritems(), key=lambda x: -x[1][1]):
+            logging.info("Profile stage %s: %s calls, %.2f s", stage, calls, elapsed)
+
+        slowest = sorted(self.plugins.iteritems(), key=lambda x: -x[1][1])[:top]
+        for (name, stage), (calls, elapsed) in slowest:
+            logging.info("Profile %s %s: %s calls, %.2f s, %.1f us/call", name, stage, calls, elapsed, 1.0e6 * elapsed / max(calls, 1))
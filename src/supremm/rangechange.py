@@ -3,16 +3,13 @@ import numpy
 
 class DataCache(object):
     """ Helper class that remembers the last value that it was passed """
-    def __init__(self):
+    def __init__(self, name='datacache'):
+        self.name = name
         self.mdata = None
         self.timestamp = None
         self.data = None
         self.description = None
 
-    def name(self):
-        """ returns the name """
-        return 'datacache'
-
     def process(self, mdata, timestamp, data, description):
         """ process call """
         self.mdata = mdata
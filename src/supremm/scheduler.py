@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+""" Ordering of the jobs to be summarized by their predicted cost. The jobs
+    are dispatched largest first within a bounded window so that a large job
+    does not start last and leave the other workers idle at the end of a run.
+"""
+
+import os
+
+def rawarchivebytes(archive):
+    """ returns the size of the metadata and first data volume of a raw
+        archive. This is used as an estimate of the amount of data that is
+        recorded for a node rather than the total size of the archive """
+
+    base = archive[:-6] if archive.endswith(".index") else archive
+
+    total = 0
+    for suffix in (".meta", ".0"):
+        try:
+            total += os.path.getsize(base + suffix)
+        except OSError:
+            pass
+
+    return total
+
+def estimate_cost(job):
+    """ returns the predicted cost of summarizing a job. This is the number of
+        node seconds scaled by the mean size of the raw archives for a node """
+
+    nodebytes = []
+    for _, archives in job.rawarchives():
+        nodebytes.append(sum(rawarchivebytes(x) for x in archives))
+
+    meanbytes = float(sum(nodebytes)) / len(nodebytes) if len(nodebytes) > 0 else 0.0
+
+    return max(job.nodecount, 1) * max(job.walltime, 1) * max(meanbytes, 1.0)
+
+def schedule_jobs(jobs, window, costfn=estimate_cost):
+    """ Reads up to window jobs at a time and yields them in order of
+        decreasing cost. The order of jobs in different windows is unchanged
+        so that every job is dispatched within window jobs of its original
+        position """
+
+    batch = []
+    for job in jobs:
+        batch.append((costfn(job), len(batch), job))
+        if len(batch) >= window:
+            for _, _, scheduled in sorted(batch, key=lambda x: (-x[0], x[1])):
+                yield scheduled
+            batch = []
+
+    for _, _, scheduled in sorted(batch, key=lambda x: (-x[0], x[1])):
+        yield scheduled
@@ -19,6 +19,18 @@ class Integrator(object):
         self._total = y * delta_x + self._total
         self._elapsed += delta_x
 
+    def extend(self, x, y):
+        """ Add arrays of data to the accumulator. Equivalent to calling add()
+            for each element in turn """
+        if len(x) == 0:
+            return
+
+        delta_x = numpy.diff(numpy.concatenate(([self._x0], x)))
+        self._x0 = x[-1]
+
+        self._total = numpy.sum(numpy.multiply(y.T, delta_x).T, axis=0) + self._total
+        self._elapsed += numpy.sum(delta_x)
+
     @property
     def total(self):
         """ get the total value """
@@ -85,6 +97,37 @@ class RollingStats(object):
             self.min = numpy.minimum(self.min, x)
             self.max = numpy.maximum(self.max, x)
 
+    def extend(self, values):
+        """ Add all of the values in the array. The first axis of the array
+            is the sample axis. The result is the same as calling append()
+            for each sample, but the stats are computed with numpy and combined
+            with the existing state """
+
+        nvalues = len(values)
+        if nvalues == 0:
+            return
+
+        values = numpy.asarray(values, dtype=numpy.float64)
+        mean = numpy.mean(values, axis=0)
+        sumsq = numpy.sum((values - mean) ** 2, axis=0)
+
+        if self._count == 0:
+            self.m = mean
+            self.s = sumsq
+            self.min = numpy.min(values, axis=0)
+            self.max = numpy.max(values, axis=0)
+        else:
+            total = self._count + nvalues
+            delta = mean - self.last_m
+            self.m = self.last_m + delta * nvalues / total
+            self.s = self.last_s + sumsq + delta * delta * self._count * nvalues / total
+            self.min = numpy.minimum(self.min, numpy.min(values, axis=0))
+            self.max = numpy.maximum(self.max, numpy.max(values, axis=0))
+
+        self._count += nvalues
+        self.last_m = self.m
+        self.last_s = self.s
+
     def get(self):
         """ return a dict with the various statistics """
         return {'avg': self.mean(), 'min': self.min, 'max': self.max, 'cnt': self._count, 'std': math.sqrt(self.variance())}
@@ -10,8 +10,8 @@ class TimeseriesAccumulator(object):
 
     def __init__(self, nhosts, totaltime):
         self._totaltime = totaltime
-        self._samplewindow = None
-        self._leadout = None
+        self._samplewindow = [None] * nhosts
+        self._leadout = [None] * nhosts
         self._data = numpy.empty((nhosts, TimeseriesAccumulator.MAX_DATAPOINTS, 2))
         self._count = numpy.zeros(nhosts, dtype=int)
 
@@ -21,6 +21,8 @@ class TimeseriesAccumulator(object):
         always added Then the sample interval is computed, and one datapoint
         per interval is collected Near the end of the job, all points are
         collected again (based on the amount of time to get the first LEAD_IN.
+        The sample interval is computed separately for each host so that the
+        datapoints for a host do not depend on the order the hosts are added.
 
         The sampling algorithm could be changed to try to capture more fine
         detail by changing the sample interval in response to the rate of
@@ -32,18 +34,32 @@ class TimeseriesAccumulator(object):
             idx = self._append(hostidx, timestamp, value)
             return idx
 
-        if self._samplewindow == None:
-            # compute sample window based on the first host to pass the post
+        if self._samplewindow[hostidx] == None:
+            # compute sample window based on the lead-in for the host
             leadin = self._data[hostidx, TimeseriesAccumulator.LEAD_IN_DATAPOINTS, 0] - self._data[hostidx, 0, 0]
-            self._samplewindow = (self._totaltime - (2.0 * leadin)) / (TimeseriesAccumulator.MAX_DATAPOINTS - 2 * TimeseriesAccumulator.LEAD_IN_DATAPOINTS)
-            self._leadout = self._data[hostidx, 0, 0] + self._totaltime - leadin
+            self._samplewindow[hostidx] = (self._totaltime - (2.0 * leadin)) / (TimeseriesAccumulator.MAX_DATAPOINTS - 2 * TimeseriesAccumulator.LEAD_IN_DATAPOINTS)
+            self._leadout[hostidx] = self._data[hostidx, 0, 0] + self._totaltime - leadin
 
-        if ((timestamp > self._leadout) or (timestamp > self._data[hostidx, self._count[hostidx] - 1, 0] + self._samplewindow)) and self._count[hostidx] < TimeseriesAccumulator.MAX_DATAPOINTS:
+        if ((timestamp > self._leadout[hostidx]) or (timestamp > self._data[hostidx, self._count[hostidx] - 1, 0] + self._samplewindow[hostidx])) and self._count[hostidx] < TimeseriesAccumulator.MAX_DATAPOINTS:
             idx = self._append(hostidx, timestamp, value)
             return idx
 
         return None
 
+    def adddatablock(self, hostidx, timestamps, values):
+        """ Add a block of datapoints for a host. Uses the same sampling algorithm
+            as adddata(). Returns a list of (insert index, block index) tuples for
+            the datapoints that were stored """
+        stored = []
+        for blockidx in xrange(len(timestamps)):
+            idx = self.adddata(hostidx, timestamps[blockidx], values[blockidx])
+            if idx != None:
+                stored.append((idx, blockidx))
+            elif self._count[hostidx] >= TimeseriesAccumulator.MAX_DATAPOINTS:
+                break
+
+        return stored
+
     def _append(self, hostidx, timestamp, value):
         """ Add this data to the store """
         insertidx = self._count[hostidx]
@@ -52,6 +68,15 @@ class TimeseriesAccumulator(object):
         self._count[hostidx] += 1
         return insertidx
 
+    def merge(self, other):
+        """ Add the datapoints from another accumulator. The two accumulators
+            must contain data for different hosts """
+        for hostidx in numpy.nonzero(other._count)[0]:
+            self._data[hostidx, :, :] = other._data[hostidx, :, :]
+            self._count[hostidx] = other._count[hostidx]
+            self._samplewindow[hostidx] = other._samplewindow[hostidx]
+            self._leadout[hostidx] = other._leadout[hostidx]
+
     def gethost(self, hostidx):
         """ return the data series """
         return self._data[hostidx, :self._count[hostidx], :]
@@ -64,6 +89,137 @@ class TimeseriesAccumulator(object):
         return str(self._data[:, :self._count, :])
 
 
+class TimeBucketStats(object):
+    """ Computes the minimum, maximum and median across the hosts of the rate of
+        change of a value in fixed width time buckets. The rate for a host in a
+        bucket is computed from its last datapoint in the bucket and its last
+        datapoint before the bucket. The statistics for a bucket are computed as
+        soon as every host has a rate for it and only the rates for the buckets
+        that are still waiting for hosts are stored. When the datapoints from
+        all of the hosts are added in timestamp order (see the interleave
+        option of Summarize) this is at most a couple of buckets. The results do
+        not depend on the order that the hosts are added.
+    """
+
+    def __init__(self, nhosts, start, totaltime, nbuckets=TimeseriesAccumulator.MAX_DATAPOINTS):
+        self._nhosts = nhosts
+        self._start = start
+        self._width = max(float(totaltime) / nbuckets, 1.0)
+        # (timestamp, value) of the last datapoint before the current bucket for each host
+        self._reference = {}
+        # (bucket, timestamp, value) of the last datapoint for each host
+        self._last = {}
+        # bucket -> {hostidx: rate} for the buckets that are missing hosts
+        self._pending = {}
+        # bucket -> (min, max, median) where each is a (rate, hostidx) tuple
+        self._stats = {}
+
+    def adddata(self, hostidx, timestamp, value):
+        """ Add a datapoint. The datapoints for each host must be added in
+            timestamp order """
+        bucket = int((timestamp - self._start) // self._width)
+
+        if hostidx not in self._reference:
+            self._reference[hostidx] = (timestamp, value)
+        elif self._last[hostidx][0] != bucket:
+            self._endbucket(hostidx)
+
+        self._last[hostidx] = (bucket, timestamp, value)
+
+    def _endbucket(self, hostidx):
+        """ Store the rate for the current bucket of the host """
+        bucket, timestamp, value = self._last.pop(hostidx)
+        reftime, refvalue = self._reference[hostidx]
+
+        if timestamp > reftime:
+            rates = self._pending.setdefault(bucket, {})
+            rates[hostidx] = (value - refvalue) / (timestamp - reftime)
+            if len(rates) == self._nhosts:
+                self._reduce(bucket)
+
+        self._reference[hostidx] = (timestamp, value)
+
+    def _reduce(self, bucket):
+        """ Replace the rates for the bucket with the statistics. Ties are broken
+            by the host index """
+        ordered = sorted((rate, hostidx) for hostidx, rate in self._pending.pop(bucket).iteritems())
+        self._stats[bucket] = (ordered[0], ordered[-1], ordered[len(ordered) / 2])
+
+    def pending(self):
+        """ The number of buckets that are waiting for data from more hosts """
+        return len(self._pending)
+
+    def merge(self, other):
+        """ Add the datapoints from another instance. The two instances must
+            contain data for different hosts """
+        self._reference.update(other._reference)
+        self._last.update(other._last)
+        self._stats.update(other._stats)
+        for bucket, rates in other._pending.iteritems():
+            mine = self._pending.setdefault(bucket, {})
+            mine.update(rates)
+            if len(mine) == self._nhosts:
+                self._reduce(bucket)
+
+    def get(self):
+        """ Returns the list of the end times of the buckets and the lists of the
+            [rate, hostidx] pairs for the minimum, maximum and median in each
+            bucket. The buckets that are missing hosts use the hosts that have
+            data. No more data can be added after this is called """
+        for hostidx in self._last.keys():
+            self._endbucket(hostidx)
+        for bucket in self._pending.keys():
+            self._reduce(bucket)
+
+        buckets = sorted(self._stats)
+        times = [self._start + (bucket + 1) * self._width for bucket in buckets]
+        stats = [[list(self._stats[bucket][i]) for bucket in buckets] for i in xrange(3)]
+
+        return times, stats[0], stats[1], stats[2]
+
+
+class SampleSchedule(object):
+    """ Computes which archive records a TimeseriesAccumulator would keep so
+        that the records in between do not need to be fetched. Every record is
+        used during the lead-in and lead-out and one record per sample window
+        in between. The sample window is computed from the lead-in in the same
+        way as the accumulator.
+    """
+
+    # The seek time is slightly after the end of the window so that the record
+    # is kept by the accumulator despite rounding of the timestamps
+    SEEK_MARGIN = 1.0
+
+    def __init__(self, totaltime):
+        self._totaltime = totaltime
+        self._first = None
+        self._count = 0
+        self._samplewindow = None
+        self._leadout = None
+
+    def nexttime(self, timestamp):
+        """ Called with the timestamp of each record that was used. Returns the
+            time to seek to for the next record or None if the next record
+            should be used """
+
+        self._count += 1
+        if self._count == 1:
+            self._first = timestamp
+
+        if self._count <= TimeseriesAccumulator.LEAD_IN_DATAPOINTS:
+            return None
+
+        if self._samplewindow == None:
+            leadin = timestamp - self._first
+            self._samplewindow = (self._totaltime - (2.0 * leadin)) / (TimeseriesAccumulator.MAX_DATAPOINTS - 2 * TimeseriesAccumulator.LEAD_IN_DATAPOINTS)
+            self._leadout = self._first + self._totaltime - leadin
+
+        if self._samplewindow <= 0 or timestamp >= self._leadout:
+            return None
+
+        return min(timestamp + self._samplewindow + SampleSchedule.SEEK_MARGIN, self._leadout)
+
+
 class RangeConverter(object):
     """
     Convert data from limited width to 64bit width. Optionally raise an exception if
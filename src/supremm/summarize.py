@@ -7,17 +7,27 @@ from ctypes import c_uint
 from pcp import pmapi
 import cpmapi as c_pmapi
 import time
+import heapq
 import logging
 import traceback
 from supremm.plugin import NodeMetadata
 from supremm.rangechange import RangeChange, DataCache
+from supremm.blockdata import BlockAccumulator, concatenateblocks
 from supremm.pcpcinterface import pcpcinterface
+from supremm import archivereader
+from supremm.pcparchive import RawArchiveSet, BoundedContext, getextractmetrics, get_timeval_from_timestamp
+from supremm.subsample import SampleSchedule
+from supremm.columncache import ColumnCache, ColumnContext
+from supremm.profiler import Profile, NullProfile
 
 import numpy
 import copy
 
 VERSION = "1.0.6"
-TIMESERIES_VERSION = 4
+TIMESERIES_VERSION = 5
+
+# Number of archive records that are fetched per call for blockmode analytics
+BLOCK_RECORDS = 1024
 
 
 class ArchiveMeta(NodeMetadata):
@@ -31,13 +41,89 @@ class ArchiveMeta(NodeMetadata):
     nodeindex = property(lambda self: self._nodeidx)
     archive = property(lambda self: self._archivedata)
 
+def summarizenode(args):
+    """ Summarize a single node archive for a job. This is called in a separate
+        process and returns the Summarize object with the per-node state """
+
+    preprocs, analytics, job, config, fail_fast, fused, profile, storecache, nodename, nodeidx, archive = args
+
+    s = Summarize([x(job) for x in preprocs], [x(job) for x in analytics], job, config, fail_fast, fused, profile)
+    if not storecache:
+        s.cacheanalytics = None
+    if s.processnode(nodename, nodeidx, archive):
+        s.archives_processed = 1
+
+    return s
+
+class FusedMember(object):
+    """ The per-analytic state for an analytic that is processed as part of
+        a FusedMetricSet """
+    def __init__(self, analytic, metric_id_array, mtypes, vsetidx, rangechange):
+        self.analytic = analytic
+        self.metric_id_array = metric_id_array
+        self.mtypes = mtypes
+        self.vsetidx = vsetidx
+        self.rangechange = rangechange
+        self.done = False
+
+        # Only used for firstlast analytics
+        self.firsttimestamp = None
+        # The DataCache for firstlast analytics or BlockAccumulator for blockmode analytics
+        self.datacache = None
+
+class FusedMetricSet(object):
+    """ The union of the metrics requested by several analytics. The archive is
+        fetched once per timestep for the union and each analytic is
+        passed the subset of the pmResult that contains its metrics """
+    def __init__(self):
+        self.metric_ids = []
+        self._position = {}
+        self.members = []
+
+    def add(self, analytic, metric_id_array, mtypes, rangechange):
+        """ add the analytic and its metrics to the set """
+        vsetidx = []
+        for pmid in metric_id_array:
+            if pmid not in self._position:
+                self._position[pmid] = len(self.metric_ids)
+                self.metric_ids.append(pmid)
+            vsetidx.append(self._position[pmid])
+
+        member = FusedMember(analytic, metric_id_array, mtypes, vsetidx, rangechange)
+        self.members.append(member)
+        return member
+
+    def fetcharray(self):
+        """ returns the c_type array of the union of the metrics """
+        metricarray = (c_uint * len(self.metric_ids))()
+        for i, pmid in enumerate(self.metric_ids):
+            metricarray[i] = pmid
+        return metricarray
+
+    def active(self):
+        """ returns the list of members that still want data """
+        return [x for x in self.members if not x.done]
+
+class InterleavedNode(object):
+    """ The open context for a node and the analytics that receive its records
+        when the nodes of a job are processed in timestamp order """
+    def __init__(self, archive, mdata, context, interface, metriccache, metricset):
+        self.archive = archive
+        self.mdata = mdata
+        self.context = context
+        self.interface = interface
+        self.metriccache = metriccache
+        self.metricset = metricset
+        self.fetcharray = metricset.fetcharray()
+        self.result = None
+
 class Summarize(object):
     """
     Summarize class is responsible for iteracting with the pmapi python code
     and managing the calls to the various analytics to process the data
     """
 
-    def __init__(self, preprocessors, analytics, job, config, fail_fast=False):
+    def __init__(self, preprocessors, analytics, job, config, fail_fast=False, fused=False, profile=False, interleave=0):
 
         self.preprocs = preprocessors
         self.alltimestamps = [x for x in analytics if x.mode in ("all", "timeseries")]
@@ -47,8 +133,45 @@ class Summarize(object):
         self.start = time.time()
         self.archives_processed = 0
         self.fail_fast = fail_fast
+        self.fused = fused
+        # Jobs with up to this many nodes are processed in interleaved mode
+        self.interleave = interleave
 
+        self.config = config
         self.rangechange = RangeChange(config)
+        self.metriccache = None
+
+        # The archives are read with libpcp unless the native reader is selected
+        # in the configuration. The interface is the module with the data
+        # extraction functions for the type of context.
+        try:
+            self.archivereader = config.getsection("summary").get("archive_reader", "pmapi")
+        except KeyError:
+            self.archivereader = "pmapi"
+        self.interface = pcpcinterface
+
+        # Decoded data for each node are stored in and read from the column
+        # cache if it is configured. The metrics for the cacheanalytics are
+        # stored, or nothing if it is None
+        self.columncache = ColumnCache.fromconfig(config)
+        self.cacheanalytics = self.preprocs + self.alltimestamps + self.firstlast
+
+        # The time spent in each stage of the processing is only recorded if
+        # the job is profiled
+        self.profile = Profile() if profile else NullProfile()
+
+    def __getstate__(self):
+        """ The per-node state is sent back from the worker processes. The
+            interface module and the metric cache for the open context cannot
+            be pickled and are not needed once the node is processed """
+        state = self.__dict__.copy()
+        del state['interface']
+        state['metriccache'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.interface = pcpcinterface
 
     def adderror(self, category, errormsg):
         """ All errors reported with this function show up in the job summary """
@@ -59,28 +182,294 @@ class Summarize(object):
         else:
             self.errors[category].add(errormsg)
 
-    def process(self):
-        """ Main entry point. All archives are processed """
+    def process(self, pool=None):
+        """ Main entry point. All archives are processed. If a process pool is
+            provided then the node archives are processed in parallel for the
+            plugins that support merging and in this process for the others.
+            Jobs with up to interleave nodes are processed in this process in
+            interleaved mode if any of the plugins support it """
+
+        if 0 < self.job.nodecount <= self.interleave and any(x.interleave and not x.blockmode for x in self.alltimestamps):
+            return self.processinterleaved()
+
+        if pool is not None:
+            parallel, serial = self.mergegroups()
+            if len(parallel) > 0:
+                return self.processparallel(pool, parallel, serial)
+
         success = 0
         self.archives_processed = 0
 
         for nodename, nodeidx, archive in self.job.nodearchives():
-            try:
-                self.processarchive(nodename, nodeidx, archive)
+            if self.processnode(nodename, nodeidx, archive):
                 self.archives_processed += 1
-            except pmapi.pmErr as exc:
+            else:
                 success -= 1
+
+        return success == 0
+
+    def processnode(self, nodename, nodeidx, archive):
+        """ process the archive for one node. Returns whether it was processed
+            successfully """
+        try:
+            self.processarchive(nodename, nodeidx, archive)
+            return True
+        except pmapi.pmErr as exc:
+            #pylint: disable=not-callable
+            self.adderror("archive", "{0}: pmapi.pmErr: {1}".format(archive, exc.message()))
+
+        except Exception as exc:
+            self.adderror("archive", "{0}: Exception: {1}. {2}".format(archive, str(exc), traceback.format_exc()))
+            if self.fail_fast:
+                raise
+
+        return False
+
+    def processinterleaved(self):
+        """ Process all of the nodes together. The preprocessors and the
+            analytics that do not support interleaving process each node in
+            turn. Then the records for the interleaving analytics from all of the
+            nodes are merged in timestamp order so that these analytics see the
+            data for all of the nodes at each time together. One record is
+            fetched at a time from each node for all of the interleaving
+            analytics, so the context and one record for every node of the job
+            are held in memory at once """
+
+        interleaved = [x for x in self.alltimestamps if x.interleave and not x.blockmode]
+
+        success = 0
+        self.archives_processed = 0
+
+        nodes = []
+        for nodename, nodeidx, archive in self.job.nodearchives():
+            try:
+                nodes.append(self.startnode(nodename, nodeidx, archive, interleaved))
+            except pmapi.pmErr as exc:
                 #pylint: disable=not-callable
                 self.adderror("archive", "{0}: pmapi.pmErr: {1}".format(archive, exc.message()))
-
-            except Exception as exc:
                 success -= 1
+            except Exception as exc:
                 self.adderror("archive", "{0}: Exception: {1}. {2}".format(archive, str(exc), traceback.format_exc()))
                 if self.fail_fast:
                     raise
+                success -= 1
+            finally:
+                self.metriccache = None
+
+        failed = self.mergenodes(nodes)
+
+        for node in nodes:
+            if node in failed:
+                success -= 1
+            else:
+                self.archives_processed += 1
+                if self.columncache is not None:
+                    self.updatecolumncache(node.mdata.nodename, node.archive, node.context)
+
+        for analytic in interleaved:
+            members = [x for node in nodes if node not in failed for x in node.metricset.members if x.analytic is analytic]
+            if len(members) > 0:
+                analytic.status = "complete"
 
         return success == 0
 
+    def startnode(self, nodename, nodeidx, archive, interleaved):
+        """ open the context for the node and run the preprocessors and the
+            analytics that are not interleaved. Returns the InterleavedNode with
+            the context positioned at the start for the interleaved analytics """
+
+        context, mdata = self.opennode(nodename, nodeidx, archive)
+
+        self.metriccache = self.interface.MetricCache(context)
+        self.metriccache.prime(self.preprocs + self.alltimestamps + self.firstlast)
+
+        for preproc in self.preprocs:
+            context.pmSetMode(c_pmapi.PM_MODE_FORW, mdata.archive.start, 0)
+            self.processforpreproc(context, mdata, preproc)
+
+        for analytic in self.alltimestamps:
+            if analytic not in interleaved:
+                context.pmSetMode(c_pmapi.PM_MODE_FORW, mdata.archive.start, 0)
+                self.processforanalytic(context, mdata, analytic)
+
+        for analytic in self.firstlast:
+            context.pmSetMode(c_pmapi.PM_MODE_FORW, mdata.archive.start, 0)
+            self.processfirstlast(context, mdata, analytic)
+
+        metricset = FusedMetricSet()
+        for analytic in interleaved:
+            metric_id_array, metricnames = self.interface.getmetricstofetch(context, analytic, self.metriccache)
+
+            if len(metric_id_array) == 0:
+                logging.debug("Skipping %s (%s)" % (type(analytic).__name__, analytic.name))
+                continue
+
+            rangechange = RangeChange(self.config)
+            rangechange.set_fetched_metrics(metricnames)
+
+            mtypes = self.interface.getmetrictypes(context, metric_id_array, self.metriccache)
+            metricset.add(analytic, metric_id_array, mtypes, rangechange)
+
+        context.pmSetMode(c_pmapi.PM_MODE_FORW, mdata.archive.start, 0)
+
+        return InterleavedNode(archive, mdata, context, self.interface, self.metriccache, metricset)
+
+    def mergenodes(self, nodes):
+        """ k-way merge of the records from the nodes. The record with the
+            earliest timestamp is passed to the interleaved analytics, then the
+            next record is fetched from the same node. Returns the set of nodes
+            that failed """
+
+        failed = set()
+        heap = []
+
+        def advance(node):
+            """ fetch the next record for the node and add it to the heap """
+            if len(node.metricset.active()) == 0:
+                return
+            try:
+                node.result = self.fetch(node.context, node.fetcharray, None)
+            except pmapi.pmErr as exc:
+                if exc.args[0] == c_pmapi.PM_ERR_EOL:
+                    return
+                raise
+            heapq.heappush(heap, (float(node.result.contents.timestamp), node.mdata.nodeindex, node))
+
+        def process(node):
+            """ pass the current record of the node to its analytics """
+            self.interface = node.interface
+            self.metriccache = node.metriccache
+            try:
+                numvals = self.interface.getnumvals(node.result)
+                for member in node.metricset.active():
+                    if all(numvals[k] == 0 for k in member.vsetidx):
+                        continue
+                    if False == self.runcallback(member.analytic, node.result, member.mtypes, node.context, node.mdata, member.metric_id_array, member.vsetidx, member.rangechange):
+                        member.done = True
+            finally:
+                node.context.pmFreeResult(node.result)
+                node.result = None
+
+        def run(func, node):
+            """ call func for the node. Errors are recorded and the node is
+                not processed any further """
+            try:
+                func(node)
+                return True
+            except pmapi.pmErr as exc:
+                #pylint: disable=not-callable
+                self.adderror("archive", "{0}: pmapi.pmErr: {1}".format(node.archive, exc.message()))
+            except Exception as exc:
+                self.adderror("archive", "{0}: Exception: {1}. {2}".format(node.archive, str(exc), traceback.format_exc()))
+                if self.fail_fast:
+                    raise
+            failed.add(node)
+            return False
+
+        try:
+            for node in nodes:
+                run(advance, node)
+
+            while len(heap) > 0:
+                _, _, node = heapq.heappop(heap)
+                if run(process, node):
+                    run(advance, node)
+        finally:
+            for _, _, node in heap:
+                node.context.pmFreeResult(node.result)
+            self.metriccache = None
+
+        return failed
+
+    def mergegroups(self):
+        """ Returns the list of the analytics whose state can be merged and the
+            list of the analytics that must process all of the nodes in turn.
+            The preprocessors run with both groups so none of the analytics are
+            merged unless all of the preprocessors support merging """
+        analytics = self.alltimestamps + self.firstlast
+        if not all(x.mergeable for x in self.preprocs):
+            return [], analytics
+        return [x for x in analytics if x.mergeable], [x for x in analytics if not x.mergeable]
+
+    def processparallel(self, pool, parallel, serial):
+        """ Process each node archive in a worker process with new instances
+            of the preprocessors and the parallel analytics. The per-node results
+            are then merged in node order. The serial analytics then process the
+            node archives in this process """
+
+        preprocs = [type(x) for x in self.preprocs]
+        analytics = [type(x) for x in parallel]
+
+        # The column cache is stored by the serial pass if there is one since
+        # it must contain the metrics for all of the analytics
+        storecache = len(serial) == 0
+
+        tasks = []
+        for nodename, nodeidx, archive in self.job.nodearchives():
+            tasks.append((preprocs, analytics, self.job, self.config, self.fail_fast, self.fused, self.profiled, storecache, nodename, nodeidx, archive))
+
+        processed = []
+        for partial in pool.imap(summarizenode, tasks):
+            processed.append(partial.archives_processed > 0)
+            self.merge(partial, parallel)
+
+        if len(serial) > 0:
+            processed = [x and y for x, y in zip(processed, self.processserial(serial))]
+
+        self.archives_processed = processed.count(True)
+
+        return all(processed)
+
+    def processserial(self, analytics):
+        """ Process the node archives in this process for the analytics. New
+            instances of the preprocessors are used since the state of the
+            preprocessors is merged from the workers. Returns the list of whether
+            each node was processed """
+
+        s = Summarize([type(x)(self.job) for x in self.preprocs], analytics, self.job, self.config, self.fail_fast, self.fused, self.profiled)
+        s.cacheanalytics = self.cacheanalytics
+
+        processed = [s.processnode(nodename, nodeidx, archive) for nodename, nodeidx, archive in self.job.nodearchives()]
+
+        for category, errors in s.errors.iteritems():
+            self.adderror(category, list(errors))
+        self.profile.merge(s.profile)
+
+        return processed
+
+    def mergeshards(self, partials):
+        """ Merge the instances that processed the node shards of the job (see
+            Job.shards()). Returns whether all of the nodes were processed """
+
+        self.archives_processed = 0
+        for partial in partials:
+            self.archives_processed += partial.archives_processed
+            self.start = min(self.start, partial.start)
+            self.merge(partial)
+
+        return self.complete()
+
+    profiled = property(lambda self: isinstance(self.profile, Profile))
+
+    def merge(self, other, analytics=None):
+        """ Merge the plugin state and errors from another instance that
+            processed different nodes from the same job. analytics is the list
+            of the analytics of this instance that the other instance has, in
+            the same order, if it does not have all of them """
+
+        if analytics is None:
+            analytics = self.alltimestamps + self.firstlast
+
+        for mine, theirs in zip(self.preprocs + analytics, other.preprocs + other.alltimestamps + other.firstlast):
+            mine.merge(theirs)
+            if theirs.status != "uninitialized":
+                mine.status = theirs.status
+
+        for category, errors in other.errors.iteritems():
+            self.adderror(category, list(errors))
+
+        self.profile.merge(other.profile)
+
     def complete(self):
         """ A job is complete if archives exist for all assigned nodes and they have
             been processed sucessfullly
@@ -105,20 +494,25 @@ class Summarize(object):
         if self.job.nodecount > 0:
             for analytic in self.alltimestamps:
                 if analytic.status != "uninitialized":
+                    start = self.profile.now()
                     if analytic.mode == "all":
                         output[analytic.name] = analytic.results()
                     if analytic.mode == "timeseries":
                         timeseries[analytic.name] = analytic.results()
+                    self.profile.add(type(analytic).__name__, "results", start)
             for analytic in self.firstlast:
                 if analytic.status != "uninitialized":
+                    start = self.profile.now()
                     output[analytic.name] = analytic.results()
+                    self.profile.add(type(analytic).__name__, "results", start)
                     
         output['summarization'] = {
             "version": VERSION,
             "elapsed": time.time() - self.start,
             "created": time.time(),
             "srcdir": self.job.jobdir,
-            "complete": self.complete()}
+            "complete": self.complete(),
+            "plugins": self.pluginversions()}
 
         output['created'] = datetime.datetime.utcnow()
 
@@ -131,10 +525,16 @@ class Summarize(object):
             output['timeseries'] = timeseries
 
         for preproc in self.preprocs:
+            start = self.profile.now()
             result = preproc.results()
+            self.profile.add(type(preproc).__name__, "results", start)
             if result != None:
                 output.update(result)
 
+        profile = self.profile.get()
+        if profile != None:
+            output['summarization']['profile'] = profile
+
         for source, data in self.job.data().iteritems():
             if 'errors' in data:
                 self.adderror(source, str(data['errors']))
@@ -146,12 +546,31 @@ class Summarize(object):
 
         return output
 
-    def runcallback(self, analytic, result, mtypes, ctx, mdata, metric_id_array):
+    def pluginversions(self):
+        """ returns the version of each plugin and preprocessor and the key of
+            its output in the summary. The plugin names are not unique (for
+            example a summary plugin and a timeseries plugin can have the same
+            name) so the class name is used """
+        versions = {}
+        for preproc in self.preprocs:
+            versions[type(preproc).__name__] = {"version": preproc.version, "output": None}
+        for analytic in self.alltimestamps + self.firstlast:
+            output = "timeseries." + analytic.name if analytic.mode == "timeseries" else analytic.name
+            versions[type(analytic).__name__] = {"version": analytic.version, "output": output}
+        return versions
+
+    def runcallback(self, analytic, result, mtypes, ctx, mdata, metric_id_array, vsetidx=None, rangechange=None):
         """ get the data and call the analytic """
 
+        if rangechange is None:
+            rangechange = self.rangechange
+
         def logerr(err):
             self.logerror(mdata.nodename, analytic.name, err)
-        data, description = pcpcinterface.extractValues(ctx, result, metric_id_array, mtypes, logerr)
+
+        start = self.profile.now()
+        data, description = self.interface.extractValues(ctx, result, metric_id_array, mtypes, logerr, vsetidx, self.metriccache)
+        start = self.profile.add(type(analytic).__name__, "extract", start)
 
         if data is None and description is None:
             return False
@@ -161,23 +580,41 @@ class Summarize(object):
             return True
 
         try:
-            self.rangechange.normalise_data(float(result.contents.timestamp), data)
+            rangechange.normalise_data(float(result.contents.timestamp), data)
+            start = self.profile.add(type(analytic).__name__, "normalise", start)
             retval = analytic.process(mdata, float(result.contents.timestamp), data, description)
+            self.profile.add(type(analytic).__name__, "process", start)
             return retval
         except Exception as e:
             logging.exception("%s %s @ %s", self.job.job_id, analytic.name, float(result.contents.timestamp))
             self.logerror(mdata.nodename, analytic.name, str(e))
             return False
 
-    def runpreproccall(self, preproc, result, mtypes, ctx, mdata, metric_id_array):
+    def runblockcallback(self, analytic, mdata, timestamps, values, description):
+        """ call the analytic with all of the data for the node """
+        start = self.profile.now()
+        try:
+            return analytic.process_block(mdata, timestamps, values, description)
+        except Exception as e:
+            logging.exception("%s %s block process", self.job.job_id, analytic.name)
+            self.logerror(mdata.nodename, analytic.name, str(e))
+            return False
+        finally:
+            self.profile.add(type(analytic).__name__, "process", start)
+
+    def runpreproccall(self, preproc, result, mtypes, ctx, mdata, metric_id_array, vsetidx=None):
         """ Call the pre-processor data processing function """
 
-        data, description = pcpcinterface.extractpreprocValues(ctx, result, metric_id_array, mtypes)
+        start = self.profile.now()
+        data, description = self.interface.extractpreprocValues(ctx, result, metric_id_array, mtypes, vsetidx, self.metriccache)
+        start = self.profile.add(type(preproc).__name__, "extract", start)
 
         if data is None and description is None:
             return False
 
-        return preproc.process(float(result.contents.timestamp), data, description)
+        retval = preproc.process(float(result.contents.timestamp), data, description)
+        self.profile.add(type(preproc).__name__, "process", start)
+        return retval
 
     def processforpreproc(self, ctx, mdata, preproc):
         """ fetch the data from the archive, reformat as a python data structure
@@ -185,7 +622,7 @@ class Summarize(object):
 
         preproc.hoststart(mdata.nodename)
 
-        metric_id_array, metricnames = pcpcinterface.getmetricstofetch(ctx, preproc)
+        metric_id_array, metricnames = self.interface.getmetricstofetch(ctx, preproc, self.metriccache)
 
         # Range correction is not performed for the pre-processors. They always
         # see the original data
@@ -196,13 +633,13 @@ class Summarize(object):
             preproc.hostend()
             return
 
-        mtypes = pcpcinterface.getmetrictypes(ctx, metric_id_array)
+        mtypes = self.interface.getmetrictypes(ctx, metric_id_array, self.metriccache)
 
         done = False
 
         while not done:
             try:
-                result = ctx.pmFetch(metric_id_array)
+                result = self.fetch(ctx, metric_id_array, type(preproc).__name__)
 
                 if False == self.runpreproccall(preproc, result, mtypes, ctx, mdata, metric_id_array):
                     # A return value of false from process indicates the computation
@@ -231,7 +668,7 @@ class Summarize(object):
         """ fetch the data from the archive, reformat as a python data structure
         and call the analytic process function """
 
-        metric_id_array, metricnames = pcpcinterface.getmetricstofetch(ctx, analytic)
+        metric_id_array, metricnames = self.interface.getmetricstofetch(ctx, analytic, self.metriccache)
 
         if len(metric_id_array) == 0:
             logging.debug("Skipping %s (%s)" % (type(analytic).__name__, analytic.name))
@@ -239,19 +676,40 @@ class Summarize(object):
 
         self.rangechange.set_fetched_metrics(metricnames)
 
-        mtypes = pcpcinterface.getmetrictypes(ctx, metric_id_array)
+        mtypes = self.interface.getmetrictypes(ctx, metric_id_array, self.metriccache)
+
+        # Only the records that the timeseries accumulator keeps are fetched for
+        # subsampling analytics. Range correction needs every record.
+        schedule = SampleSchedule(self.job.walltime) if analytic.subsample and self.rangechange.passthrough else None
+
+        if analytic.blockmode and schedule is None and self.rangechange.passthrough and None not in [self.interface.bufferdtype(x) for x in mtypes]:
+            try:
+                self.processrecordblocks(ctx, mdata, analytic, metric_id_array, mtypes)
+            except pmapi.pmErr as exp:
+                logging.warning("%s (%s) raised exception %s", type(analytic).__name__, analytic.name, str(exp))
+                analytic.status = "failure"
+                raise exp
+            analytic.status = "complete"
+            return
+
+        # Analytics in blockmode get all of the data for the node in one call
+        target = BlockAccumulator(analytic.name) if analytic.blockmode else analytic
 
         done = False
 
         while not done:
             result = None
             try:
-                result = ctx.pmFetch(metric_id_array)
+                result = self.fetch(ctx, metric_id_array, type(analytic).__name__)
 
-                if False == self.runcallback(analytic, result, mtypes, ctx, mdata, metric_id_array):
+                if False == self.runcallback(target, result, mtypes, ctx, mdata, metric_id_array):
                     # A return value of false from process indicates the computation
                     # failed and no more data should be sent.
                     done = True
+                elif schedule is not None:
+                    seekto = schedule.nexttime(float(result.contents.timestamp))
+                    if seekto != None:
+                        ctx.pmSetMode(c_pmapi.PM_MODE_FORW, get_timeval_from_timestamp(seekto), 0)
 
             except pmapi.pmErr as exp:
                 if exp.args[0] == c_pmapi.PM_ERR_EOL:
@@ -264,8 +722,74 @@ class Summarize(object):
                 if result != None:
                     ctx.pmFreeResult(result)
 
+        if analytic.blockmode and len(target.timestamps) > 0:
+            self.runblockcallback(analytic, mdata, *target.getblock())
+
         analytic.status = "complete"
 
+    def processrecordblocks(self, ctx, mdata, analytic, metric_id_array, mtypes):
+        """ fetch the data from the archive in blocks of records and call the
+            process_block function of the analytic """
+
+        maxinstances = max([len(self.metriccache.getinstances(x) or [None]) for x in metric_id_array])
+        block = self.interface.RecordBlock(mtypes, BLOCK_RECORDS, maxinstances)
+
+        # The records after the end of the time range of a bounded context
+        # are discarded
+        limit = ctx.end if isinstance(ctx, BoundedContext) else None
+
+        parts = []
+        while True:
+            start = self.profile.now()
+            status = self.interface.fetchblock(ctx, metric_id_array, block)
+            self.profile.add(type(analytic).__name__, "fetch", start)
+            if block.nrecords > 0:
+                parts.append(block.getrecords())
+                if limit != None and block.timestamps[block.nrecords - 1] > limit:
+                    break
+
+            if status == c_pmapi.PM_ERR_TOOBIG:
+                block.resize(2 * block.maxinstances)
+            elif status == c_pmapi.PM_ERR_EOL:
+                break
+            elif status < 0:
+                raise pmapi.pmErr(status)
+
+        if len(parts) == 0:
+            return
+
+        timestamps, values, instances = concatenateblocks(parts)
+
+        if limit != None:
+            inrange = timestamps <= limit
+            timestamps = timestamps[inrange]
+            values = [x[inrange] for x in values]
+            if len(timestamps) == 0:
+                return
+
+        description = []
+        for pmid, ids in zip(metric_id_array, instances):
+            names = self.metriccache.getinstances(pmid)
+            if names != None and any(x not in names for x in ids):
+                names = self.metriccache.getinstances(pmid, True)
+            if names == None:
+                names = {}
+            description.append([ids, [names.get(x) for x in ids]])
+
+        # The plugins get the same datatype as for process()
+        values = [x.astype(numpy.float64) for x in values]
+
+        self.runblockcallback(analytic, mdata, timestamps, values, description)
+
+    def fetch(self, ctx, metric_id_array, name):
+        """ fetch the next record from the context. The time is recorded in the
+            profile for the analytic with the class name (None for fused fetches) """
+        start = self.profile.now()
+        try:
+            return ctx.pmFetch(metric_id_array)
+        finally:
+            self.profile.add(name, "fetch", start)
+
     def logerror(self, archive, analyticname, pmerrorcode):
         """
         Store the detail of archive processing errors
@@ -278,17 +802,17 @@ class Summarize(object):
         """ fetch the data from the archive, reformat as a python data structure
         and call the analytic process function """
 
-        metric_id_array, metricnames = pcpcinterface.getmetricstofetch(ctx, analytic)
+        metric_id_array, metricnames = self.interface.getmetricstofetch(ctx, analytic, self.metriccache)
 
         if len(metric_id_array) == 0:
             return
 
         self.rangechange.set_fetched_metrics(metricnames)
 
-        mtypes = pcpcinterface.getmetrictypes(ctx, metric_id_array)
+        mtypes = self.interface.getmetrictypes(ctx, metric_id_array, self.metriccache)
 
         try:
-            result = ctx.pmFetch(metric_id_array)
+            result = self.fetch(ctx, metric_id_array, type(analytic).__name__)
             firstimestamp = copy.deepcopy(result.contents.timestamp)
 
             if False == self.runcallback(analytic, result, mtypes, ctx, mdata, metric_id_array):
@@ -302,10 +826,10 @@ class Summarize(object):
             if self.rangechange.passthrough == False:
                 # need to process every timestamp and only pass the last one to the plugin
                 done = False
-                datacache = DataCache()
+                datacache = DataCache(analytic.name)
                 while not done:
                     try:
-                        result = ctx.pmFetch(metric_id_array)
+                        result = self.fetch(ctx, metric_id_array, type(analytic).__name__)
                         if False == self.runcallback(datacache, result, mtypes, ctx, mdata, metric_id_array):
                             # A return value of false from process indicates the computation
                             # failed and no more data should be sent.
@@ -329,7 +853,7 @@ class Summarize(object):
             else:
                 ctx.pmSetMode(c_pmapi.PM_MODE_BACK, ctx.pmGetArchiveEnd(), 0)
 
-                result = ctx.pmFetch(metric_id_array)
+                result = self.fetch(ctx, metric_id_array, type(analytic).__name__)
 
                 if result.contents.timestamp.tv_sec == firstimestamp.tv_sec and result.contents.timestamp.tv_usec == firstimestamp.tv_usec:
                     # This achive must only contain one data point for these metrics
@@ -356,22 +880,286 @@ class Summarize(object):
                 logging.exception("%s", analytic.name)
                 raise e
 
+    def runfused(self, ctx, mdata, metricset, callback):
+        """ fetch the union of the metrics in the metricset once per timestep
+            and pass the result to the callback for every member that has
+            data in it. Stops at the end of the archive or when all of the
+            members are done """
+
+        fetcharray = metricset.fetcharray()
+
+        while True:
+            members = metricset.active()
+            if len(members) == 0:
+                break
+
+            result = None
+            try:
+                result = self.fetch(ctx, fetcharray, None)
+                numvals = self.interface.getnumvals(result)
+
+                for member in members:
+                    # The union may contain records that have none of the
+                    # metrics for this member. These would not have been
+                    # returned by a fetch of the member's own metrics.
+                    if all(numvals[k] == 0 for k in member.vsetidx):
+                        continue
+                    callback(member, result, ctx, mdata)
+
+            except pmapi.pmErr as exp:
+                if exp.args[0] == c_pmapi.PM_ERR_EOL:
+                    break
+                for member in members:
+                    logging.warning("%s (%s) raised exception %s", type(member.analytic).__name__, member.analytic.name, str(exp))
+                    member.analytic.status = "failure"
+                raise exp
+            finally:
+                if result != None:
+                    ctx.pmFreeResult(result)
+
+    def fusedpreproccallback(self, member, result, ctx, mdata):
+        """ process one timestep for a preprocessor in fused mode """
+        if False == self.runpreproccall(member.analytic, result, member.mtypes, ctx, mdata, member.metric_id_array, member.vsetidx):
+            member.done = True
+
+    def fusedanalyticcallback(self, member, result, ctx, mdata):
+        """ process one timestep for an analytic in fused mode """
+
+        if member.analytic.mode != "firstlast":
+            target = member.datacache if member.datacache != None else member.analytic
+            if False == self.runcallback(target, result, member.mtypes, ctx, mdata, member.metric_id_array, member.vsetidx, member.rangechange):
+                member.done = True
+            return
+
+        if member.firsttimestamp is None:
+            member.firsttimestamp = copy.deepcopy(result.contents.timestamp)
+            if False == self.runcallback(member.analytic, result, member.mtypes, ctx, mdata, member.metric_id_array, member.vsetidx, member.rangechange):
+                member.analytic.status = "failure"
+                member.done = True
+            elif member.rangechange.passthrough:
+                # The last datapoint is fetched directly once the archive has been read
+                member.done = True
+            else:
+                member.datacache = DataCache(member.analytic.name)
+            return
+
+        if False == self.runcallback(member.datacache, result, member.mtypes, ctx, mdata, member.metric_id_array, member.vsetidx, member.rangechange):
+            member.done = True
+
+    def processpreprocsfused(self, ctx, mdata):
+        """ run all of the preprocessors with a single pass through the archive """
+
+        metricset = FusedMetricSet()
+
+        for preproc in self.preprocs:
+            preproc.hoststart(mdata.nodename)
+
+            metric_id_array, _ = self.interface.getmetricstofetch(ctx, preproc, self.metriccache)
+            if len(metric_id_array) == 0:
+                logging.debug("Skipping %s (%s)" % (type(preproc).__name__, preproc.name))
+                preproc.hostend()
+                continue
+
+            mtypes = self.interface.getmetrictypes(ctx, metric_id_array, self.metriccache)
+            metricset.add(preproc, metric_id_array, mtypes, None)
+
+        try:
+            self.runfused(ctx, mdata, metricset, self.fusedpreproccallback)
+        except Exception:
+            for member in metricset.members:
+                member.analytic.status = "failure"
+                member.analytic.hostend()
+            raise
+
+        for member in metricset.members:
+            member.analytic.status = "complete"
+            member.analytic.hostend()
+
+    def processanalyticsfused(self, ctx, mdata):
+        """ run all of the analytics with a single pass through the archive. The
+            firstlast analytics that do not need range correction get their last
+            datapoint with one backwards fetch at the end """
+
+        metricset = FusedMetricSet()
+
+        for analytic in self.alltimestamps + self.firstlast:
+            metric_id_array, metricnames = self.interface.getmetricstofetch(ctx, analytic, self.metriccache)
+
+            if len(metric_id_array) == 0:
+                logging.debug("Skipping %s (%s)" % (type(analytic).__name__, analytic.name))
+                continue
+
+            rangechange = RangeChange(self.config)
+            rangechange.set_fetched_metrics(metricnames)
+
+            mtypes = self.interface.getmetrictypes(ctx, metric_id_array, self.metriccache)
+            member = metricset.add(analytic, metric_id_array, mtypes, rangechange)
+
+            if analytic.mode != "firstlast" and analytic.blockmode:
+                member.datacache = BlockAccumulator(analytic.name)
+
+        self.runfused(ctx, mdata, metricset, self.fusedanalyticcallback)
+
+        for member in metricset.members:
+            analytic = member.analytic
+
+            if analytic.mode != "firstlast":
+                if member.datacache != None and len(member.datacache.timestamps) > 0:
+                    self.runblockcallback(analytic, mdata, *member.datacache.getblock())
+                analytic.status = "complete"
+                continue
+
+            if member.firsttimestamp is None or analytic.status == "failure":
+                continue
+
+            if member.datacache != None:
+                if False == member.datacache.docallback(analytic):
+                    analytic.status = "failure"
+                else:
+                    analytic.status = "complete"
+                continue
+
+            self.processlast(ctx, mdata, member)
+
+    def processlast(self, ctx, mdata, member):
+        """ fetch the last datapoint in the archive for a firstlast analytic """
+
+        analytic = member.analytic
+        result = None
+        try:
+            ctx.pmSetMode(c_pmapi.PM_MODE_BACK, ctx.pmGetArchiveEnd(), 0)
+            result = self.fetch(ctx, member.metric_id_array, type(analytic).__name__)
+
+            if result.contents.timestamp.tv_sec == member.firsttimestamp.tv_sec and result.contents.timestamp.tv_usec == member.firsttimestamp.tv_usec:
+                # This achive must only contain one data point for these metrics
+                return
+
+            if False == self.runcallback(analytic, result, member.mtypes, ctx, mdata, member.metric_id_array, None, member.rangechange):
+                analytic.status = "failure"
+                return
+
+            analytic.status = "complete"
+
+        except pmapi.pmErr as e:
+            if e.args[0] != c_pmapi.PM_ERR_EOL:
+                logging.exception("%s", analytic.name)
+                raise e
+        finally:
+            if result != None:
+                ctx.pmFreeResult(result)
+
+    def opencontext(self, archive, nodename=None):
+        """ returns the context for the archive and the interface module to
+            use with it. The column cache is used if it has all of the metrics
+            for the node. Otherwise the native reader is used if it is
+            configured and it can read the archive, otherwise libpcp """
+
+        directread = isinstance(archive, RawArchiveSet)
+        derived = [x for x in self.preprocs + self.alltimestamps + self.firstlast if len(x.derivedMetrics) > 0]
+
+        if self.columncache is not None and nodename is not None and len(derived) == 0:
+            if self.columncache.covers(self.job, nodename, getextractmetrics(self.preprocs + self.alltimestamps + self.firstlast)):
+                try:
+                    return self.columncache.open(self.job, nodename), archivereader
+                except (archivereader.ArchiveError, IOError, ValueError) as exc:
+                    logging.debug("Column cache unavailable for %s (%s)", nodename, str(exc))
+
+        # The raw archives are always read with the native reader if possible
+        # since libpcp requires that the archives in a multi-archive context
+        # do not overlap
+        if self.archivereader == "native" or directread:
+            if len(derived) == 0:
+                try:
+                    return self.opennative(archive), archivereader
+                except archivereader.ArchiveError as exc:
+                    logging.debug("Native reader unavailable for %s (%s). Using libpcp", archive, str(exc))
+
+        if directread:
+            return BoundedContext(archive), pcpcinterface
+
+        return pmapi.pmContext(c_pmapi.PM_CONTEXT_ARCHIVE, archive), pcpcinterface
+
+    @staticmethod
+    def opennative(archive):
+        """ returns the archivereader.ArchiveContext for the archive """
+        if isinstance(archive, RawArchiveSet):
+            if archive.shared is not None:
+                decoded = [archive.shared.get(x) for x in archive.archives]
+                return archivereader.ArchiveContext(decoded, archive.start_timestamp, archive.end_timestamp)
+            return archivereader.ArchiveContext(archive.archives, archive.start_timestamp, archive.end_timestamp)
+        return archivereader.ArchiveContext(archive)
+
+    def updatecolumncache(self, nodename, archive, context):
+        """ store the decoded data for the node in the column cache """
+        if isinstance(context, ColumnContext) or self.cacheanalytics is None:
+            return
+        if len([x for x in self.cacheanalytics if len(x.derivedMetrics) > 0]) > 0:
+            return
+
+        try:
+            if not isinstance(context, archivereader.ArchiveContext):
+                context = self.opennative(archive)
+            self.columncache.store(self.job, nodename, context, getextractmetrics(self.cacheanalytics))
+        except archivereader.ArchiveError as exc:
+            logging.debug("Unable to add %s to the column cache (%s)", nodename, str(exc))
+
     def processarchive(self, nodename, nodeidx, archive):
         """ process the archive """
-        # TODO need to benchmark code to see if there is a benefit to interleaving the calls to
-        # pmFetch for the different contexts. This version runs all the pmFetches for each analytic
-        # in turn.
-        context = pmapi.pmContext(c_pmapi.PM_CONTEXT_ARCHIVE, archive)
-        mdata = ArchiveMeta(nodename, nodeidx, context.pmGetArchiveLabel())
+        # This version runs all the pmFetches for each analytic in turn. The
+        # interleave option fetches the records from all of the nodes in a job
+        # in timestamp order instead (see processinterleaved()).
+        context, mdata = self.opennode(nodename, nodeidx, archive)
+
+        self.processcontext(context, mdata)
+
+        if self.columncache is not None:
+            self.updatecolumncache(nodename, archive, context)
+
+    def opennode(self, nodename, nodeidx, archive):
+        """ open the context for the node archive. Sets the interface for the
+            context and returns the context and the ArchiveMeta """
+        start = self.profile.now()
+        context, self.interface = self.opencontext(archive, nodename)
+        self.profile.add(None, "open", start)
+
+        if isinstance(self.profile, Profile):
+            if isinstance(context, ColumnContext):
+                self.profile.addarchive(context.nodedir)
+            elif isinstance(archive, RawArchiveSet):
+                self.profile.addarchive(archive.archives)
+            else:
+                self.profile.addarchive(archive)
 
-        for preproc in self.preprocs:
-            context.pmSetMode(c_pmapi.PM_MODE_FORW, mdata.archive.start, 0)
-            self.processforpreproc(context, mdata, preproc)
+        return context, ArchiveMeta(nodename, nodeidx, context.pmGetArchiveLabel())
 
-        for analytic in self.alltimestamps:
-            context.pmSetMode(c_pmapi.PM_MODE_FORW, mdata.archive.start, 0)
-            self.processforanalytic(context, mdata, analytic)
+    def processcontext(self, context, mdata):
+        """ run all of the preprocessors and analytics on the data for the node """
 
-        for analytic in self.firstlast:
-            context.pmSetMode(c_pmapi.PM_MODE_FORW, mdata.archive.start, 0)
-            self.processfirstlast(context, mdata, analytic)
+        try:
+            # All of the metric names are looked up once for the archive
+            self.metriccache = self.interface.MetricCache(context)
+            self.metriccache.prime(self.preprocs + self.alltimestamps + self.firstlast)
+
+            if self.fused:
+                # Preprocessors must have processed all of the data before the
+                # analytics start since the analytics may use their results.
+                context.pmSetMode(c_pmapi.PM_MODE_FORW, mdata.archive.start, 0)
+                self.processpreprocsfused(context, mdata)
+
+                context.pmSetMode(c_pmapi.PM_MODE_FORW, mdata.archive.start, 0)
+                self.processanalyticsfused(context, mdata)
+                return
+
+            for preproc in self.preprocs:
+                context.pmSetMode(c_pmapi.PM_MODE_FORW, mdata.archive.start, 0)
+                self.processforpreproc(context, mdata, preproc)
+
+            for analytic in self.alltimestamps:
+                context.pmSetMode(c_pmapi.PM_MODE_FORW, mdata.archive.start, 0)
+                self.processforanalytic(context, mdata, analytic)
+
+            for analytic in self.firstlast:
+                context.pmSetMode(c_pmapi.PM_MODE_FORW, mdata.archive.start, 0)
+                self.processfirstlast(context, mdata, analytic)
+        finally:
+            self.metriccache = None
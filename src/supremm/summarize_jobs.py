@@ -3,32 +3,156 @@
     Main script for converting host-based pcp archives to job-level summaries.
 """
 
+import datetime
 import logging
 import os
 import shutil
+import sys
 import time
 import traceback
+import threading
+import Queue
 import multiprocessing as mp
 from supremm.config import Config
 from supremm.account import DbAcct
 from supremm.xdmodaccount import XDMoDAcct
 from supremm import outputter
 from supremm.plugin import loadplugins, loadpreprocessors
-from supremm.proc_common import getoptions, summarizejob, override_defaults, filter_plugins
+from supremm.proc_common import getoptions, summarizejob, extractjob, summarizeextracted, summarizeshard, override_defaults, filter_plugins, stale_analytics, ShardedJobs
 from supremm.scripthelpers import setuplogger
+from supremm.archivereader import SharedArchives
+from supremm.profiler import ProfileReport
+from supremm.scheduler import schedule_jobs
+from supremm.journal import Journal, NullJournal
 
 
-def get_jobs(opts, account):
+def get_jobs(opts, account, journal, poller=None):
     """
     Returns an iterable of Jobs from the appropriate method of Accounting,
-    as specified by the options
+    as specified by the options. In daemon mode the jobs are read by the
+    poller for the resource. A time range starts at the watermark in the
+    journal and the jobs that are completed in the journal are skipped
     """
-    if opts['mode'] == "single":
-        return account.getbylocaljobid(opts['local_job_id'])
+    if poller is not None:
+        jobs = poller.poll()
+    elif opts['mode'] == "single":
+        jobs = account.getbylocaljobid(opts['local_job_id'])
     elif opts['mode'] == "timerange":
-        return account.getbytimerange(opts['start'], opts['end'], opts)
+        start = opts['start']
+        if journal.watermark != None and datetime.datetime.fromtimestamp(journal.watermark) > start:
+            start = datetime.datetime.fromtimestamp(journal.watermark)
+            logging.info("Resuming from the journal watermark %s", start)
+        jobs = account.getbytimerange(start, opts['end'], opts)
     else:
-        return account.get(None, None)
+        jobs = account.get(None, None)
+
+    # The jobs are tracked in the order they are read
+    jobs = journal.track(jobs)
+
+    if opts['schedule_window'] > 1:
+        # Largest jobs first so that they do not finish last
+        return schedule_jobs(jobs, opts['schedule_window'])
+
+    return jobs
+
+
+def get_account(resconf, config):
+    """ returns the accounting interface for the resource """
+    if resconf['batch_system'] == "XDMoD":
+        return XDMoDAcct(resconf['resource_id'], config)
+    return DbAcct(resconf['resource_id'], config)
+
+
+class JobPoller(object):
+    """
+    Reads the jobs for a resource that ended since the previous poll in daemon
+    mode. The high-water mark is the end time of the earliest job that was read
+    and has not been completed, or the end time of the latest job that was read
+    if all of them were completed. The jobs that failed or were not processed
+    are read again by the next poll. Only jobs that ended at least delay
+    seconds ago are read. The poller is used as the journal for the resource so
+    that it is told when the jobs are completed. The completed jobs that end at
+    the high-water mark are returned by the next query as well so they are
+    skipped.
+    """
+
+    def __init__(self, dbif, delay, journal):
+        self.dbif = dbif
+        self.delay = delay
+        self.journal = journal
+        self.highwater = None
+        self._outstanding = {}
+        self._completed = {}
+        self._lastread = None
+        self._lock = threading.Lock()
+
+    watermark = property(lambda x: x.journal.watermark)
+
+    def poll(self):
+        """ yields the jobs that ended since the previous poll and the jobs
+            that were not completed by the previous poll """
+        with self._lock:
+            self._outstanding = {}
+
+        for job in self.dbif.get(self.highwater, int(time.time()) - self.delay):
+            with self._lock:
+                if job.job_pk_id in self._completed:
+                    continue
+                if self._lastread is None or job.acct['end_time'] > self._lastread:
+                    self._lastread = job.acct['end_time']
+            yield job
+
+        with self._lock:
+            self._advance()
+
+    def track(self, jobs):
+        """ yields the jobs that have not been completed in the journal and
+            records them as outstanding """
+        for job in self.journal.track(jobs):
+            with self._lock:
+                self._outstanding[job.job_pk_id] = job.acct['end_time']
+            yield job
+
+    def done(self, job):
+        """ record that a job has been completed """
+        self.journal.done(job)
+        with self._lock:
+            self._outstanding.pop(job.job_pk_id, None)
+            self._completed[job.job_pk_id] = job.acct['end_time']
+            self._advance()
+
+    def _advance(self):
+        """ move the high-water mark up to the earliest outstanding job. The
+            completed jobs that end before it are not read again """
+        if len(self._outstanding) > 0:
+            highwater = min(self._outstanding.itervalues())
+        else:
+            highwater = self._lastread
+
+        if highwater != self.highwater:
+            self.highwater = highwater
+            self._completed = dict((jobid, endtime) for jobid, endtime in self._completed.iteritems() if endtime >= highwater)
+
+
+def job_analytics(jobs, m, opts, preprocs, plugins, journal):
+    """
+    Yields each job with the preprocessors and plugins to run for it. In
+    incremental mode only the plugins that are out of date in the existing
+    summary are run and jobs that are up to date are skipped.
+    """
+    for job in jobs:
+        if not opts['incremental']:
+            yield job, preprocs, plugins
+            continue
+
+        jobpreprocs, jobplugins = stale_analytics(job, preprocs, plugins, m.getversions(job))
+        if len(jobpreprocs) == 0 and len(jobplugins) == 0:
+            logging.debug("Summary for job %s is up to date", job.job_id)
+            journal.done(job)
+            continue
+
+        logging.debug("Job %s incremental plugins: %s", job.job_id, ", ".join(x.__name__ for x in jobpreprocs + jobplugins))
+        yield job, jobpreprocs, jobplugins
 
 
 def clean_jobdir(opts, job):
@@ -37,25 +161,37 @@ def clean_jobdir(opts, job):
         shutil.rmtree(job.jobdir)
 
 
-def process_summary(m, dbif, opts, job, summarize_time, result):
+def process_summary(m, dbif, opts, job, summarize_time, result, report, journal):
     summary, mdata, success, summarize_error = result
     try:
+        # The outputter modifies the summary
+        profile = summary['summarization'].get('profile')
+
         # TODO: change behavior so markasdone only happens if this is successful
         outputter_start = time.time()
-        m.process(summary, mdata)
+        if opts['incremental']:
+            m.update(summary, mdata)
+        else:
+            m.process(summary, mdata)
         outputter_time = time.time() - outputter_start
 
+        if profile != None:
+            report.add(profile)
+            report.addstage("output", outputter_time)
+
         if not opts['dry_run']:
             # TODO: this attempts to emulate the old timing behavior. Keep it?
             process_time = summarize_time + outputter_time
             dbif.markasdone(job, success, process_time, summarize_error)
+
+        journal.done(job)
     except Exception as e:
         logging.error("Failure processing summary for job %s %s. Error: %s %s", job.job_id, job.jobdir, str(e), traceback.format_exc())
         if opts["fail_fast"]:
             raise
 
 
-def processjobs(config, opts, process_pool=None):
+def processjobs(config, opts, process_pool=None, node_pool=None):
     """ main function that does the work. One run of this function per process """
 
     allpreprocs = loadpreprocessors()
@@ -64,6 +200,7 @@ def processjobs(config, opts, process_pool=None):
     allplugins = loadplugins()
     logging.debug("Loaded %s plugins", len(allplugins))
 
+    resources = []
     for r, resconf in config.resourceconfigs():
         if opts['resource'] is None or opts['resource'] == r or opts['resource'] == str(resconf['resource_id']):
             logging.info("Processing resource %s", r)
@@ -76,71 +213,244 @@ def processjobs(config, opts, process_pool=None):
 
         logging.debug("Using %s preprocessors", len(preprocs))
         logging.debug("Using %s plugins", len(plugins))
-        if process_pool is not None:
-            process_resource_multiprocessing(resconf, preprocs, plugins, config, opts, process_pool)
-        else:
-            process_resource(resconf, preprocs, plugins, config, opts)
 
+        resources.append((resconf, preprocs, plugins))
 
-def process_resource(resconf, preprocs, plugins, config, opts):
-    with outputter.factory(config, resconf, dry_run=opts["dry_run"]) as m:
+    # The completed jobs are recorded in the journal so that an interrupted run can be resumed
+    journal = Journal(opts['journal']) if opts['journal'] != None else NullJournal()
 
-        if resconf['batch_system'] == "XDMoD":
-            dbif = XDMoDAcct(resconf['resource_id'], config)
-        else:
-            dbif = DbAcct(resconf['resource_id'], config)
+    try:
+        if opts['daemon'] > 0:
+            run_daemon(resources, config, opts, journal, process_pool, node_pool)
+            return
+
+        report = ProfileReport()
+
+        for resconf, preprocs, plugins in resources:
+            with outputter.factory(config, resconf, dry_run=opts["dry_run"]) as m:
+                dbif = get_account(resconf, config)
+                rjournal = journal.resource(resconf['resource_id'])
+                jobs = job_analytics(get_jobs(opts, dbif, rjournal), m, opts, preprocs, plugins, rjournal)
+                process_jobs(m, dbif, jobs, resconf, preprocs, plugins, config, opts, report, rjournal, process_pool, node_pool)
+
+        report.log()
+    finally:
+        journal.close()
+
+
+def process_jobs(m, dbif, jobs, resconf, preprocs, plugins, config, opts, report, journal, process_pool=None, node_pool=None):
+    """ summarize the jobs for a resource with the processing mode that is
+        selected by the options """
+    if opts['batch'] > 0:
+        process_resource_batched(m, dbif, jobs, resconf, config, opts, report, journal)
+    elif opts['prefetch'] > 0:
+        process_resource_pipelined(m, dbif, jobs, resconf, preprocs, plugins, config, opts, report, journal, process_pool, node_pool)
+    elif process_pool is not None:
+        process_resource_multiprocessing(m, dbif, jobs, resconf, preprocs, plugins, config, opts, report, journal, process_pool)
+    else:
+        process_resource(m, dbif, jobs, resconf, config, opts, report, journal, node_pool)
+
+
+def run_daemon(resources, config, opts, journal, process_pool=None, node_pool=None):
+    """
+    Summarize the jobs as they finish. The accounting database is polled every
+    opts['daemon'] seconds for the jobs that ended since the previous poll.
+    The plugins, worker pools, database connections and outputters are kept
+    open between the polls. The first poll reads all of the unprocessed jobs.
+    """
+
+    outputters = []
+    try:
+        pollers = []
+        for resconf, preprocs, plugins in resources:
+            m = outputter.factory(config, resconf, dry_run=opts["dry_run"])
+            outputters.append(m)
+            dbif = get_account(resconf, config)
+            pollers.append((resconf, preprocs, plugins, m.__enter__(), JobPoller(dbif, opts['daemon_delay'], journal.resource(resconf['resource_id']))))
+
+        while True:
+            pollstart = time.time()
+            report = ProfileReport()
+
+            for resconf, preprocs, plugins, m, poller in pollers:
+                try:
+                    jobs = job_analytics(get_jobs(opts, poller.dbif, poller, poller), m, opts, preprocs, plugins, poller)
+                    process_jobs(m, poller.dbif, jobs, resconf, preprocs, plugins, config, opts, report, poller, process_pool, node_pool)
+                except Exception as e:
+                    logging.error("Failure polling resource %s. Error: %s %s", resconf['name'], str(e), traceback.format_exc())
+                    if opts["fail_fast"]:
+                        raise
+                    # The database connections are reopened for the next poll
+                    poller.dbif = get_account(resconf, config)
+
+                logging.debug("Resource %s high-water mark %s", resconf['name'], poller.highwater)
+
+            report.log()
+            journal.flush()
+
+            time.sleep(max(0, opts['daemon'] - (time.time() - pollstart)))
+
+    finally:
+        for m in outputters:
+            m.__exit__(None, None, None)
+
+
+def process_resource(m, dbif, jobs, resconf, config, opts, report, journal, node_pool=None):
+    for job, jobpreprocs, jobplugins in jobs:
+        try:
+            summarize_start = time.time()
+            res = summarizejob(job, config, resconf, jobplugins, jobpreprocs, opts, node_pool)
+            if res is None:
+                continue  # Extract-only mode
+            s, mdata, success, s_err = res
+            summarize_time = time.time() - summarize_start
+            summary_dict = s.get()
+        except Exception as e:
+            logging.error("Failure for summarization of job %s %s. Error: %s %s", job.job_id, job.jobdir, str(e), traceback.format_exc())
+            clean_jobdir(opts, job)
+            if opts["fail_fast"]:
+                raise
+            else:
+                continue
+
+        process_summary(m, dbif, opts, job, summarize_time, (summary_dict, mdata, success, s_err), report, journal)
+        clean_jobdir(opts, job)
+
+
+def process_resource_multiprocessing(m, dbif, jobs, resconf, preprocs, plugins, config, opts, report, journal, pool):
+    # The shards of the large jobs are summarized by different workers and
+    # the results are merged here once all of the shards are done
+    sharded = ShardedJobs(config, resconf, opts)
 
-        for job in get_jobs(opts, dbif):
+    it = iter_tasks(jobs, resconf['name'], preprocs, plugins, sharded)
+    pool_iter = pool.imap_unordered(do_summarize_task, it)
+    while True:
+        try:
+            job, result, summarize_time = pool_iter.next(timeout=600000)
+        except StopIteration:
+            break
+
+        if job in sharded:
             try:
-                summarize_start = time.time()
-                res = summarizejob(job, config, resconf, plugins, preprocs, opts)
-                if res is None:
-                    continue  # Extract-only mode
-                s, mdata, success, s_err = res
-                summarize_time = time.time() - summarize_start
-                summary_dict = s.get()
+                merged = sharded.add(job, result)
             except Exception as e:
-                logging.error("Failure for summarization of job %s %s. Error: %s %s", job.job_id, job.jobdir, str(e), traceback.format_exc())
-                clean_jobdir(opts, job)
+                logging.error("Failure for merging the shards of job %s. Error: %s %s", job.job_id, str(e), traceback.format_exc())
                 if opts["fail_fast"]:
                     raise
-                else:
-                    continue
-
-            process_summary(m, dbif, opts, job, summarize_time, (summary_dict, mdata, success, s_err))
+                continue
+            if merged is None:
+                continue
+            job, (s, mdata, success, s_err), summarize_time = merged
+            result = (s.get(), mdata, success, s_err)
+
+        if result is not None:
+            process_summary(m, dbif, opts, job, summarize_time, result, report, journal)
+            clean_jobdir(opts, job)
+        else:
             clean_jobdir(opts, job)
 
 
-def process_resource_multiprocessing(resconf, preprocs, plugins, config, opts, pool):
-    with outputter.factory(config, resconf, dry_run=opts['dry_run']) as m:
-        if resconf['batch_system'] == "XDMoD":
-            dbif = XDMoDAcct(resconf['resource_id'], config)
+def iter_jobs(jobs, config, resconf, opts):
+    """
+    Combines the job iterator from job_analytics with the other information needed to pass to summarizejob.
+    """
+    for job, preprocs, plugins in jobs:
+        yield job, config, resconf, plugins, preprocs, opts
+
+
+def iter_tasks(jobs, resname, preprocs, plugins, sharded=None):
+    """
+    Yields the tasks for the job pool workers. The configuration and the plugins
+    are loaded once in each worker by init_worker() so a task only has the job,
+    the resource name and the names of the plugins for the job if they are not
+    the defaults for the resource. Jobs that are split into node shards by
+    sharded have a task for each shard with the job archive directory and
+    profile setting for the shard.
+    """
+    for job, jobpreprocs, jobplugins in jobs:
+        names = analytic_names(preprocs, plugins, jobpreprocs, jobplugins)
+        shards = sharded.split(job, jobpreprocs, jobplugins) if sharded is not None else None
+        if shards is None:
+            yield job, resname, names, None
         else:
-            dbif = DbAcct(resconf['resource_id'], config)
+            for shard, jobdir, profile in shards:
+                yield shard, resname, names, (jobdir, profile)
 
-        jobs = get_jobs(opts, dbif)
 
-        it = iter_jobs(jobs, config, resconf, plugins, preprocs, opts)
-        pool_iter = pool.imap_unordered(do_summarize, it)
-        while True:
-            try:
-                job, result, summarize_time = pool_iter.next(timeout=600000)
-            except StopIteration:
-                break
+def analytic_names(preprocs, plugins, jobpreprocs, jobplugins):
+    """ returns None if the preprocessors and plugins for a job are the defaults
+        for the resource, otherwise the names of the classes """
+    if jobpreprocs is preprocs and jobplugins is plugins:
+        return None
+    return [x.__name__ for x in jobpreprocs], [x.__name__ for x in jobplugins]
 
-            if result is not None:
-                process_summary(m, dbif, opts, job, summarize_time, result)
-                clean_jobdir(opts, job)
-            else:
-                clean_jobdir(opts, job)
 
+# The configuration and plugins in a job pool worker process. Set by init_worker()
+WORKER_STATE = {}
 
-def iter_jobs(jobs, config, resconf, plugins, preprocs, opts):
+
+def init_worker(config, opts):
     """
-    Combines the db cursor job iterator with the other information needed to pass to summarizejob.
+    Job pool initializer. Loads the plugins and preprocessors once in each
+    worker process.
     """
-    for job in jobs:
-        yield job, config, resconf, plugins, preprocs, opts
+    WORKER_STATE['config'] = config
+    WORKER_STATE['opts'] = opts
+    WORKER_STATE['preprocs'] = loadpreprocessors()
+    WORKER_STATE['plugins'] = loadplugins()
+    WORKER_STATE['resources'] = {}
+
+
+def worker_analytics(resname, names):
+    """
+    returns the resource configuration, preprocessors and plugins for a task in
+    a job pool worker process
+    """
+    if resname not in WORKER_STATE['resources']:
+        for r, resconf in WORKER_STATE['config'].resourceconfigs():
+            if r == resname:
+                resconf = override_defaults(resconf, WORKER_STATE['opts'])
+                preprocs, plugins = filter_plugins(resconf, WORKER_STATE['preprocs'], WORKER_STATE['plugins'])
+                WORKER_STATE['resources'][resname] = (resconf, preprocs, plugins)
+
+    resconf, preprocs, plugins = WORKER_STATE['resources'][resname]
+
+    if names is not None:
+        preprocnames, pluginnames = names
+        preprocs = [x for x in preprocs if x.__name__ in preprocnames]
+        plugins = [x for x in plugins if x.__name__ in pluginnames]
+
+    return resconf, preprocs, plugins
+
+
+def do_summarize_task(task):
+    """
+    summarize a job in a job pool worker process
+    """
+    job, resname, names, shard = task
+    resconf, preprocs, plugins = worker_analytics(resname, names)
+    if shard is not None:
+        jobdir, profile = shard
+        return do_summarizeshard((job, WORKER_STATE['config'], resconf, plugins, preprocs, WORKER_STATE['opts'], jobdir, profile))
+    return do_summarize((job, WORKER_STATE['config'], resconf, plugins, preprocs, WORKER_STATE['opts']))
+
+
+def do_summarizeshard(args):
+    """
+    summarize the nodes in one shard of a job. The partial results are
+    returned in place of the summary
+    """
+    job, config, resconf, plugins, preprocs, opts, jobdir, profile = args
+    try:
+        summarize_start = time.time()
+        partial = summarizeshard(job, config, resconf, plugins, preprocs, opts, jobdir, profile)
+    except Exception as e:
+        logging.error("Failure for summarization of a shard of job %s. Error: %s %s", job.job_id, str(e), traceback.format_exc())
+        if opts["fail_fast"]:
+            raise
+        return job, None, None
+
+    return job, partial, time.time() - summarize_start
 
 
 def do_summarize(args):
@@ -166,6 +476,282 @@ def do_summarize(args):
     return job, (summary_dict, mdata, success, s_err), summarize_time
 
 
+def process_resource_batched(m, dbif, jobs, resconf, config, opts, report, journal):
+    """ Process the jobs in batches of opts['batch'] jobs. The raw archives
+        that are used by several jobs in a batch are only read once """
+    batch = []
+    for item in jobs:
+        batch.append(item)
+        if len(batch) >= opts['batch']:
+            process_batch(m, dbif, batch, config, resconf, opts, report, journal)
+            batch = []
+
+    if len(batch) > 0:
+        process_batch(m, dbif, batch, config, resconf, opts, report, journal)
+
+
+def process_batch(m, dbif, jobs, config, resconf, opts, report, journal):
+    """
+    Summarize a batch of jobs directly from the raw archives. Each raw archive
+    is decoded once for the union of the time ranges of the jobs that use
+    it and each job reads the records in its own time range on each node.
+    jobs is a list of (job, preprocessors, plugins).
+    """
+
+    batchopts = dict(opts)
+    batchopts['direct_read'] = True
+
+    shared = SharedArchives()
+
+    extracted = []
+    for job, preprocs, plugins in jobs:
+        try:
+            result = extractjob(job, config, resconf, plugins, preprocs, batchopts)
+        except Exception as e:
+            logging.error("Failure for extraction of job %s. Error: %s %s", job.job_id, str(e), traceback.format_exc())
+            if opts["fail_fast"]:
+                raise
+            continue
+
+        for _, _, archiveset in job.nodearchives():
+            archiveset.shared = shared
+            for archive in archiveset.archives:
+                shared.add(archive, archiveset.start_timestamp, archiveset.end_timestamp)
+
+        extracted.append((job, preprocs, plugins, result))
+
+    for job, preprocs, plugins, result in extracted:
+        try:
+            summarize_start = time.time()
+            s, mdata, success, s_err = summarizeextracted(job, config, plugins, preprocs, batchopts, result)
+            summary_dict = s.get()
+            summarize_time = time.time() - summarize_start + mdata['mergetime']
+        except Exception as e:
+            logging.error("Failure for summarization of job %s. Error: %s %s", job.job_id, str(e), traceback.format_exc())
+            if opts["fail_fast"]:
+                raise
+            continue
+        finally:
+            # The decoded archives are closed once all of the jobs that use them are done
+            for _, _, archiveset in job.nodearchives():
+                for archive in archiveset.archives:
+                    shared.release(archive)
+
+        process_summary(m, dbif, opts, job, summarize_time, (summary_dict, mdata, success, s_err), report, journal)
+
+
+# Marks the end of the items in a pipeline queue
+PIPELINE_END = None
+
+
+class PipelineStage(object):
+    """
+    One stage of the pipelined job processing. The worker threads take items
+    from the input queue, call func and put the result on the output queue
+    (results that are None are dropped). The number of items, the time spent
+    processing and the time spent waiting for input are recorded.
+    """
+
+    def __init__(self, name, func, inqueue, outqueue, workers):
+        self.name = name
+        self.func = func
+        self.inqueue = inqueue
+        self.outqueue = outqueue
+        self.count = 0
+        self.busy = 0.0
+        self.waiting = 0.0
+        self.error = None
+        self._lock = threading.Lock()
+        self._running = workers
+        self._threads = []
+        for i in xrange(workers):
+            thread = threading.Thread(target=self._run, name="{0}-{1}".format(name, i))
+            thread.daemon = True
+            self._threads.append(thread)
+
+    def start(self):
+        """ start the worker threads """
+        for thread in self._threads:
+            thread.start()
+
+    def _run(self):
+        """ worker thread main loop """
+        while True:
+            waitstart = time.time()
+            item = self.inqueue.get()
+            start = time.time()
+
+            if item is PIPELINE_END:
+                # Let the other workers in this stage see the end marker
+                self.inqueue.put(PIPELINE_END)
+                break
+
+            result = None
+            try:
+                result = self.func(item)
+            except Exception:
+                logging.error("Pipeline stage %s failed. Error: %s", self.name, traceback.format_exc())
+                with self._lock:
+                    if self.error is None:
+                        self.error = sys.exc_info()
+
+            with self._lock:
+                self.count += 1
+                self.busy += time.time() - start
+                self.waiting += start - waitstart
+
+            if result is not None:
+                self.outqueue.put(result)
+
+        with self._lock:
+            self._running -= 1
+            last = self._running == 0
+
+        if last:
+            self.outqueue.put(PIPELINE_END)
+
+    def logtimes(self):
+        """ log the timing information for the stage """
+        logging.info("Pipeline stage %s: %s jobs, %.1f s busy, %.1f s waiting for input", self.name, self.count, self.busy, self.waiting)
+
+
+def feed_jobs(jobs, config, resconf, opts, outqueue):
+    """ put the jobs on the first queue of the pipeline. The database cursor is
+        only used by this thread """
+    try:
+        for args in iter_jobs(jobs, config, resconf, opts):
+            outqueue.put(args)
+    except Exception:
+        logging.error("Failure reading jobs. Error: %s", traceback.format_exc())
+    finally:
+        outqueue.put(PIPELINE_END)
+
+
+def do_extract(args):
+    """
+    prefetch stage of the pipeline. Extracts the job-level archives for the job
+    """
+    job, config, resconf, plugins, preprocs, opts = args
+    try:
+        extracted = extractjob(job, config, resconf, plugins, preprocs, opts)
+    except Exception as e:
+        logging.error("Failure for extraction of job %s %s. Error: %s %s", job.job_id, job.jobdir, str(e), traceback.format_exc())
+        clean_jobdir(opts, job)
+        if opts["fail_fast"]:
+            raise
+        return None
+
+    if opts['extractonly']:
+        if extracted[1] != 0:
+            logging.error("Failure extracting logs for job %s", job.job_id)
+        return None
+
+    return job, config, plugins, preprocs, opts, extracted
+
+
+def do_summarizeextracted(args, nodepool=None):
+    """
+    summarize stage of the pipeline. This is run in a separate process if
+    there is a process pool
+    """
+    job, config, plugins, preprocs, opts, extracted = args
+    try:
+        summarize_start = time.time()
+        s, mdata, success, s_err = summarizeextracted(job, config, plugins, preprocs, opts, extracted, nodepool)
+        summary_dict = s.get()
+        # The time includes the extraction to match summarizejob()
+        summarize_time = time.time() - summarize_start + mdata['mergetime']
+    except Exception as e:
+        logging.error("Failure for summarization of job %s %s. Error: %s %s", job.job_id, job.jobdir, str(e), traceback.format_exc())
+        if opts["fail_fast"]:
+            raise
+        return job, None, None
+
+    return job, (summary_dict, mdata, success, s_err), summarize_time
+
+
+def do_summarizeextracted_task(task):
+    """
+    summarize stage of the pipeline in a job pool worker process
+    """
+    job, resname, names, extracted = task
+    _, preprocs, plugins = worker_analytics(resname, names)
+    return do_summarizeextracted((job, WORKER_STATE['config'], plugins, preprocs, WORKER_STATE['opts'], extracted))
+
+
+def raise_stage_error(stages):
+    """ reraise the first exception from any of the pipeline stages """
+    for stage in stages:
+        if stage.error is not None:
+            raise stage.error[0], stage.error[1], stage.error[2]
+
+
+def process_resource_pipelined(m, dbif, jobs, resconf, preprocs, plugins, config, opts, report, journal, process_pool=None, node_pool=None):
+    """
+    Process the jobs with separate stages for the archive extraction, the
+    summarization and the output. The extraction runs up to opts['prefetch']
+    jobs ahead of the summarization so that the I/O for the extraction
+    overlaps with the summarization. The output is done by this thread.
+    """
+    jobqueue = Queue.Queue(opts['prefetch'])
+    extractedqueue = Queue.Queue(opts['prefetch'])
+    summarizedqueue = Queue.Queue(opts['prefetch'])
+
+    if process_pool is not None:
+        def summarize(args):
+            """ summarize the job in the job pool. Only the job and the extraction result are sent """
+            job, _, jobplugins, jobpreprocs, _, extracted = args
+            task = (job, resconf['name'], analytic_names(preprocs, plugins, jobpreprocs, jobplugins), extracted)
+            return process_pool.apply(do_summarizeextracted_task, (task,))
+        summarizeworkers = opts['threads']
+    else:
+        summarize = lambda args: do_summarizeextracted(args, node_pool)
+        summarizeworkers = 1
+
+    stages = [
+        PipelineStage("prefetch", do_extract, jobqueue, extractedqueue, opts['prefetch_threads']),
+        PipelineStage("summarize", summarize, extractedqueue, summarizedqueue, summarizeworkers)
+    ]
+
+    feeder = threading.Thread(target=feed_jobs, name="jobs", args=(jobs, config, resconf, opts, jobqueue))
+    feeder.daemon = True
+    feeder.start()
+
+    for stage in stages:
+        stage.start()
+
+    output_count = 0
+    output_busy = 0.0
+    output_waiting = 0.0
+
+    while True:
+        waitstart = time.time()
+        item = summarizedqueue.get()
+        start = time.time()
+        output_waiting += start - waitstart
+
+        if item is PIPELINE_END:
+            break
+
+        job, result, summarize_time = item
+        if result is not None:
+            process_summary(m, dbif, opts, job, summarize_time, result, report, journal)
+        clean_jobdir(opts, job)
+
+        output_count += 1
+        output_busy += time.time() - start
+
+        if opts['fail_fast']:
+            raise_stage_error(stages)
+
+    for stage in stages:
+        stage.logtimes()
+    logging.info("Pipeline stage output: %s jobs, %.1f s busy, %.1f s waiting for input", output_count, output_busy, output_waiting)
+
+    if opts['fail_fast']:
+        raise_stage_error(stages)
+
+
 def main():
     """
     main entry point for script
@@ -178,13 +764,20 @@ def main():
 
     threads = opts['threads']
 
-    process_pool = mp.Pool(threads) if threads > 1 else None
-    processjobs(config, opts, process_pool)
+    # The job pool workers load the configuration and plugins once
+    process_pool = mp.Pool(threads, init_worker, (config, opts)) if threads > 1 else None
 
-    if process_pool is not None:
-        # wait for all processes to finish
-        process_pool.close()
-        process_pool.join()
+    # The workers in the job pool cannot have child processes so the nodes
+    # in a job are only summarized in parallel when jobs are processed serially
+    node_pool = mp.Pool(opts['node_threads']) if threads == 1 and opts['node_threads'] > 1 else None
+
+    processjobs(config, opts, process_pool, node_pool)
+
+    for pool in (process_pool, node_pool):
+        if pool is not None:
+            # wait for all processes to finish
+            pool.close()
+            pool.join()
 
 
 if __name__ == "__main__":
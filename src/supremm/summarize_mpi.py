@@ -15,13 +15,23 @@ from supremm.account import DbAcct
 from supremm.xdmodaccount import XDMoDAcct
 from supremm import outputter
 from supremm.plugin import loadplugins, loadpreprocessors
-from supremm.proc_common import getoptions, summarizejob, override_defaults, filter_plugins
+from supremm.proc_common import getoptions, summarizejob, summarizeshard, override_defaults, filter_plugins, ShardedJobs
 from supremm.scripthelpers import setuplogger
 
 import sys
 import time
 import psutil
 import json
+from collections import deque
+
+# Message tags. The master sends batches of work and the shutdown message
+# in response to the requests from the workers. The workers send their
+# statistics when they are done
+TAG_WORK = 1
+TAG_REQUEST = 2
+TAG_SHUTDOWN = 3
+TAG_DONE = 4
+
 
 def processjobs(config, opts, procid, comm):
     """ main function that does the work. One run of this function per process """
@@ -52,119 +62,239 @@ def processjobs(config, opts, procid, comm):
             else:
                 dbif = DbAcct(resconf['resource_id'], config)
 
-            list_procs = 0
-
-            # Master
             if procid == 0:
-                getjobs = {}
-                if opts['mode'] == "single":
-                    getjobs['cmd'] = dbif.getbylocaljobid
-                    getjobs['opts'] = [opts['local_job_id'],]
-                elif opts['mode'] == "timerange":
-                    getjobs['cmd'] = dbif.getbytimerange
-                    getjobs['opts'] = [opts['start'], opts['end'], opts]
-                else:
-                    getjobs['cmd'] = dbif.get
-                    getjobs['opts'] = [None, None]
-
-                logging.debug("MASTER STARTING")
-                numworkers = opts['threads']-1
-                numsent = 0
-                numreceived = 0
-
-
-                for job in getjobs['cmd'](*(getjobs['opts'])):
-                    if numsent >= numworkers:
-                        list_procs += 1
-                        if opts['dump_proclist'] and (list_procs == 1 or list_procs == 1000):
-                            # Once all ranks are going, dump the process list for debugging
-                            logging.info("Dumping process list")
-                            allpinfo = {}
-                            for proc in psutil.process_iter():
-                                try:
-                                    pinfo = proc.as_dict()
-                                except psutil.NoSuchProcess:
-                                    pass
-                                else:
-                                    allpinfo[pinfo['pid']] = pinfo
-
-                            with open("rank-{}_{}.proclist".format(procid, list_procs), 'w') as outfile:
-                                json.dump(allpinfo, outfile, indent=2)
-
-                        # Wait for a worker to be done and then send more work
-                        process = comm.recv(source=MPI.ANY_SOURCE, tag=1)
-                        numreceived += 1
-                        comm.send(job, dest=process, tag=1)
-                        numsent += 1
-                        logging.debug("Sent new job: %d sent, %d received", numsent, numreceived)
-                    else:
-                        # Initial batch
-                        comm.send(job, dest=numsent+1, tag=1)
-                        numsent += 1
-                        logging.debug("Initial Batch: %d sent, %d received", numsent, numreceived)
-
-                logging.info("After all jobs sent: %d sent, %d received", numsent, numreceived)
-
-                # Get leftover results
-                while numsent > numreceived:
-                    comm.recv(source=MPI.ANY_SOURCE, tag=1)
-                    numreceived += 1
-                    logging.debug("Getting leftovers. %d sent, %d received", numsent, numreceived)
-
-                # Shut them down
-                for worker in xrange(numworkers):
-                    logging.debug("Shutting down: %d", worker+1)
-                    comm.send(None, dest=worker+1, tag=1)
-
-            # Worker
+                run_master(config, dbif, m, opts, plugins, preprocs, resconf, comm)
+            else:
+                run_worker(config, dbif, m, opts, plugins, preprocs, resconf, procid, comm)
+
+
+class WorkQueue(object):
+    """
+    The work that has been read from the job iterator on the master. Up to
+    one item per worker is read ahead of the work that is requested. The
+    batches get smaller once all of the work has been read so that the last
+    items are spread over the workers rather than queued on one of them
+    """
+
+    def __init__(self, work):
+        self._work = work
+        self._buffer = deque()
+        self.exhausted = False
+
+    def take(self, count, workers):
+        """ returns the next batch of up to count items for a worker. workers
+            is the number of workers that are still running """
+
+        while not self.exhausted and len(self._buffer) < count + workers:
+            try:
+                self._buffer.append(next(self._work))
+            except StopIteration:
+                self.exhausted = True
+
+        if self.exhausted:
+            count = min(count, max(1, len(self._buffer) // max(1, workers)))
+
+        return [self._buffer.popleft() for _ in xrange(min(count, len(self._buffer)))]
+
+
+def run_master(config, dbif, m, opts, plugins, preprocs, resconf, comm):
+    """ Sends the work to the workers in batches when they ask for it and
+        merges the results for the sharded jobs """
+
+    getjobs = {}
+    if opts['mode'] == "single":
+        getjobs['cmd'] = dbif.getbylocaljobid
+        getjobs['opts'] = [opts['local_job_id'],]
+    elif opts['mode'] == "timerange":
+        getjobs['cmd'] = dbif.getbytimerange
+        getjobs['opts'] = [opts['start'], opts['end'], opts]
+    else:
+        getjobs['cmd'] = dbif.get
+        getjobs['opts'] = [None, None]
+
+    logging.debug("MASTER STARTING")
+    numworkers = opts['threads']-1
+    running = numworkers
+    numsent = 0
+    numrequests = 0
+    busy = 0.0
+    start = time.time()
+
+    # The results for the shards of the large jobs are sent back
+    # to the master, which merges them and outputs the summary
+    sharded = ShardedJobs(config, resconf, opts)
+
+    work = WorkQueue(iter_work(getjobs['cmd'](*(getjobs['opts'])), sharded, preprocs, plugins))
+
+    # The batches are sent without waiting for the workers to receive them
+    sends = []
+    stats = {}
+
+    while running > 0:
+        status = MPI.Status()
+        process, count, results, workerstats = comm.recv(source=MPI.ANY_SOURCE, tag=MPI.ANY_TAG, status=status)
+        busystart = time.time()
+
+        for shard, partial in results:
+            process_shard(dbif, m, opts, sharded, shard, partial)
+
+        if status.Get_tag() == TAG_DONE:
+            running -= 1
+            stats[process] = workerstats
+        elif count > 0:
+            numrequests += 1
+            batch = work.take(count, running)
+            if len(batch) > 0:
+                sends.append(comm.isend(batch, dest=process, tag=TAG_WORK))
+                numsent += len(batch)
+                logging.debug("Sent %d items to %d: %d sent", len(batch), process, numsent)
+            else:
+                sends.append(comm.isend(None, dest=process, tag=TAG_SHUTDOWN))
+                logging.debug("Shutting down: %d", process)
+
+            if opts['dump_proclist'] and (numrequests == numworkers or numrequests == 1000):
+                # Once all ranks are going, dump the process list for debugging
+                dump_proclist(0, numrequests)
+
+        sends = [x for x in sends if not x.test()[0]]
+        busy += time.time() - busystart
+
+    for request in sends:
+        request.wait()
+
+    logging.info("After all jobs sent: %d sent in %d batches", numsent, numrequests)
+
+    elapsed = time.time() - start
+    logging.info("Rank 0: %.1f s busy, %.0f%% utilization", busy, 100.0 * busy / max(elapsed, 1.0e-6))
+    for process, (count, workerbusy, idle, workerelapsed) in sorted(stats.iteritems()):
+        logging.info("Rank %d: %d jobs, %.1f s busy, %.1f s waiting for work, %.0f%% utilization",
+                     process, count, workerbusy, idle, 100.0 * workerbusy / max(workerelapsed, 1.0e-6))
+
+
+def run_worker(config, dbif, m, opts, plugins, preprocs, resconf, procid, comm):
+    """ Processes the work from the master. Up to opts['prefetch'] items are
+        queued on the worker and more are requested when the queue is half
+        empty so that the next item is ready when the current one is done.
+        The worker only blocks waiting for the master when the queue is empty """
+
+    logging.debug("WORKER %d STARTING", procid)
+
+    prefetch = max(1, opts['prefetch'])
+    queue = deque()
+    shutdown = False
+    count = 0
+    busy = 0.0
+    idle = 0.0
+    start = time.time()
+
+    comm.send((procid, prefetch, [], None), dest=0, tag=TAG_REQUEST)
+    requested = True
+
+    while True:
+        while not shutdown and (len(queue) == 0 or comm.Iprobe(source=0)):
+            waitstart = time.time()
+            status = MPI.Status()
+            work = comm.recv(source=0, tag=MPI.ANY_TAG, status=status)
+            idle += time.time() - waitstart
+            requested = False
+            if status.Get_tag() == TAG_SHUTDOWN:
+                shutdown = True
             else:
-                sendtime = time.time()
-                midtime = time.time()
-                recvtime = time.time()
-                logging.debug("WORKER %d STARTING", procid)
-                while True:
-                    recvtries = 0
-                    while not comm.Iprobe(source=0, tag=1):
-                        if recvtries < 1000:
-                            recvtries += 1
-                            continue
-                        # Sleep so we can instrument how efficient we are
-                        # Otherwise, workers spin on exit at the hidden mpi_finalize call.
-                        # If you care about maximum performance and don't care about wasted cycles, remove the Iprobe/sleep loop
-                        # Empirically, a tight loop with time.sleep(0.001) uses ~1% CPU
-                        time.sleep(0.001)
-                    job = comm.recv(source=0, tag=1)
-                    recvtime = time.time()
-                    mpisendtime = midtime-sendtime
-                    mpirecvtime = recvtime-midtime
-                    if (mpisendtime+mpirecvtime) > 2:
-                        logging.warning("MPI send/recv took %s/%s", mpisendtime, mpirecvtime)
-                    if job != None:
-                        logging.debug("Rank: %s, Starting: %s", procid, job.job_id)
-                        process_job(config, dbif, job, m, opts, plugins, preprocs, resconf)
-                        logging.debug("Rank: %s, Finished: %s", procid, job.job_id)
-                        sendtime = time.time()
-                        comm.send(procid, dest=0, tag=1)
-                        midtime = time.time()
-
-                        list_procs += 1
-                        if opts['dump_proclist'] and (list_procs == 1 or list_procs == 10):
-                            # Once all ranks are going, dump the process list for debugging
-                            logging.info("Dumping process list")
-                            allpinfo = {}
-                            for proc in psutil.process_iter():
-                                try:
-                                    pinfo = proc.as_dict()
-                                except psutil.NoSuchProcess:
-                                    pass
-                                else:
-                                    allpinfo[pinfo['pid']] = pinfo
-
-                            with open("rank-{}_{}.proclist".format(procid, list_procs), 'w') as outfile:
-                                json.dump(allpinfo, outfile, indent=2)
-                    else:
-                        # Got shutdown message
-                        break
+                queue.extend(work)
+
+        if len(queue) == 0:
+            break
+
+        item = queue.popleft()
+
+        if not shutdown and not requested and len(queue) <= prefetch // 2:
+            comm.send((procid, prefetch - len(queue), [], None), dest=0, tag=TAG_REQUEST)
+            requested = True
+
+        busystart = time.time()
+        if isinstance(item, tuple):
+            # One shard of a job. The partial results are sent to the master
+            shard, jobdir, profile = item
+            logging.debug("Rank: %s, Starting shard: %s", procid, shard.job_id)
+            partial = summarize_shard(config, shard, opts, plugins, preprocs, resconf, jobdir, profile)
+            logging.debug("Rank: %s, Finished shard: %s", procid, shard.job_id)
+            comm.send((procid, 0, [(shard, partial)], None), dest=0, tag=TAG_REQUEST)
+        else:
+            logging.debug("Rank: %s, Starting: %s", procid, item.job_id)
+            process_job(config, dbif, item, m, opts, plugins, preprocs, resconf)
+            logging.debug("Rank: %s, Finished: %s", procid, item.job_id)
+        busy += time.time() - busystart
+
+        count += 1
+        if opts['dump_proclist'] and (count == 1 or count == 10):
+            # Once all ranks are going, dump the process list for debugging
+            dump_proclist(procid, count)
+
+    comm.send((procid, 0, [], (count, busy, idle, time.time() - start)), dest=0, tag=TAG_DONE)
+
+
+def dump_proclist(procid, count):
+    """ write the process list to a file for debugging """
+    logging.info("Dumping process list")
+    allpinfo = {}
+    for proc in psutil.process_iter():
+        try:
+            pinfo = proc.as_dict()
+        except psutil.NoSuchProcess:
+            pass
+        else:
+            allpinfo[pinfo['pid']] = pinfo
+
+    with open("rank-{}_{}.proclist".format(procid, count), 'w') as outfile:
+        json.dump(allpinfo, outfile, indent=2)
+
+
+def iter_work(jobs, sharded, preprocs, plugins):
+    """ Yields the work to send to the workers. This is either a job or, for
+        the jobs that are split into node shards, a (shard, job archive
+        directory, profile) tuple for each shard """
+    for job in jobs:
+        shards = sharded.split(job, preprocs, plugins)
+        if shards is None:
+            yield job
+        else:
+            for shard in shards:
+                yield shard
+
+
+def summarize_shard(config, shard, opts, plugins, preprocs, resconf, jobdir, profile):
+    """ Summarize one shard of a job on a worker. Returns the partial results
+        or None if the shard failed """
+    try:
+        return summarizeshard(shard, config, resconf, plugins, preprocs, opts, jobdir, profile)
+    except Exception as e:
+        logging.error("Failure for shard of job %s. Error: %s %s", shard.job_id, str(e), traceback.format_exc())
+        return None
+
+
+def process_shard(dbif, m, opts, sharded, shard, partial):
+    """ Called on the master with the result for a shard of a job. The job is
+        output once the results for all of its shards have been received """
+    job = None
+    try:
+        merged = sharded.add(shard, partial)
+        if merged is None:
+            return
+
+        job, (summary, mdata, success, summarize_error), summarize_time = merged
+
+        m.process(summary.get(), mdata)
+
+        if not opts['dry_run']:
+            dbif.markasdone(job, success, summarize_time, summarize_error)
+
+    except Exception as e:
+        logging.error("Failure for job %s. Error: %s %s", shard.job_id, str(e), traceback.format_exc())
+
+    finally:
+        if job is not None and opts['dodelete'] and job.jobdir is not None and os.path.exists(job.jobdir):
+            # Clean up
+            shutil.rmtree(job.jobdir)
 
 
 def process_job(config, dbif, job, m, opts, plugins, preprocs, resconf):
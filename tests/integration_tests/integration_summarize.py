@@ -0,0 +1,120 @@
+import os
+import json
+import pickle
+import multiprocessing
+
+from pcp import pmapi
+import cpmapi as c_pmapi
+
+from supremm.Job import Job
+from supremm.summarize import Summarize
+from supremm.plugin import loadplugins, loadpreprocessors
+from supremm.proc_common import summarizeshard, summarizeshards
+
+ARCHIVE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pcp_logs_extracted", "20161229.00.10")
+
+
+class NoConfig(object):
+    """ configuration without any of the optional sections """
+    def getsection(self, name):
+        raise KeyError(name)
+
+
+OPTS = {"direct_read": True, "fail_fast": False, "fused_fetch": False, "interleave": 0, "tag": None, "force_timeout": 2 * 86400}
+
+
+def makejob(nodecount, extracted=True):
+    """ job with nodecount nodes that all use the integration test archive """
+    context = pmapi.pmContext(c_pmapi.PM_CONTEXT_ARCHIVE, ARCHIVE)
+    start = int(float(context.pmGetArchiveLabel().start))
+    end = int(float(context.pmGetArchiveEnd()))
+
+    job = Job(1, "972366", {"nodes": nodecount, "start_time": start, "end_time": end})
+    nodenames = ["node{0}".format(x) for x in xrange(nodecount)]
+    job.set_nodes(nodenames)
+    job.set_rawarchives(dict((x, [ARCHIVE]) for x in nodenames))
+    if extracted:
+        for nodename in nodenames:
+            job.addnodearchive(nodename, ARCHIVE)
+
+    return job
+
+
+def summarize(job):
+    """ returns a Summarize for the job with all of the plugins """
+    return Summarize([x(job) for x in loadpreprocessors()], [x(job) for x in loadplugins()], job, NoConfig())
+
+
+def comparable(summary):
+    """ the summary without the fields that depend on when it was created """
+    summary = dict(summary)
+    del summary['created']
+    del summary['summarization']
+    return json.dumps(summary, sort_keys=True, default=lambda x: x.tolist() if hasattr(x, "tolist") else str(x))
+
+
+def test_pickle_processed():
+    s = summarize(makejob(2))
+    s.process()
+
+    restored = pickle.loads(pickle.dumps(s, pickle.HIGHEST_PROTOCOL))
+
+    assert restored.archives_processed == 2
+    assert comparable(restored.get()) == comparable(s.get())
+
+
+def test_processparallel():
+    serial = summarize(makejob(3))
+    serial.process()
+
+    # Only some of the plugins support merging so the others are run in
+    # this process
+    parallel = summarize(makejob(3))
+    assert all(len(x) > 0 for x in parallel.mergegroups())
+
+    pool = multiprocessing.Pool(2)
+    try:
+        parallel.process(pool)
+    finally:
+        pool.terminate()
+
+    assert parallel.archives_processed == 3
+    assert comparable(parallel.get()) == comparable(serial.get())
+
+def test_processinterleaved():
+    serial = summarize(makejob(3))
+    serial.process()
+
+    # The plugins that do not support interleaving process each node in turn
+    interleaved = summarize(makejob(3))
+    interleaved.interleave = 3
+    assert interleaved.process()
+
+    assert interleaved.archives_processed == 3
+    spread = interleaved.get()['timeseries']['gpfsspread']
+    assert 'error' not in spread
+    assert len(spread['times']) == len(spread['min']) == len(spread['max']) == len(spread['med'])
+    assert comparable(interleaved.get()) == comparable(serial.get())
+
+def test_summarizeshards():
+    preprocs = [x for x in loadpreprocessors() if x.mergeable]
+    plugins = [x for x in loadplugins() if x.mergeable]
+
+    serial = makejob(3)
+    s = Summarize([x(serial) for x in preprocs], [x(serial) for x in plugins], serial, NoConfig())
+    s.process()
+
+    job = makejob(3, extracted=False)
+    partials = []
+    for shard in job.shards(1):
+        partial = summarizeshard(shard, NoConfig(), {}, plugins, preprocs, OPTS, None, False)
+        # The partial results are sent back from the worker processes
+        partials.append(pickle.loads(pickle.dumps(partial, pickle.HIGHEST_PROTOCOL)))
+
+    merged, mdata, success, summarizeerror = summarizeshards(job, NoConfig(), plugins, preprocs, OPTS, partials, 0)
+
+    assert success
+    assert summarizeerror is None
+    assert mdata['shards'] == 3
+    assert merged.archives_processed == 3
+    assert comparable(merged.get()) == comparable(s.get())
@@ -24,3 +24,4 @@ EOF
 [[ $count -eq 4 ]]
 
 pytest tests/integration_tests/integration_plugin_api.py
+pytest tests/integration_tests/integration_summarize.py
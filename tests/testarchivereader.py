@@ -0,0 +1,105 @@
+import unittest
+import os
+import numpy
+import cpmapi as c_pmapi
+from supremm.archivereader import ArchiveReader, ArchiveContext, ArchiveError, MetricCache, SharedArchives, extractValues
+
+ARCHIVE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "integration_tests", "pcp_logs_extracted", "20161229.00.10")
+
+class TestArchiveReader(unittest.TestCase):
+
+    def setUp(self):
+        self.reader = ArchiveReader(ARCHIVE)
+
+    def tearDown(self):
+        self.reader.close()
+
+    def test_metadata(self):
+        self.assertEqual(self.reader.label.hostname, "cpn-p26-07.cbls.ccr.buffalo.edu")
+        self.assertEqual(self.reader.label.start.tv_sec, 1482988219)
+        self.assertEqual(self.reader.label.start.tv_usec, 797018)
+        self.assertEqual(self.reader.names["hinv.ncpu"], 0x0f000020)
+        self.assertEqual(self.reader.gettype(self.reader.names["gpfs.fsios.read_bytes"]), 3)
+        self.assertEqual(self.reader.getinstances(0x21c00000), {0: "gpfs0"})
+
+    def test_records(self):
+        records = list(self.reader.records())
+        self.assertEqual(len(records), 2910)
+
+        numval, insts, values = records[0][1][0x0f000020]
+        self.assertEqual(numval, 1)
+        self.assertEqual(list(insts), [-1])
+        self.assertEqual(list(values), [12])
+
+        numval, insts, values = records[1][1][self.reader.names["gpfs.fsios.writes"]]
+        self.assertEqual(list(insts), [0])
+        self.assertEqual(values.dtype, numpy.uint64)
+        self.assertEqual(list(values), [23504])
+
+    def test_seek(self):
+        start = 1483004899.85041
+        records = list(self.reader.records(start))
+        self.assertTrue(float(records[0][0]) >= start)
+        self.assertEqual(len(records), 2345)
+
+    def test_end(self):
+        self.assertEqual(self.reader.end().tv_sec, 1483074589)
+
+    def test_missing(self):
+        self.assertRaises(ArchiveError, ArchiveReader, ARCHIVE + "-missing")
+
+class TestArchiveContext(unittest.TestCase):
+
+    def test_fetch(self):
+        context = ArchiveContext(ARCHIVE)
+        cache = MetricCache(context)
+        pmids = cache.lookupnames(["gpfs.fsios.writes", "gpfs.fsios.read_bytes"])
+
+        context.pmSetMode(c_pmapi.PM_MODE_FORW, context.pmGetArchiveLabel().start, 0)
+        result = context.pmFetch(pmids)
+        data, description = extractValues(context, result, pmids, [3, 3], lambda x: None, None, cache)
+
+        self.assertEqual(list(data[0]), [23504.0])
+        self.assertEqual(list(data[1]), [0.0])
+        self.assertEqual(description[0][1], ["gpfs0"])
+
+        result = context.pmFetch(pmids)
+        _, description2 = extractValues(context, result, pmids, [3, 3], lambda x: None, None, cache)
+        self.assertTrue(description is description2)
+
+        context.reader.close()
+
+    def test_bounds(self):
+        start = 1483004899.85041
+        end = 1483010000.0
+        context = ArchiveContext([ARCHIVE], start, end)
+        self.assertEqual(context.pmGetArchiveLabel().start.tv_sec, 1483004899)
+
+        pmids = MetricCache(context).lookupnames(["gpfs.fsios.writes"])
+        context.pmSetMode(c_pmapi.PM_MODE_FORW, context.pmGetArchiveLabel().start, 0)
+        result = context.pmFetch(pmids)
+        self.assertTrue(float(result.timestamp) >= start)
+        self.assertTrue(float(context.pmGetArchiveEnd()) <= end)
+
+        context.reader.close()
+
+    def test_shared(self):
+        shared = SharedArchives()
+        shared.add(ARCHIVE, 1483004899.0, 1483010000.0)
+        shared.add(ARCHIVE, 1483000000.0, 1483005000.0)
+
+        decoded = shared.get(ARCHIVE)
+        self.assertTrue(decoded.times[0] >= 1483000000.0)
+        self.assertTrue(decoded.times[-1] <= 1483010000.0)
+
+        first = ArchiveContext([decoded], 1483004899.0, 1483010000.0)
+        second = ArchiveContext([shared.get(ARCHIVE)], 1483000000.0, 1483005000.0)
+        self.assertTrue(float(first.pmGetArchiveEnd()) <= 1483010000.0)
+        self.assertTrue(float(second.pmGetArchiveEnd()) <= 1483005000.0)
+
+        shared.release(ARCHIVE)
+        shared.release(ARCHIVE)
+        self.assertRaises(KeyError, shared.get, ARCHIVE)
+
+if __name__ == '__main__':
+    unittest.main()
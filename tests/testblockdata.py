@@ -0,0 +1,105 @@
+import unittest
+import numpy
+from supremm.blockdata import BlockAccumulator, concatenateblocks
+from supremm.statistics import RollingStats
+from supremm.plugin import Plugin
+
+class MockAnalytic(object):
+    def __init__(self):
+        self.args = None
+
+    def process_block(self, nodemeta, timestamps, values, description):
+        self.args = (nodemeta, timestamps, values, description)
+        return True
+
+class TestBlockAccumulator(unittest.TestCase):
+
+    def test_block(self):
+
+        acc = BlockAccumulator("test")
+        acc.process("node", 1.0, [numpy.array([1.0, 2.0])], [[numpy.array([0, 1]), ["cpu0", "cpu1"]]])
+        acc.process("node", 2.0, [numpy.array([3.0])], [[numpy.array([1]), ["cpu1"]]])
+        acc.process("node", 3.0, [numpy.array([4.0, 5.0, 6.0])], [[numpy.array([0, 1, 2]), ["cpu0", "cpu1", "cpu2"]]])
+
+        analytic = MockAnalytic()
+        self.assertTrue(acc.docallback(analytic))
+
+        nodemeta, timestamps, values, description = analytic.args
+
+        self.assertEqual(nodemeta, "node")
+        self.assertTrue(numpy.all(timestamps == numpy.array([1.0, 2.0, 3.0])))
+        self.assertEqual(values[0].shape, (3, 3))
+        self.assertTrue(numpy.all(numpy.ma.getmaskarray(values[0]) == numpy.array([[False, False, True], [True, False, True], [False, False, False]])))
+        self.assertEqual(values[0][2, 2], 6.0)
+        self.assertEqual(values[0][1, 1], 3.0)
+        self.assertEqual(list(description[0][0]), [0, 1, 2])
+        self.assertEqual(description[0][1], ["cpu0", "cpu1", "cpu2"])
+
+    def test_nodata(self):
+        acc = BlockAccumulator("test")
+        analytic = MockAnalytic()
+        self.assertTrue(acc.docallback(analytic))
+        self.assertEqual(analytic.args, None)
+
+    def test_concatenate(self):
+        first = (numpy.array([1.0, 2.0]), [numpy.ma.masked_array([[1.0], [2.0]], [[False], [False]])], [numpy.array([0])])
+        second = (numpy.array([3.0]), [numpy.ma.masked_array([[3.0, 4.0]], [[True, False]])], [numpy.array([0, 7])])
+
+        timestamps, values, instances = concatenateblocks([first, second])
+
+        self.assertTrue(numpy.all(timestamps == numpy.array([1.0, 2.0, 3.0])))
+        self.assertEqual(values[0].shape, (3, 2))
+        self.assertTrue(numpy.all(numpy.ma.getmaskarray(values[0]) == numpy.array([[False, True], [False, True], [True, False]])))
+        self.assertEqual(values[0][2, 1], 4.0)
+        self.assertEqual(list(instances[0]), [0, 7])
+
+class TestRollingStats(unittest.TestCase):
+
+    def test_extend(self):
+        values = numpy.array([3.0, 1.0, 4.0, 1.0, 5.0, 9.0, 2.0, 6.0])
+
+        appended = RollingStats()
+        for val in values:
+            appended.append(val)
+
+        extended = RollingStats()
+        extended.append(values[0])
+        extended.extend(values[1:4])
+        extended.extend(values[4:])
+
+        self.assertEqual(extended.count(), appended.count())
+        self.assertAlmostEqual(extended.mean(), appended.mean())
+        self.assertAlmostEqual(extended.variance(), appended.variance())
+        self.assertEqual(extended.min, appended.min)
+        self.assertEqual(extended.max, appended.max)
+
+class TestPluginApi(unittest.TestCase):
+
+    def test_abstractprocess(self):
+
+        class Base(Plugin):
+            name = property(lambda x: "test")
+            mode = property(lambda x: "all")
+            requiredMetrics = property(lambda x: ["kernel.all.load"])
+            optionalMetrics = property(lambda x: [])
+            derivedMetrics = property(lambda x: [])
+
+            def results(self):
+                return {}
+
+        class BlockPlugin(Base):
+            blockmode = property(lambda x: True)
+
+            def process_block(self, nodemeta, timestamps, values, description):
+                return True
+
+        class SubBlockPlugin(BlockPlugin):
+            pass
+
+        # Plugins must implement process() or process_block()
+        self.assertRaises(TypeError, Base, None)
+        self.assertTrue(BlockPlugin(None).blockmode)
+        self.assertTrue(SubBlockPlugin(None).blockmode)
+
+if __name__ == '__main__':
+    unittest.main()
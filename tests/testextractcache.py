@@ -0,0 +1,74 @@
+import unittest
+import datetime
+import os
+import shutil
+import tempfile
+from supremm.extractcache import ExtractCache
+
+class TestExtractCache(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.cache = ExtractCache(os.path.join(self.workdir, "cache"), 1000)
+        self.begin = datetime.datetime(2016, 1, 1)
+        self.end = datetime.datetime(2016, 1, 2)
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def makearchive(self, name, size):
+        archive = os.path.join(self.workdir, name)
+        for suffix in (".0", ".index", ".meta"):
+            with open(archive + suffix, "w") as fp:
+                fp.write("x" * size)
+        return archive
+
+    def test_fetchstore(self):
+        raw = self.makearchive("raw", 10)
+        key = ExtractCache.fingerprint("node1", [raw], self.begin, self.end)
+
+        self.assertFalse(self.cache.fetch(key, os.path.join(self.workdir, "out")))
+
+        self.cache.store(key, self.makearchive("node1", 100))
+        self.assertTrue(self.cache.fetch(key, os.path.join(self.workdir, "out")))
+        self.assertEqual(os.path.getsize(os.path.join(self.workdir, "out.meta")), 100)
+
+        self.assertNotEqual(key, ExtractCache.fingerprint("node1", [raw], self.begin, self.end, ["kernel.all.load"]))
+        self.assertNotEqual(key, ExtractCache.fingerprint("node2", [raw], self.begin, self.end))
+
+    def test_fingerprintvolumes(self):
+        raw = self.makearchive("raw", 10)
+        key = ExtractCache.fingerprint("node1", [raw], self.begin, self.end)
+
+        # Data appended to a volume
+        with open(raw + ".0", "a") as fp:
+            fp.write("x")
+        appended = ExtractCache.fingerprint("node1", [raw], self.begin, self.end)
+        self.assertNotEqual(key, appended)
+
+        # New volume
+        with open(raw + ".1", "w") as fp:
+            fp.write("x")
+        self.assertNotEqual(appended, ExtractCache.fingerprint("node1", [raw], self.begin, self.end))
+
+    def test_evict(self):
+        self.cache.maxbytes = 1300
+        self.cache.store("first", self.makearchive("node1", 200))
+        self.cache.store("second", self.makearchive("node2", 200))
+        os.utime(os.path.join(self.cache.cachedir, "second"), (0, 0))
+        self.cache.store("third", self.makearchive("node3", 200))
+
+        self.assertEqual(sorted(os.listdir(self.cache.cachedir)), ["first", "third"])
+
+    def test_evictonlimit(self):
+        self.cache.maxbytes = 1300
+        self.cache.store("first", self.makearchive("node1", 200))
+        self.cache.store("second", self.makearchive("node2", 200))
+
+        # The cache is only scanned when the tracked size exceeds the limit
+        self.cache.evict = lambda: self.fail("evict called below the limit")
+        self.cache.store("third", self.makearchive("node3", 10))
+        self.assertEqual(self.cache._size, 1230)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,30 @@
+import unittest
+from supremm.summarize import FusedMetricSet
+
+class TestFusedMetricSet(unittest.TestCase):
+
+    def test_union(self):
+        metricset = FusedMetricSet()
+
+        first = metricset.add("a", [10, 11, 12], [1, 1, 1], None)
+        second = metricset.add("b", [12, 13, 10], [1, 1, 1], None)
+
+        self.assertEqual(metricset.metric_ids, [10, 11, 12, 13])
+        self.assertEqual(first.vsetidx, [0, 1, 2])
+        self.assertEqual(second.vsetidx, [2, 3, 0])
+
+        fetcharray = metricset.fetcharray()
+        self.assertEqual(list(fetcharray), [10, 11, 12, 13])
+
+    def test_active(self):
+        metricset = FusedMetricSet()
+
+        first = metricset.add("a", [10], [1], None)
+        second = metricset.add("b", [11], [1], None)
+
+        first.done = True
+
+        self.assertEqual(metricset.active(), [second])
+
+if __name__ == '__main__':
+    unittest.main()
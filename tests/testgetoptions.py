@@ -10,6 +10,18 @@ class TestGetOptions(unittest.TestCase):
     def setUp(self):
         self.defaults = {
                 'fail_fast': False,
+                'fused_fetch': False,
+                'direct_read': False,
+                'filter_metrics': False,
+                'batch': 0,
+                'incremental': False,
+                'profile': 0.0,
+                'interleave': 0,
+                'schedule_window': 0,
+                'shard_nodes': 0,
+                'daemon': 0,
+                'daemon_delay': 300,
+                'journal': None,
                 'dry_run': False,
                 'dodelete': True,
                 'extractonly': False,
@@ -33,7 +45,11 @@ class TestGetOptions(unittest.TestCase):
                 'resource': None,
                 'tag': None,
                 'dump_proclist': False,
-                'threads': 1
+                'threads': 1,
+                'node_threads': 1,
+                'extract_threads': 1,
+                'prefetch': 0,
+                'prefetch_threads': 1
         }
 
     def helper(self, args, expected):
@@ -164,12 +180,36 @@ class TestGetOptions(unittest.TestCase):
 
         self.helper(['-t', '4'], expected)
 
+    def testsetnodethreads(self):
+        expected = self.defaults.copy()
+        expected['node_threads'] = 8
+
+        self.helper(['--node-threads', '8'], expected)
+
+    def testextractthreads(self):
+        expected = self.defaults.copy()
+        expected['extract_threads'] = 16
+
+        self.helper(['--extract-threads', '16'], expected)
+
     def testdumpprolist(self):
         expected = self.defaults.copy()
         expected['dump_proclist'] = True
 
         self.helper(['--dump-proclist'], expected)
 
+    def testfusedfetch(self):
+        expected = self.defaults.copy()
+        expected['fused_fetch'] = True
+
+        self.helper(['--fused-fetch'], expected)
+
+    def testdirectread(self):
+        expected = self.defaults.copy()
+        expected['direct_read'] = True
+
+        self.helper(['--direct-read'], expected)
+
     def testmaxnodetime(self):
         expected = self.defaults.copy()
         expected['max_nodetime'] = 3455
@@ -0,0 +1,33 @@
+import unittest
+
+from supremm.Job import Job
+
+class TestJob(unittest.TestCase):
+
+    def setUp(self):
+        self.job = Job(1, "1234", {"nodes": 5, "start_time": 1000, "end_time": 2000})
+        self.job.set_nodes(["node{0}".format(x) for x in xrange(5)])
+        self.job.set_rawarchives(dict(("node{0}".format(x), ["archive{0}".format(x)]) for x in xrange(5)))
+
+    def test_shards(self):
+        shards = self.job.shards(2)
+
+        self.assertEqual(len(shards), 3)
+        self.assertEqual([[x for x, _ in y.rawarchives()] for y in shards], [["node0", "node1"], ["node2", "node3"], ["node4"]])
+
+        for shard in shards:
+            self.assertEqual(shard.nodecount, 5)
+            self.assertEqual(shard.job_pk_id, 1)
+
+        shards[1].addnodearchive("node3", "node3.archive")
+        shards[1].mark_bad_rawarchive("node2", "archive2", "bad archive")
+        self.assertEqual([x for x in shards[1].nodearchives()], [("node3", 3, "node3.archive")])
+        self.assertEqual(shards[1].get_errors(), ["bad archive"])
+
+        # The original job is not modified
+        self.assertEqual([x for x in self.job.nodearchives()], [])
+        self.assertEqual(len([x for x in self.job.rawarchives()]), 5)
+        self.assertEqual(self.job.get_errors(), [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import unittest
+
+from supremm.journal import NullJournal
+from supremm.summarize_jobs import JobPoller
+
+class FakeJob(object):
+    def __init__(self, job_pk_id, end_time):
+        self.job_pk_id = job_pk_id
+        self.job_id = str(job_pk_id)
+        self.acct = {"end_time": end_time}
+
+class FakeAccount(object):
+    """ unprocessed jobs in order of end time """
+    def __init__(self, jobs):
+        self.jobs = jobs
+        self.queries = []
+
+    def get(self, start_time, end_time):
+        self.queries.append(start_time)
+        return [x for x in self.jobs if start_time is None or x.acct['end_time'] >= start_time]
+
+class TestJobPoller(unittest.TestCase):
+
+    def setUp(self):
+        self.jobs = [FakeJob(1, 100), FakeJob(2, 200), FakeJob(3, 200), FakeJob(4, 300)]
+        self.account = FakeAccount(self.jobs)
+        self.poller = JobPoller(self.account, 0, NullJournal())
+
+    def test_failed(self):
+        for job in self.poller.track(self.poller.poll()):
+            if job.job_pk_id != 2:
+                self.poller.done(job)
+
+        # Job 2 failed so the next poll starts at its end time
+        self.assertEqual(self.poller.highwater, 200)
+        self.assertEqual([x.job_pk_id for x in self.poller.track(self.poller.poll())], [2])
+        self.assertEqual(self.account.queries, [None, 200])
+
+        self.poller.done(self.jobs[1])
+        self.assertEqual(self.poller.highwater, 300)
+
+    def test_abort(self):
+        polled = self.poller.track(self.poller.poll())
+        self.poller.done(next(polled))
+        next(polled)
+
+        # Job 2 was read ahead and not processed. Job 1 is read again and
+        # skipped since it was completed
+        self.assertEqual(self.poller.highwater, 100)
+        self.assertEqual([x.job_pk_id for x in self.poller.track(self.poller.poll())], [2, 3, 4])
+
+    def test_completed(self):
+        for job in self.poller.track(self.poller.poll()):
+            self.poller.done(job)
+
+        self.assertEqual(self.poller.highwater, 300)
+        self.assertEqual(list(self.poller.poll()), [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import unittest
+import os
+import shutil
+import tempfile
+
+from supremm.journal import Journal
+
+class FakeJob(object):
+    def __init__(self, job_pk_id, end_time):
+        self.job_pk_id = job_pk_id
+        self.job_id = str(job_pk_id)
+        self.acct = {"end_time": end_time}
+
+class TestJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "journal")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_resume(self):
+        jobs = [FakeJob(1, 100), FakeJob(2, 200), FakeJob(3, 200), FakeJob(4, 300)]
+
+        journal = Journal(self.path, flushsize=2)
+        resource = journal.resource(7)
+        tracked = resource.track(jobs)
+
+        for job in [next(tracked), next(tracked), next(tracked)]:
+            if job.job_pk_id != 2:
+                resource.done(job)
+
+        # Job 2 is outstanding so the watermark is its end time
+        self.assertEqual(resource.watermark, 200)
+        journal.close()
+
+        # Partial line from an interrupted write
+        with open(self.path, "a") as fp:
+            fp.write("done 7 4")
+
+        # The query is resumed from the watermark
+        journal = Journal(self.path)
+        resource = journal.resource("7")
+        self.assertEqual(resource.watermark, 200)
+        self.assertEqual([x.job_pk_id for x in resource.track(jobs[1:])], [2, 4])
+
+        self.assertEqual(journal.resource(8).watermark, None)
+
+    def test_watermark(self):
+        journal = Journal(self.path, flushsize=100)
+        resource = journal.resource(1)
+        for job in resource.track([FakeJob(1, 100), FakeJob(2, 150)]):
+            resource.done(job)
+
+        self.assertEqual(resource.watermark, 150)
+        self.assertFalse(os.path.exists(self.path))
+
+        journal.close()
+        with open(self.path, "r") as fp:
+            self.assertEqual(fp.read(), "done 1 1 100\ndone 1 2 150\nwatermark 1 150\n")
+
+    def test_compact(self):
+        journal = Journal(self.path, flushsize=10)
+        resource = journal.resource(1)
+        for job in resource.track([FakeJob(x, 100 * x) for x in xrange(1, 101)]):
+            resource.done(job)
+        journal.close()
+
+        # Only the last job is at the watermark
+        self.assertEqual(resource.watermark, 10000)
+        self.assertEqual(len(resource._completed), 1)
+        with open(self.path, "r") as fp:
+            self.assertLess(len(fp.readlines()), 30)
+
+        journal = Journal(self.path)
+        resource = journal.resource(1)
+        self.assertEqual(resource.watermark, 10000)
+        self.assertEqual([x.job_pk_id for x in resource.track([FakeJob(100, 10000), FakeJob(101, 10100)])], [101])
+        with open(self.path, "r") as fp:
+            self.assertEqual(fp.read(), "watermark 1 10000\ndone 1 100 10000\n")
+
+if __name__ == '__main__':
+    unittest.main()
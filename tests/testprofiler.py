@@ -0,0 +1,66 @@
+import unittest
+import os
+import shutil
+import tempfile
+
+from supremm.profiler import Profile, NullProfile, ProfileReport, archivebytes
+
+class TestProfiler(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_profile(self):
+        first = Profile()
+        start = first.add("CpuUsage", "extract", first.now() - 1.0)
+        first.add("CpuUsage", "process", start)
+        first.add("CpuUsage", "extract", first.now())
+        first.add(None, "fetch", first.now())
+
+        second = Profile()
+        second.add("CpuUsage", "extract", second.now())
+        second.add("MemoryUsage", "fetch", second.now())
+
+        first.merge(second)
+        profile = first.get()
+
+        self.assertEqual(profile['fetches'], 2)
+        self.assertEqual(profile['stages']['extract']['calls'], 3)
+        self.assertEqual(profile['plugins']['CpuUsage']['extract']['calls'], 3)
+        self.assertGreaterEqual(profile['plugins']['CpuUsage']['extract']['time'], 1.0)
+        self.assertEqual(profile['plugins']['CpuUsage']['process']['calls'], 1)
+        self.assertEqual(profile['plugins']['MemoryUsage']['fetch']['calls'], 1)
+        self.assertNotIn(None, profile['plugins'])
+
+        report = ProfileReport()
+        report.add(profile)
+        report.add(profile)
+        report.addstage("output", 0.5)
+        self.assertEqual(report.jobs, 2)
+        self.assertEqual(report.fetches, 4)
+        self.assertEqual(report.plugins[("CpuUsage", "extract")][0], 6)
+        self.assertEqual(report.stages["output"], [1, 0.5])
+
+    def test_nullprofile(self):
+        profile = NullProfile()
+        self.assertEqual(profile.add("CpuUsage", "extract", profile.now()), 0)
+        self.assertEqual(profile.get(), None)
+
+    def test_archivebytes(self):
+        for filename, size in [("archive.meta", 10), ("archive.index", 20), ("archive.0", 30), ("archive.0.xz", 40), ("archive2.0", 50)]:
+            with open(os.path.join(self.tmpdir, filename), "w") as fp:
+                fp.write("x" * size)
+
+        self.assertEqual(archivebytes(os.path.join(self.tmpdir, "archive")), 60)
+        self.assertEqual(archivebytes(os.path.join(self.tmpdir, "archive.index")), 60)
+
+        profile = Profile()
+        profile.addarchive([os.path.join(self.tmpdir, "archive"), os.path.join(self.tmpdir, "archive2")])
+        self.assertEqual(profile.get()['archives'], [{"archive": os.path.join(self.tmpdir, "archive"), "bytes": 60},
+                                                     {"archive": os.path.join(self.tmpdir, "archive2"), "bytes": 50}])
+
+if __name__ == '__main__':
+    unittest.main()
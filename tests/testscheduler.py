@@ -0,0 +1,45 @@
+import unittest
+import os
+import shutil
+import tempfile
+
+from supremm.scheduler import schedule_jobs, estimate_cost
+
+class FakeJob(object):
+    def __init__(self, name, nodecount, walltime, rawarchives):
+        self.name = name
+        self.nodecount = nodecount
+        self.walltime = walltime
+        self._rawarchives = rawarchives
+
+    def rawarchives(self):
+        return self._rawarchives.iteritems()
+
+class TestScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_schedule(self):
+        costs = {"a": 1, "b": 5, "c": 3, "d": 2, "e": 4, "f": 4, "g": 1}
+        order = [x for x in schedule_jobs(["a", "b", "c", "d", "e", "f", "g"], 3, lambda x: costs[x])]
+        self.assertEqual(order, ["b", "c", "a", "e", "f", "d", "g"])
+
+        self.assertEqual([x for x in schedule_jobs([], 3, lambda x: costs[x])], [])
+
+    def test_estimate(self):
+        for filename, size in [("node1.meta", 100), ("node1.0", 900), ("node1.index", 10), ("node2.meta", 300)]:
+            with open(os.path.join(self.tmpdir, filename), "w") as fp:
+                fp.write("x" * size)
+
+        job = FakeJob("job", 2, 3600, {"node1": [os.path.join(self.tmpdir, "node1.index")],
+                                       "node2": [os.path.join(self.tmpdir, "node2"), os.path.join(self.tmpdir, "missing")]})
+
+        self.assertEqual(estimate_cost(job), 2 * 3600 * 650.0)
+        self.assertEqual(estimate_cost(FakeJob("empty", 0, 0, {})), 1.0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+import unittest
+import numpy
+from supremm.subsample import TimeseriesAccumulator, SampleSchedule, TimeBucketStats
+
+class TestTimeseriesAccumulator(unittest.TestCase):
+
+    def test_merge(self):
+
+        first = TimeseriesAccumulator(3, 1000)
+        second = TimeseriesAccumulator(3, 1000)
+
+        for t in xrange(5):
+            first.adddata(0, 10.0 * t, t)
+            second.adddata(2, 10.0 * t, 2 * t)
+
+        first.merge(second)
+
+        self.assertTrue(numpy.all(first.gethost(0)[:, 1] == numpy.arange(5)))
+        self.assertTrue(numpy.all(first.gethost(2)[:, 1] == 2 * numpy.arange(5)))
+        self.assertEqual(len(first.gethost(1)), 0)
+
+    def test_mergeorder(self):
+
+        serial = TimeseriesAccumulator(2, 1000)
+        first = TimeseriesAccumulator(2, 1000)
+        second = TimeseriesAccumulator(2, 1000)
+
+        # The hosts have different sample intervals so the lead-in differs
+        for hostidx, interval in enumerate([1.0, 5.0]):
+            partial = first if hostidx == 0 else second
+            for t in numpy.arange(0.0, 1000.0, interval):
+                serial.adddata(hostidx, t, t)
+                partial.adddata(hostidx, t, t)
+
+        first.merge(second)
+
+        for hostidx in xrange(2):
+            self.assertTrue(numpy.all(first.gethost(hostidx) == serial.gethost(hostidx)))
+
+    def test_schedule(self):
+
+        walltime = 48 * 3600.0
+        timestamps = numpy.arange(0.0, walltime + 1, 30.0)
+
+        full = TimeseriesAccumulator(1, walltime)
+        for t in timestamps:
+            full.adddata(0, t, t)
+
+        sampled = TimeseriesAccumulator(1, walltime)
+        schedule = SampleSchedule(walltime)
+        fetched = 0
+        idx = 0
+        while idx < len(timestamps):
+            fetched += 1
+            sampled.adddata(0, timestamps[idx], timestamps[idx])
+            seekto = schedule.nexttime(timestamps[idx])
+            idx = idx + 1 if seekto == None else numpy.searchsorted(timestamps, seekto)
+
+        self.assertLess(fetched, len(timestamps) / 20)
+        self.assertEqual(len(sampled.gethost(0)), TimeseriesAccumulator.MAX_DATAPOINTS)
+        self.assertTrue(numpy.all(sampled.gethost(0)[:11, 0] == full.gethost(0)[:11, 0]))
+        self.assertTrue(numpy.all(numpy.abs(sampled.gethost(0)[:, 0] - full.gethost(0)[:, 0]) <= 60.0 * numpy.arange(1, 101)))
+
+class TestTimeBucketStats(unittest.TestCase):
+
+    def test_order(self):
+
+        timestamps = numpy.arange(0.0, 1000.0, 10.0)
+
+        # The value for host h increases at rate h + 1
+        interleaved = TimeBucketStats(3, 0.0, 1000.0, 10)
+        for t in timestamps:
+            for hostidx in xrange(3):
+                interleaved.adddata(hostidx, t, (hostidx + 1) * t)
+            # Only the current bucket is waiting for data
+            self.assertLessEqual(interleaved.pending(), 1)
+
+        serial = TimeBucketStats(3, 0.0, 1000.0, 10)
+        for hostidx in [2, 0, 1]:
+            for t in timestamps:
+                serial.adddata(hostidx, t, (hostidx + 1) * t)
+
+        merged = TimeBucketStats(3, 0.0, 1000.0, 10)
+        other = TimeBucketStats(3, 0.0, 1000.0, 10)
+        for t in timestamps:
+            merged.adddata(0, t, t)
+            other.adddata(1, t, 2 * t)
+            other.adddata(2, t, 3 * t)
+        merged.merge(other)
+
+        times, minimum, maximum, median = interleaved.get()
+        self.assertEqual(times, [100.0 * x for x in xrange(1, 11)])
+        self.assertEqual(minimum, [[1.0, 0]] * 10)
+        self.assertEqual(maximum, [[3.0, 2]] * 10)
+        self.assertEqual(median, [[2.0, 1]] * 10)
+        self.assertEqual(serial.get(), (times, minimum, maximum, median))
+        self.assertEqual(merged.get(), (times, minimum, maximum, median))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,12 +1,14 @@
 import unittest
 from mock import patch, Mock
-from supremm.proc_common import summarizejob
+from supremm.proc_common import summarizejob, stale_analytics
 from supremm.config import Config
 from supremm.Job import Job
 from supremm.errors import ProcessingError
+from supremm.pcparchive import getextractmetrics, getextractcmdline, archivemetrics
 
 import logging
 import datetime
+import os
 import tempfile
 
 class TestSummarizeJob(unittest.TestCase):
@@ -21,6 +23,18 @@ class TestSummarizeJob(unittest.TestCase):
 
         self.options = {
                 'fail_fast': False,
+                'fused_fetch': False,
+                'direct_read': False,
+                'filter_metrics': False,
+                'batch': 0,
+                'incremental': False,
+                'profile': 0.0,
+                'interleave': 0,
+                'schedule_window': 0,
+                'shard_nodes': 0,
+                'daemon': 0,
+                'daemon_delay': 300,
+                'journal': None,
                 'dry_run': False,
                 'dodelete': True,
                 'extractonly': False,
@@ -44,7 +58,11 @@ class TestSummarizeJob(unittest.TestCase):
                 'resource': None,
                 'tag': None,
                 'dump_proclist': False,
-                'threads': 1
+                'threads': 1,
+                'node_threads': 1,
+                'extract_threads': 1,
+                'prefetch': 0,
+                'prefetch_threads': 1
         }
 
         confjob = {
@@ -187,6 +205,59 @@ class TestSummarizeJob(unittest.TestCase):
 
         self.verify_errors(ProcessingError.PMLOGEXTRACT_ERROR, 'skipped_pmlogextract_error', error, mdata)
 
+    def test_extractmetrics(self):
+
+        analytic = Mock(requiredMetrics=[["kernel.all.load"], ["kernel.all.cpu.user", "kernel.all.cpu.sys"]],
+                        optionalMetrics=["hinv.ncpu"],
+                        derivedMetrics=[{'name': 'mem.used', 'formula': 'mem.util.used - mem.util.cached'}])
+        preproc = Mock(requiredMetrics=["kernel.all.load", "hinv.map.cpu_node"], optionalMetrics=[], derivedMetrics=[])
+
+        self.assertEqual(getextractmetrics([analytic, preproc]),
+                         ["hinv.map.cpu_node", "hinv.ncpu", "kernel.all.cpu.sys", "kernel.all.cpu.user", "kernel.all.load", "mem.util.cached", "mem.util.used"])
+
+        cmdline = getextractcmdline(datetime.datetime(2016, 1, 1), datetime.datetime(2016, 1, 2), ['archive1'], 'out', 'metrics.config')
+        self.assertEqual(cmdline[5:], ['-c', 'metrics.config', 'archive1', 'out'])
+
+    def test_archivemetrics(self):
+        archive = os.path.join(os.path.dirname(os.path.abspath(__file__)), "integration_tests", "pcp_logs_extracted", "20161229.00.10")
+
+        # Metrics that are not in the archive are not put in the pmlogextract config
+        self.assertEqual(archivemetrics([archive], ["gpfs.fsios", "hinv.ncpu", "nosuch.metric"]), ["gpfs.fsios", "hinv.ncpu"])
+        self.assertEqual(archivemetrics([archive + "-missing"], ["hinv.ncpu"]), None)
+
+    def test_staleanalytics(self):
+
+        def analytic(classname, name, version, preprocs=None):
+            instance = Mock(version=version, requiredPreprocessors=preprocs or [])
+            instance.name = name
+            cls = Mock(return_value=instance)
+            cls.__name__ = classname
+            return cls
+
+        perf = analytic("PerfPreproc", "perf", 2)
+        hinv = analytic("HardwareInventory", "hinv", 1)
+        cpuperf = analytic("CpuPerfCounters", "cpuperf", 1, ["perf"])
+        load1 = analytic("Load1", "load1", 1, ["hinv"])
+        memory = analytic("MemoryUsage", "memory", 3)
+        network = analytic("Network", "network", 1)
+        # Same name as the summary plugin
+        networkts = analytic("NetworkTimeseries", "network", 2)
+
+        allplugins = [cpuperf, load1, memory, network, networkts]
+        versions = {"PerfPreproc": 1, "HardwareInventory": 1, "CpuPerfCounters": 1, "Load1": 1,
+                    "MemoryUsage": 2, "Network": 1, "NetworkTimeseries": 1}
+
+        preprocs, plugins = stale_analytics(self.mockjob, [perf, hinv], allplugins, versions)
+        self.assertEqual(preprocs, [perf])
+        self.assertEqual(plugins, [cpuperf, memory, networkts])
+
+        versions.update({"PerfPreproc": 2, "MemoryUsage": 3, "NetworkTimeseries": 2})
+        self.assertEqual(stale_analytics(self.mockjob, [perf, hinv], allplugins, versions), ([], []))
+
+        preprocs, plugins = stale_analytics(self.mockjob, [perf, hinv], allplugins, {})
+        self.assertEqual(preprocs, [perf, hinv])
+        self.assertEqual(plugins, allplugins)
+
 
 if __name__ == '__main__':
     unittest.main()